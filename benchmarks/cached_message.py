@@ -0,0 +1,115 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Compare how much memory a cached message costs as a full ``novus.Message``
+versus as a ``CachedMessage`` snapshot.
+Run from the repository root with ``python -m benchmarks.cached_message``.
+"""
+
+from __future__ import annotations
+
+import gc
+import random
+import string
+import tracemalloc
+from typing import Any, Callable
+
+import novus
+
+from utils.cached_message import CachedMessage
+
+
+COUNT = 5_000
+AUTHORS = [
+    {
+        "id": str(100_000_000_000_000_000 + i),
+        "username": f"user{i}",
+        "discriminator": "0",
+        "global_name": f"User {i}",
+        "avatar": "".join(random.choices(string.hexdigits.lower(), k=32)),
+    }
+    for i in range(50)
+]
+
+
+def make_payload(index: int) -> dict[str, Any]:
+    """
+    Make a message payload like one the gateway would send. Members are
+    left out so that the novus numbers are, if anything, on the low side.
+    """
+
+    message_id = (1_100_000_000_000_000_000 + index) << 1
+    attachments = []
+    if index % 10 == 0:
+        attachments.append({
+            "id": str(message_id + 1),
+            "filename": f"image{index}.png",
+            "size": 1234,
+            "url": f"https://cdn.discordapp.com/attachments/1/{message_id}/image{index}.png",
+            "proxy_url": f"https://media.discordapp.net/attachments/1/{message_id}/image{index}.png",
+        })
+    return {
+        "id": str(message_id),
+        "channel_id": "1000000000000000000",
+        "guild_id": "1000000000000000001",
+        "author": AUTHORS[index % len(AUTHORS)],
+        "content": "".join(random.choices(string.ascii_letters + " ", k=random.randrange(10, 200))),
+        "timestamp": "2024-01-01T00:00:00.000000+00:00",
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": attachments,
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+    }
+
+
+def measure(build: Callable[[dict[str, Any]], object]) -> float:
+    """
+    Build ``COUNT`` messages, keep them all alive, and return the number of
+    bytes each one is still holding on to once its payload is gone.
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    kept = [build(make_payload(i)) for i in range(COUNT)]
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(kept) == COUNT
+    return (after - before) / COUNT
+
+
+def main() -> None:
+    state = novus.api.HTTPConnection("")
+    full = measure(lambda data: novus.Message(state=state, data=data))
+    state = novus.api.HTTPConnection("")
+    snapshot = measure(
+        lambda data: CachedMessage.from_message(
+            novus.Message(state=state, data=data),
+        )
+    )
+    print(f"novus.Message  {full:>10,.0f} bytes/message")
+    print(f"CachedMessage  {snapshot:>10,.0f} bytes/message")
+    print(f"reduction      {full / snapshot:>10,.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Compare the old list-backed message cache against the ring buffer cache.
+Run from the repository root with ``python -m benchmarks.message_cache``.
+"""
+
+from __future__ import annotations
+
+import random
+import time
+from typing import Callable
+
+from utils.message_cache import ChannelMessageCache
+from utils.message_queuer import MaxLenList
+
+
+class FakeMessage:
+
+    __slots__ = ("id",)
+
+    def __init__(self, id: int):
+        self.id = id
+
+
+def list_get(cache: MaxLenList[FakeMessage], message_id: int) -> FakeMessage | None:
+    """
+    The lookup that ``MessageHandler.try_get_message`` used to do.
+    """
+
+    for i in cache:
+        if i.id == message_id:
+            return i
+    return None
+
+
+def ops_per_second(func: Callable[[int], object], ops: int) -> float:
+    """
+    Run a function ``ops`` times and return how many calls it managed per
+    second.
+    """
+
+    start = time.perf_counter()
+    for i in range(ops):
+        func(i)
+    return ops / (time.perf_counter() - start)
+
+
+def run(size: int) -> None:
+    """
+    Benchmark both caches when they're full with ``size`` messages.
+    """
+
+    old: MaxLenList[FakeMessage] = MaxLenList(size)
+    new: ChannelMessageCache[FakeMessage] = ChannelMessageCache(size)
+    for i in range(size):
+        old.append(FakeMessage(i))
+        new.append(FakeMessage(i))
+    lookups = [random.randrange(size, size * 2) for _ in range(1_000)]
+    next_id = size * 2
+
+    def old_append(i: int) -> None:
+        old.append(FakeMessage(next_id + i))
+
+    def new_append(i: int) -> None:
+        new.append(FakeMessage(next_id + i))
+
+    results = [
+        ("append", ops_per_second(old_append, size), ops_per_second(new_append, size)),
+        (
+            "get",
+            ops_per_second(lambda i: list_get(old, lookups[i % 1_000]), 1_000),
+            ops_per_second(lambda i: new.get(lookups[i % 1_000]), 100_000),
+        ),
+        (
+            "latest(100)",
+            ops_per_second(lambda i: old[-100:], 10_000),
+            ops_per_second(lambda i: new.latest(100), 10_000),
+        ),
+    ]
+    for name, old_ops, new_ops in results:
+        print(
+            f"{size:>7,} {name:<12} "
+            f"list {old_ops:>14,.0f} ops/s  "
+            f"ring {new_ops:>14,.0f} ops/s  "
+            f"({new_ops / old_ops:,.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    for size in (5_000, 50_000):
+        run(size)
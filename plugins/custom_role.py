@@ -21,6 +21,8 @@ import novus as n
 from novus import types as t
 from novus.ext import client, database as db
 
+from utils import guild_settings, rest_scheduler
+
 
 class CustomRole(client.Plugin):
 
@@ -49,10 +51,13 @@ class CustomRole(client.Plugin):
             # User already has the role
             return -1
         try:
-            await guild.add_member_role(
-                user.id,
-                role_id,
-                reason="User custom role.",
+            await rest_scheduler.call(
+                guild.add_member_role(
+                    user.id,
+                    role_id,
+                    reason="User custom role.",
+                ),
+                route=f"guilds/{guild.id}/members",
             )
         except n.NotFound:
             # Role doesn't exist
@@ -75,19 +80,8 @@ class CustomRole(client.Plugin):
 
         # Get relevant db data
         await ctx.defer(ephemeral=True)
+        settings = await guild_settings.get(ctx.guild.id)
         async with db.Database.acquire() as conn:
-            row: dict[str, int] | None = await conn.fetchrow(
-                """
-                SELECT
-                    custom_role_allowed_role_id,
-                    custom_role_beneath_role_id
-                FROM
-                    guild_settings
-                WHERE
-                    guild_id = $1
-                """,
-                ctx.guild.id,
-            )
             existing_custom_role_id: int | None = await conn.fetchval(
                 """
                 SELECT
@@ -104,13 +98,13 @@ class CustomRole(client.Plugin):
         assert isinstance(ctx.user, n.GuildMember), "User should be a GuildMember"
 
         # See if they have the required role to use this command
-        if row is None or row["custom_role_allowed_role_id"] is None:
+        if settings.custom_role_allowed_role_id is None:
             await ctx.send(
                 "Custom role settings have not been set up on this server.",
                 ephemeral=True,
             )
             return
-        if (req_role_id := row["custom_role_allowed_role_id"]) not in ctx.user.role_ids:
+        if (req_role_id := settings.custom_role_allowed_role_id) not in ctx.user.role_ids:
             await ctx.send(
                 f"You need to have the <@&{req_role_id}> role to create a custom role.",
                 ephemeral=True,
@@ -134,18 +128,24 @@ class CustomRole(client.Plugin):
                 return
 
         # Create role and move into place
-        if (ben_role_id := row["custom_role_beneath_role_id"]) is None:
+        if (ben_role_id := settings.custom_role_beneath_role_id) is None:
             await ctx.send(
                 "Custom role settings have not been set up on this server.",
                 ephemeral=True,
             )
             return
-        created_role = await ctx.guild.create_role(
-            name=f"User custom role @ {ctx.user.id}",
-            reason="User custom role.",
-            permissions=n.Permissions.none(),
+        created_role = await rest_scheduler.call(
+            ctx.guild.create_role(
+                name=f"User custom role @ {ctx.user.id}",
+                reason="User custom role.",
+                permissions=n.Permissions.none(),
+            ),
+            route=f"guilds/{ctx.guild.id}/roles",
+        )
+        guild_roles = await rest_scheduler.call(
+            ctx.guild.fetch_roles(),
+            route=f"guilds/{ctx.guild.id}/roles",
         )
-        guild_roles = await ctx.guild.fetch_roles()
         guild_roles = sorted(guild_roles, key=lambda r: (r.position, r.id))
         new_guild_roles = []
         added_new = False
@@ -154,7 +154,10 @@ class CustomRole(client.Plugin):
                 new_guild_roles.append((created_role.id, idx))
                 added_new = True
             new_guild_roles.append((i.id, idx + (1 if added_new else 0)))
-        await ctx.guild.move_roles(new_guild_roles)
+        await rest_scheduler.call(
+            ctx.guild.move_roles(new_guild_roles),
+            route=f"guilds/{ctx.guild.id}/roles",
+        )
 
         # Save role ID in the database
         async with db.Database.acquire() as conn:
@@ -181,10 +184,13 @@ class CustomRole(client.Plugin):
             )
 
         # Assign the role to the user
-        await ctx.guild.add_member_role(
-            ctx.user.id,
-            created_role.id,
-            reason="User custom role.",
+        await rest_scheduler.call(
+            ctx.guild.add_member_role(
+                ctx.user.id,
+                created_role.id,
+                reason="User custom role.",
+            ),
+            route=f"guilds/{ctx.guild.id}/members",
         )
 
         # And done
@@ -224,9 +230,12 @@ class CustomRole(client.Plugin):
 
             # Delete the role and remove from database
             try:
-                await ctx.guild.delete_role(
-                    custom_role_id,
-                    reason="User custom role deletion.",
+                await rest_scheduler.call(
+                    ctx.guild.delete_role(
+                        custom_role_id,
+                        reason="User custom role deletion.",
+                    ),
+                    route=f"guilds/{ctx.guild.id}/roles",
                 )
             except n.NotFound:
                 pass
@@ -310,10 +319,13 @@ class CustomRole(client.Plugin):
 
         # Edit the role's name
         try:
-            await ctx.guild.edit_role(
-                custom_role_id,
-                name=name,
-                reason="User custom role name change.",
+            await rest_scheduler.call(
+                ctx.guild.edit_role(
+                    custom_role_id,
+                    name=name,
+                    reason="User custom role name change.",
+                ),
+                route=f"guilds/{ctx.guild.id}/roles",
             )
         except n.NotFound:
             await ctx.send(
@@ -406,10 +418,13 @@ class CustomRole(client.Plugin):
 
         # Edit the role's colour
         try:
-            await ctx.guild.edit_role(
-                custom_role_id,
-                color=colour_int,
-                reason="User custom role colour change.",
+            await rest_scheduler.call(
+                ctx.guild.edit_role(
+                    custom_role_id,
+                    color=colour_int,
+                    reason="User custom role colour change.",
+                ),
+                route=f"guilds/{ctx.guild.id}/roles",
             )
         except n.NotFound:
             await ctx.send(
@@ -129,7 +129,10 @@ class MeowChat(client.Plugin):
 
         if not any(self.match(pattern, message.content) for pattern in self.MEOW_KEYWORDS):
             try:
-                await message.delete(reason="Meow chat enabled; invalid message.")
+                await u.rest_scheduler.call(
+                    message.delete(reason="Meow chat enabled; invalid message."),
+                    route=f"channels/{message.channel.id}/messages",
+                )
                 should_give_pointer = False
                 now = n.utils.utcnow()
                 last_pointer_time = self.LAST_MEOW_POINTER.get(message.channel.id)
@@ -137,16 +140,24 @@ class MeowChat(client.Plugin):
                     should_give_pointer = True
                     self.LAST_MEOW_POINTER[message.channel.id] = now
                 if should_give_pointer:
-                    m = await message.channel.send(
-                        f"Hey {message.author.mention} meow chat is turned on for this channel! "
-                        f"Meowing is mandatory :3"
+                    m = await u.rest_scheduler.call(
+                        message.channel.send(
+                            f"Hey {message.author.mention} meow chat is turned on for this channel! "
+                            f"Meowing is mandatory :3"
+                        ),
+                        priority=u.Priority.LOW,
+                        route=f"channels/{message.channel.id}/messages",
                     )
                     await asyncio.sleep(5)
                     try:
-                        await m.delete()
+                        await u.rest_scheduler.call(
+                            m.delete(),
+                            priority=u.Priority.LOW,
+                            route=f"channels/{message.channel.id}/messages",
+                        )
                     except Exception:
                         pass
-            except (n.Forbidden, n.NotFound):
+            except (n.Forbidden, n.NotFound, u.RequestDropped):
                 pass
             except Exception as e:
                 self.log.exception(
@@ -215,7 +226,10 @@ class MeowChat(client.Plugin):
         while n.utils.utcnow() < time:
             await asyncio.sleep(0.5)
         self.MEOW_CHATS.discard(channel.id)
-        await channel.send("Meow chat has been automatically disabled :3")
+        await u.rest_scheduler.call(
+            channel.send("Meow chat has been automatically disabled :3"),
+            route=f"channels/{channel.id}/messages",
+        )
         self.MEOW_TIMEOUT_TASKS.pop(channel.id, None)
 
     @client.command(
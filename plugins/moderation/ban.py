@@ -23,7 +23,7 @@ from typing import cast
 import novus as n
 from novus.ext import client, database as db
 
-from utils import Action, ActionType, create_chat_log,  get_datetime_until
+from utils import Action, ActionType, Priority, create_chat_log,  get_datetime_until, rest_scheduler
 
 
 class Ban(client.Plugin):
@@ -71,8 +71,7 @@ class Ban(client.Plugin):
         """
 
         await interaction.defer()
-        async with db.Database.acquire() as conn:
-            log_id = await create_chat_log(conn, interaction.channel)
+        log_id = await create_chat_log(interaction.channel)
 
         # Get duration
         future: dt | None = None
@@ -82,10 +81,14 @@ class Ban(client.Plugin):
             except OverflowError:
                 future = None
         try:
-            await interaction.guild.ban(
-                user,
-                delete_message_seconds=int(delete_days * (24 * 60 * 60)),
-                reason=reason,
+            await rest_scheduler.call(
+                interaction.guild.ban(
+                    user,
+                    delete_message_seconds=int(delete_days * (24 * 60 * 60)),
+                    reason=reason,
+                ),
+                priority=Priority.MODERATION,
+                route=f"guilds/{interaction.guild.id}/bans",
             )
         except n.Unauthorized:
             await interaction.send(
@@ -95,41 +98,15 @@ class Ban(client.Plugin):
 
         # Create an action for the infraction
         assert interaction.guild
-        async with db.Database.acquire() as conn:
-            await Action.create(
-                conn,
-                guild_id=interaction.guild.id,
-                user_id=user.id,
-                action_type=ActionType.BAN,
-                reason=reason,
-                moderator_id=interaction.user.id,
-                log_id=log_id
-            )
-            if future is not None:
-                await conn.execute(
-                    """
-                    INSERT INTO
-                        temporary_bans
-                        (
-                            guild_id,
-                            user_id,
-                            expiry_time
-                        )
-                    VALUES
-                        (
-                            $1,
-                            $2,
-                            $3
-                        )
-                    ON CONFLICT (guild_id, user_id)
-                    DO UPDATE
-                    SET
-                        expiry_time = excluded.expiry_time
-                    """,
-                    interaction.guild.id,
-                    user.id,
-                    future.naive,
-                )
+        await Action.create(
+            guild_id=interaction.guild.id,
+            user_id=user.id,
+            action_type=ActionType.BAN,
+            reason=reason,
+            moderator_id=interaction.user.id,
+            log_id=log_id,
+            temporary_ban_until=future,
+        )
         if future:
             await interaction.send(f"**{user.mention}** has been banned until {future.mention}.")
         else:
@@ -162,14 +139,12 @@ class Ban(client.Plugin):
         await interaction.defer()
 
         assert interaction.guild
-        async with db.Database.acquire() as conn:
-            await Action.create(
-                conn,
-                guild_id=interaction.guild.id,
-                user_id=user_id_int,
-                action_type=ActionType.UNBAN,
-                moderator_id=interaction.user.id,
-            )
+        await Action.create(
+            guild_id=interaction.guild.id,
+            user_id=user_id_int,
+            action_type=ActionType.UNBAN,
+            moderator_id=interaction.user.id,
+        )
 
         fake_guild = n.Object(interaction.guild.id, state=self.bot.state)
         success = await self.try_unban(fake_guild, user_id_int)
@@ -238,10 +213,14 @@ class Ban(client.Plugin):
         """
 
         try:
-            await n.Guild.unban(
-                guild,
-                user_id,
-                reason="Temporary ban has expired.",
+            await rest_scheduler.call(
+                n.Guild.unban(
+                    guild,
+                    user_id,
+                    reason="Temporary ban has expired.",
+                ),
+                priority=Priority.MODERATION,
+                route=f"guilds/{guild.id}/bans",
             )
         except n.Forbidden:
             self.log.info(
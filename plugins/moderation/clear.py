@@ -17,10 +17,12 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
 
+import time
+
 import novus
 from novus.ext import client
 
-from utils import delete_messages
+from utils import DeleteResult, delete_messages
 
 
 class Clear(client.Plugin):
@@ -61,9 +63,33 @@ class Clear(client.Plugin):
         """
 
         await ctx.defer(ephemeral=True)
-        await delete_messages(ctx.channel, user, num_messages, reason)
-        content = "Cleared last {} messages".format(num_messages)
+
+        # Keep the user updated, but without editing on every request
+        last_update = time.monotonic()
+
+        async def on_progress(progress: DeleteResult) -> None:
+            nonlocal last_update
+            if time.monotonic() - last_update < 2:
+                return
+            last_update = time.monotonic()
+            await ctx.edit_original(
+                content="Clearing messages... ({}/{})".format(
+                    progress.deleted,
+                    progress.found,
+                ),
+            )
+
+        result = await delete_messages(
+            ctx.channel,
+            user,
+            int(num_messages),
+            reason,
+            on_progress=on_progress,
+        )
+        content = "Cleared last {} messages".format(result.deleted)
         if user:
             content += " from **{}**".format(user.mention)
         content += "."
+        if result.failed:
+            content += " {} messages couldn't be deleted.".format(result.failed)
         await ctx.send(content, ephemeral=True)
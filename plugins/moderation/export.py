@@ -0,0 +1,234 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+from datetime import datetime as dt
+from typing import Any, AsyncIterator
+
+import asyncpg
+import novus
+from novus.ext import client
+
+from utils import ExportFormat, export_query, export_records, iter_chat_log_archive
+
+
+# Discord's upload limit for bots in servers without boosts
+DEFAULT_UPLOAD_LIMIT = 10 * 1024 * 1024
+
+LOG_COLUMNS = (
+    "log_id",
+    "log_timestamp",
+    "message_id",
+    "author_id",
+    "author_name",
+    "message_content",
+)
+
+
+async def archived_log_messages(
+        conn: asyncpg.Connection,
+        guild_id: int) -> AsyncIterator[dict[str, Any]]:
+    """
+    Yield every message in the guild's compressed chat logs, one log at a
+    time.
+    """
+
+    cursor = conn.cursor(
+        """
+        SELECT
+            log_id,
+            timestamp,
+            data
+        FROM
+            chat_log_archives
+        WHERE
+            log_id IN (
+                SELECT
+                    log_id
+                FROM
+                    actions
+                WHERE
+                    guild_id = $1
+                    AND log_id IS NOT NULL
+            )
+        """,
+        guild_id,
+        prefetch=10,
+    )
+    async for row in cursor:
+        for message in iter_chat_log_archive(row["data"]):
+            yield {
+                "log_id": row["log_id"],
+                "log_timestamp": row["timestamp"],
+                **message,
+            }
+
+
+class Export(client.Plugin):
+
+    @client.command(
+        name="export",
+        options=[
+            novus.ApplicationCommandOption(
+                name="format",
+                type=novus.ApplicationOptionType.STRING,
+                description="The format of the exported files.",
+                choices=[
+                    novus.ApplicationCommandChoice(name="CSV", value="csv"),
+                    novus.ApplicationCommandChoice(name="NDJSON", value="ndjson"),
+                ],
+                required=False,
+            ),
+        ],
+        default_member_permissions=novus.Permissions(manage_guild=True),
+        dm_permission=False,
+    )
+    async def export(
+            self,
+            interaction: novus.types.CommandI,
+            format: ExportFormat = "csv") -> None:
+        """
+        Export the guild's full moderation history and the chat logs
+        attached to it.
+        """
+
+        await interaction.defer(ephemeral=True)
+        assert interaction.guild
+        guild_id = interaction.guild.id
+        export_path: str | None = getattr(self.bot.config, "export_path", None)
+        directory = export_path or tempfile.mkdtemp(prefix="voxelmod-export-")
+        os.makedirs(directory, exist_ok=True)
+        stamp = f"{dt.utcnow():%Y%m%d%H%M%S}"
+        actions_path = os.path.join(directory, f"{guild_id}-actions-{stamp}.{format}.gz")
+        logs_path = os.path.join(directory, f"{guild_id}-chat-logs-{stamp}.{format}.gz")
+
+        # Exports can take a while, so use their own connection rather than
+        # holding one from the pool
+        conn: asyncpg.Connection = await asyncpg.connect(self.bot.config.database_dsn)
+        try:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                action_count = await export_query(
+                    conn,
+                    """
+                    SELECT
+                        id,
+                        user_id,
+                        action_type,
+                        reason,
+                        moderator_id,
+                        log_id,
+                        timestamp
+                    FROM
+                        actions
+                    WHERE
+                        guild_id = $1
+                    ORDER BY
+                        timestamp,
+                        id
+                    """,
+                    guild_id,
+                    path=actions_path,
+                    format=format,
+                )
+                message_count = await export_query(
+                    conn,
+                    """
+                    SELECT
+                        chat_logs.log_id,
+                        chat_logs.timestamp AS log_timestamp,
+                        logged_messages.message_id,
+                        logged_messages.author_id,
+                        logged_messages.author_name,
+                        logged_messages.message_content
+                    FROM
+                        chat_logs
+                    CROSS JOIN
+                        UNNEST(chat_logs.message_ids, chat_logs.content_hashes)
+                        AS log_message (message_id, content_hash)
+                    JOIN
+                        logged_messages
+                    ON
+                        logged_messages.message_id = log_message.message_id
+                        AND logged_messages.content_hash = log_message.content_hash
+                    WHERE
+                        chat_logs.log_id IN (
+                            SELECT
+                                log_id
+                            FROM
+                                actions
+                            WHERE
+                                guild_id = $1
+                                AND log_id IS NOT NULL
+                        )
+                    """,
+                    guild_id,
+                    path=logs_path,
+                    format=format,
+                )
+                message_count += await export_records(
+                    archived_log_messages(conn, guild_id),
+                    logs_path,
+                    format,
+                    columns=LOG_COLUMNS,
+                )
+        except Exception:
+            if not export_path:
+                shutil.rmtree(directory, ignore_errors=True)
+            raise
+        finally:
+            await conn.close()
+
+        summary = (
+            f"Exported **{action_count:,}** actions and "
+            f"**{message_count:,}** logged messages."
+        )
+
+        # Leave the files where they are if we have somewhere to put them
+        if export_path:
+            return await interaction.send(
+                f"{summary} The files have been saved as `{actions_path}` and `{logs_path}`.",
+                ephemeral=True,
+            )
+
+        # Otherwise upload them
+        try:
+            upload_limit = getattr(self.bot.config, "export_upload_limit", DEFAULT_UPLOAD_LIMIT)
+            size = os.path.getsize(actions_path) + os.path.getsize(logs_path)
+            if size > upload_limit:
+                return await interaction.send(
+                    (
+                        f"{summary} The export is too large to upload "
+                        f"({size / 1024 / 1024:,.1f} MB); ask the bot owner "
+                        f"to set an export path."
+                    ),
+                    ephemeral=True,
+                )
+            with open(actions_path, "rb") as actions_file, open(logs_path, "rb") as logs_file:
+                await interaction.send(
+                    summary,
+                    files=[
+                        novus.File(actions_file, os.path.basename(actions_path)),
+                        novus.File(logs_file, os.path.basename(logs_path)),
+                    ],
+                    ephemeral=True,
+                )
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
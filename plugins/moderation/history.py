@@ -17,23 +17,42 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
 
+from datetime import datetime as dt, timedelta
+from typing import Any
+import uuid
+
 import novus
 from novus.ext import client, database as db
 
-from utils import create_chat_log
+from utils import ActionSummary, guild_settings, history_cache
+
+
+# Action timestamps are naive UTC
+EPOCH = dt(1970, 1, 1)
 
 
 class History(client.Plugin):
 
-    @client.event.filtered_component(r"P_HIST \d+ \d+")
+    @client.event.filtered_component(r"P_HIST \d+ .+")
     async def history_paginator(self, ctx: novus.types.ComponentI):
         """
         Handle a paginator button being clicked.
         """
 
-        user_id = int(ctx.data.custom_id.split(" ")[1])
-        offset = int(ctx.data.custom_id.split(" ")[2])
-        await self.get_user_history(ctx, user_id, offset)
+        _, user_id, *cursor = ctx.data.custom_id.split(" ")
+        if len(cursor) != 3:
+            # A button from before cursors were used - start again
+            return await self.get_user_history(ctx, int(user_id))
+        direction, timestamp, action_id = cursor
+        await self.get_user_history(
+            ctx,
+            int(user_id),
+            (
+                EPOCH + timedelta(microseconds=int(timestamp)),
+                uuid.UUID(action_id),
+            ),
+            older=direction == "n",
+        )
 
     @client.command(
         name="history",
@@ -59,38 +78,35 @@ class History(client.Plugin):
             self,
             ctx: novus.types.CommandI | novus.Interaction[novus.MessageComponentData],
             user_id: int,
-            offset: int = 0) -> None:
+            cursor: tuple[dt, uuid.UUID] | None = None,
+            *,
+            older: bool = True) -> None:
         """
         Get the history for the user.
+
+        Parameters
+        ----------
+        ctx
+            The interaction to respond to.
+        user_id : int
+            The ID of the user to get the history of.
+        cursor : tuple[dt, uuid.UUID] | None
+            The timestamp and ID of the action to page from. If not given,
+            the most recent actions are shown.
+        older : bool
+            Whether to show the actions older than the cursor, rather than
+            the ones newer than it.
         """
 
         await ctx.defer_update()
 
         # Get the actions
         assert ctx.guild
-        async with db.Database.acquire() as conn:
-            rows = await conn.fetch(
-                """
-                SELECT
-                    id,
-                    action_type,
-                    reason,
-                    moderator_id,
-                    timestamp
-                FROM
-                    actions
-                WHERE
-                    user_id = $1
-                    AND guild_id = $2
-                ORDER BY
-                    timestamp DESC
-                LIMIT 6
-                OFFSET $3
-                """,
-                user_id,
-                ctx.guild.id,
-                offset,
-            )
+        rows, summary = await self.fetch_page(ctx.guild.id, user_id, cursor, older=older)
+        if not rows and cursor is not None:
+            # Whatever was on the other side of the cursor has gone
+            cursor, older = None, True
+            rows, summary = await self.fetch_page(ctx.guild.id, user_id, None)
         if not rows:
             return await ctx.send(
                 (
@@ -101,8 +117,17 @@ class History(client.Plugin):
                 allowed_mentions=novus.AllowedMentions.none(),
             )
 
+        # Work out which pages exist either side of this one
+        has_more = len(rows) > 5
+        rows = rows[:5]
+        if older:
+            has_newer, has_older = cursor is not None, has_more
+        else:
+            rows.reverse()
+            has_newer, has_older = has_more, True
+
         # Make into an embed
-        embed = novus.Embed()
+        embed = novus.Embed(description=f"<@{user_id}> has {summary}.")
         for r in rows:
             timestamp = r["timestamp"]
             relative = novus.utils.format_timestamp(timestamp, "R")
@@ -116,16 +141,16 @@ class History(client.Plugin):
         buttons = [
             novus.Button(
                 label="\N{LEFTWARDS ARROW}",
-                custom_id=f"P_HIST {user_id} {offset - 5}",
+                custom_id=self.page_custom_id(user_id, "p", rows[0]),
             ),
             novus.Button(
                 label="\N{RIGHTWARDS ARROW}",
-                custom_id=f"P_HIST {user_id} {offset + 5}"
+                custom_id=self.page_custom_id(user_id, "n", rows[-1]),
             ),
         ]
-        if offset == 0:
+        if not has_newer:
             buttons[0].disabled = True
-        if len(rows) <= 5:
+        if not has_older:
             buttons[-1].disabled = True
 
         # Send message
@@ -137,21 +162,300 @@ class History(client.Plugin):
             components=components,
         )
 
-    # @client.command(name="logs")
-    # async def logs(self, ctx: novus.types.CommandI) -> None:
-    #     """
-    #     Create and store a chat log.
-    #     """
+    async def oldest_visible(self, guild_id: int) -> dt:
+        """
+        Get the time of the oldest action that a guild keeps, so that
+        anything older can be hidden until its partition is removed.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild.
+
+        Returns
+        -------
+        dt
+            The oldest visible time, as naive UTC.
+        """
 
-    #     await ctx.defer()
-    #     async with db.Database.acquire() as conn:
-    #         log_id = await create_chat_log(conn, ctx.channel)
+        settings = await guild_settings.get(guild_id)
+        retention_days = settings.action_retention_days or getattr(self.bot.config, "action_retention_days", None)
+        if not retention_days:
+            return dt.min
+        return dt.utcnow() - timedelta(days=retention_days)
 
-    #     # TODO website stuff
+    async def fetch_page(
+            self,
+            guild_id: int,
+            user_id: int,
+            cursor: tuple[dt, uuid.UUID] | None,
+            *,
+            older: bool = True) -> tuple[list[Any], ActionSummary]:
+        """
+        Get a page of a user's history, along with their action summary.
+        One more action than is shown is fetched, so that we know if
+        there's another page. Pages are cached until the user's next action.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild.
+        user_id : int
+            The ID of the user.
+        cursor : tuple[dt, uuid.UUID] | None
+            The timestamp and ID of the action to page from.
+        older : bool
+            Whether to get the actions older than the cursor, rather than
+            the ones newer than it.
+
+        Returns
+        -------
+        tuple[list[Any], ActionSummary]
+            Up to six action rows, nearest to the cursor first, and the
+            user's summary.
+        """
+
+        page_key = (cursor, older)
+        page = history_cache.get(guild_id, user_id, page_key)
+        if page is None:
+            version = history_cache.version(guild_id, user_id)
+            oldest = await self.oldest_visible(guild_id)
+            async with db.Database.acquire() as conn:
+                if cursor is None:
+                    rows = await conn.fetch(
+                        """
+                        SELECT
+                            id,
+                            action_type,
+                            reason,
+                            moderator_id,
+                            timestamp
+                        FROM
+                            actions
+                        WHERE
+                            guild_id = $1
+                            AND user_id = $2
+                            AND timestamp >= $3
+                        ORDER BY
+                            timestamp DESC,
+                            id DESC
+                        LIMIT 6
+                        """,
+                        guild_id,
+                        user_id,
+                        oldest,
+                    )
+                elif older:
+                    rows = await conn.fetch(
+                        """
+                        SELECT
+                            id,
+                            action_type,
+                            reason,
+                            moderator_id,
+                            timestamp
+                        FROM
+                            actions
+                        WHERE
+                            guild_id = $1
+                            AND user_id = $2
+                            AND (timestamp, id) < ($3, $4)
+                            AND timestamp >= $5
+                        ORDER BY
+                            timestamp DESC,
+                            id DESC
+                        LIMIT 6
+                        """,
+                        guild_id,
+                        user_id,
+                        *cursor,
+                        oldest,
+                    )
+                else:
+                    rows = await conn.fetch(
+                        """
+                        SELECT
+                            id,
+                            action_type,
+                            reason,
+                            moderator_id,
+                            timestamp
+                        FROM
+                            actions
+                        WHERE
+                            guild_id = $1
+                            AND user_id = $2
+                            AND (timestamp, id) > ($3, $4)
+                            AND timestamp >= $5
+                        ORDER BY
+                            timestamp ASC,
+                            id ASC
+                        LIMIT 6
+                        """,
+                        guild_id,
+                        user_id,
+                        *cursor,
+                        oldest,
+                    )
+                summary = await ActionSummary.fetch(conn, guild_id, user_id)
+            page = (rows, summary)
+            history_cache.put(guild_id, user_id, page_key, page, version=version)
+        return page
+
+    @staticmethod
+    def page_custom_id(user_id: int, direction: str, row: Any) -> str:
+        """
+        Build the custom ID for a paginator button, keeping the timestamp
+        and ID of the action to page from.
 
-    #     await ctx.send(
-    #         "Created a chat log with code {0}"
-    #         .format(log_id)
-    #     )
+        Parameters
+        ----------
+        user_id : int
+            The ID of the user whose history is being paged.
+        direction : str
+            ``n`` to page to older actions, ``p`` to page to newer ones.
+        row : Any
+            The action row to page from.
 
-    #     ...
+        Returns
+        -------
+        str
+            The custom ID for the button.
+        """
+
+        timestamp = (row["timestamp"] - EPOCH) // timedelta(microseconds=1)
+        return f"P_HIST {user_id} {direction} {timestamp} {row['id'].hex}"
+
+    @client.event.filtered_component(r"P_HSEARCH \d+ \d+ [0-9a-f]{32}")
+    async def history_search_paginator(self, ctx: novus.types.ComponentI):
+        """
+        Handle the next page button on a history search being clicked. The
+        search query is kept in the footer of the results embed.
+        """
+
+        _, user_id, timestamp, action_id = ctx.data.custom_id.split(" ")
+        assert ctx.message
+        query = ctx.message.embeds[0].footer.text
+        await self.search_history(
+            ctx,
+            query,
+            int(user_id) or None,
+            (
+                EPOCH + timedelta(microseconds=int(timestamp)),
+                uuid.UUID(action_id),
+            ),
+        )
+
+    @client.command(
+        name="history-search",
+        options=[
+            novus.ApplicationCommandOption(
+                name="query",
+                description="The words to search for in action reasons (\"quotes\", OR and -exclude all work).",
+                type=novus.ApplicationOptionType.STRING,
+                max_length=200,
+            ),
+            novus.ApplicationCommandOption(
+                name="user",
+                description="Only search the actions against this user.",
+                type=novus.ApplicationOptionType.USER,
+                required=False,
+            ),
+        ],
+        default_member_permissions=novus.Permissions(moderate_members=True),
+        dm_permission=False,
+    )
+    async def history_search(
+            self,
+            ctx: novus.types.CommandI,
+            query: str,
+            user: novus.GuildMember | None = None) -> None:
+        """
+        Search the reasons of every action in the guild.
+        """
+
+        await self.search_history(ctx, query, user.id if user else None)
+
+    async def search_history(
+            self,
+            ctx: novus.types.CommandI | novus.Interaction[novus.MessageComponentData],
+            query: str,
+            user_id: int | None = None,
+            cursor: tuple[dt, uuid.UUID] | None = None) -> None:
+        """
+        Show a page of the actions whose reasons match a search, newest
+        first.
+
+        Parameters
+        ----------
+        ctx
+            The interaction to respond to.
+        query : str
+            The search query, in web search syntax.
+        user_id : int | None
+            The user to limit the search to.
+        cursor : tuple[dt, uuid.UUID] | None
+            The timestamp and ID of the action to show results older than.
+        """
+
+        await ctx.defer_update()
+        assert ctx.guild
+        if cursor is None:
+            cursor = (dt.max, uuid.UUID(int=(1 << 128) - 1))
+        oldest = await self.oldest_visible(ctx.guild.id)
+        async with db.Database.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT
+                    id,
+                    user_id,
+                    action_type,
+                    reason,
+                    timestamp
+                FROM
+                    actions
+                WHERE
+                    guild_id = $1
+                    AND reason_search @@ WEBSEARCH_TO_TSQUERY('english', $2)
+                    AND ($3::BIGINT IS NULL OR user_id = $3)
+                    AND (timestamp, id) < ($4, $5)
+                    AND timestamp >= $6
+                ORDER BY
+                    timestamp DESC,
+                    id DESC
+                LIMIT 6
+                """,
+                ctx.guild.id,
+                query,
+                user_id,
+                *cursor,
+                oldest,
+            )
+        if not rows:
+            return await ctx.send("No actions matched that search.")
+
+        # Make into an embed, keeping the query for the next page
+        embed = novus.Embed()
+        embed.set_footer(query)
+        for r in rows[:5]:
+            relative = novus.utils.format_timestamp(r["timestamp"], "R")
+            embed.add_field(
+                str(r["id"]),
+                f"`{r['action_type']}` | <@{r['user_id']}> | {relative}\n{r['reason']}",
+                inline=False,
+            )
+
+        # Add a button for the next page
+        last = rows[min(len(rows), 5) - 1]
+        timestamp = (last["timestamp"] - EPOCH) // timedelta(microseconds=1)
+        button = novus.Button(
+            label="\N{RIGHTWARDS ARROW}",
+            custom_id=f"P_HSEARCH {user_id or 0} {timestamp} {last['id'].hex}",
+        )
+        if len(rows) <= 5:
+            button.disabled = True
+        await ctx.send(
+            embeds=[embed],
+            components=[novus.ActionRow([button])],
+            allowed_mentions=novus.AllowedMentions.none(),
+        )
@@ -0,0 +1,508 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import html
+import itertools
+import os
+import tempfile
+from typing import IO, Any, Literal
+import uuid
+
+import novus
+from novus.ext import client, database as db
+
+from utils import iter_chat_log_archive, snowflake_to_datetime
+
+
+MESSAGES_PER_PAGE = 10
+# Search results are paged by message ID and content hash, which is signed
+MIN_CONTENT_HASH = -(1 << 63)
+TranscriptFormat = Literal["text", "html"]
+
+HTML_HEADER = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Chat log {0}</title>
+<style>
+body {{ font-family: sans-serif; background: #313338; color: #dbdee1; }}
+.message {{ margin: 0 0 12px 0; }}
+.author {{ font-weight: bold; color: #f2f3f5; }}
+.time {{ font-size: 0.8em; color: #949ba4; margin-left: 6px; }}
+.content {{ white-space: pre-wrap; }}
+</style>
+</head>
+<body>
+<h1>Chat log {0}</h1>
+"""
+HTML_MESSAGE = """<div class="message">
+<span class="author">{author}</span><span class="time">{time}</span>
+<div class="content">{content}</div>
+</div>
+"""
+HTML_FOOTER = """</body>
+</html>
+"""
+
+
+class Logs(client.Plugin):
+
+    @staticmethod
+    def parse_code(code: str) -> uuid.UUID | None:
+        """
+        Turn a chat log code into a UUID, if it's valid.
+        """
+
+        try:
+            return uuid.UUID(code.strip())
+        except ValueError:
+            return None
+
+    @staticmethod
+    async def fetch_log(
+            conn: Any,
+            log_id: uuid.UUID,
+            guild_id: int) -> Any:
+        """
+        Get the size of a chat log (and its compressed messages, if it's
+        been archived), as long as it belongs to the given guild.
+
+        Parameters
+        ----------
+        conn : asyncpg.Connection
+            An open database connection.
+        log_id : uuid.UUID
+            The ID of the chat log.
+        guild_id : int
+            The ID of the guild that's asking for the log.
+
+        Returns
+        -------
+        asyncpg.Record | None
+            A row with the number of messages in the log as ``size`` and
+            the archived messages as ``data`` (``None`` if the log hasn't
+            been compressed), or ``None`` if the log doesn't exist in the
+            guild.
+        """
+
+        return await conn.fetchrow(
+            """
+            WITH guild_log AS (
+                SELECT
+                    $1::UUID AS log_id
+                WHERE
+                    EXISTS (
+                        SELECT
+                            1
+                        FROM
+                            actions
+                        WHERE
+                            log_id = $1
+                            AND guild_id = $2
+                    )
+            )
+            SELECT
+                CARDINALITY(message_ids) AS size,
+                NULL::BYTEA AS data
+            FROM
+                chat_logs
+            WHERE
+                log_id = $1
+                AND (guild_id = $2 OR log_id IN (SELECT log_id FROM guild_log))
+            UNION ALL
+            SELECT
+                message_count AS size,
+                data
+            FROM
+                chat_log_archives
+            WHERE
+                log_id = $1
+                AND (guild_id = $2 OR log_id IN (SELECT log_id FROM guild_log))
+            LIMIT 1
+            """,
+            log_id,
+            guild_id,
+        )
+
+    @client.event.filtered_component(r"P_LOGS [0-9a-f]{32} \d+")
+    async def logs_view_paginator(self, ctx: novus.types.ComponentI):
+        """
+        Handle a chat log paginator button being clicked.
+        """
+
+        _, log_id, page = ctx.data.custom_id.split(" ")
+        await self.view_log_page(ctx, uuid.UUID(log_id), int(page))
+
+    @client.command(
+        name="logs view",
+        options=[
+            novus.ApplicationCommandOption(
+                name="code",
+                type=novus.ApplicationOptionType.STRING,
+                description="The code of the chat log that you want to see.",
+            ),
+            novus.ApplicationCommandOption(
+                name="transcript",
+                type=novus.ApplicationOptionType.STRING,
+                description="Get the whole log as a file instead of as pages.",
+                choices=[
+                    novus.ApplicationCommandChoice(name="Text", value="text"),
+                    novus.ApplicationCommandChoice(name="HTML", value="html"),
+                ],
+                required=False,
+            ),
+        ],
+        default_member_permissions=novus.Permissions(moderate_members=True),
+        dm_permission=False,
+    )
+    async def logs_view(
+            self,
+            ctx: novus.types.CommandI,
+            code: str,
+            transcript: TranscriptFormat | None = None) -> None:
+        """
+        View a stored chat log.
+        """
+
+        log_id = self.parse_code(code)
+        if log_id is None:
+            return await ctx.send("That isn't a valid chat log code.", ephemeral=True)
+        if transcript is None:
+            return await self.view_log_page(ctx, log_id, 0)
+        await self.send_transcript(ctx, log_id, transcript)
+
+    async def view_log_page(
+            self,
+            ctx: novus.types.CommandI | novus.Interaction[novus.MessageComponentData],
+            log_id: uuid.UUID,
+            page: int) -> None:
+        """
+        Show a page of a chat log. Only the messages on the page are read,
+        by slicing the log's list of message IDs.
+
+        Parameters
+        ----------
+        ctx
+            The interaction to respond to.
+        log_id : uuid.UUID
+            The ID of the chat log.
+        page : int
+            The page to show, from zero.
+        """
+
+        await ctx.defer_update()
+        assert ctx.guild
+        async with db.Database.acquire() as conn:
+            log = await self.fetch_log(conn, log_id, ctx.guild.id)
+            if log is None:
+                return await ctx.send("There's no chat log with that code.")
+            rows: list[Any]
+            if log["data"] is not None:
+                rows = list(itertools.islice(
+                    iter_chat_log_archive(log["data"]),
+                    page * MESSAGES_PER_PAGE,
+                    (page + 1) * MESSAGES_PER_PAGE,
+                ))
+            else:
+                rows = await conn.fetch(
+                    """
+                    SELECT
+                        logged_messages.message_id,
+                        logged_messages.author_id,
+                        logged_messages.author_name,
+                        logged_messages.message_content
+                    FROM
+                        chat_logs
+                    CROSS JOIN
+                        UNNEST(chat_logs.message_ids[$2:$3], chat_logs.content_hashes[$2:$3])
+                        WITH ORDINALITY AS log_message (message_id, content_hash, position)
+                    JOIN
+                        logged_messages
+                    ON
+                        logged_messages.message_id = log_message.message_id
+                        AND logged_messages.content_hash = log_message.content_hash
+                    WHERE
+                        chat_logs.log_id = $1
+                    ORDER BY
+                        log_message.position
+                    """,
+                    log_id,
+                    page * MESSAGES_PER_PAGE + 1,
+                    (page + 1) * MESSAGES_PER_PAGE,
+                )
+        if not rows:
+            return await ctx.send("That chat log is empty.")
+
+        # Make into an embed
+        lines = []
+        for r in rows:
+            content = r["message_content"] or "*No content*"
+            if len(content) > 300:
+                content = content[:300] + "..."
+            timestamp = novus.utils.format_timestamp(snowflake_to_datetime(r["message_id"]), "f")
+            lines.append(f"**{r['author_name']}** ({timestamp})\n{content}")
+        pages = max(1, -(-log["size"] // MESSAGES_PER_PAGE))
+        embed = novus.Embed(
+            title=f"Chat log {log_id}",
+            description="\n\n".join(lines),
+        )
+        embed.set_footer(f"Page {page + 1} of {pages}")
+
+        # Decide what buttons we want
+        buttons = [
+            novus.Button(
+                label="\N{LEFTWARDS ARROW}",
+                custom_id=f"P_LOGS {log_id.hex} {page - 1}",
+            ),
+            novus.Button(
+                label="\N{RIGHTWARDS ARROW}",
+                custom_id=f"P_LOGS {log_id.hex} {page + 1}",
+            ),
+        ]
+        if page == 0:
+            buttons[0].disabled = True
+            buttons[0].custom_id = f"P_LOGS {log_id.hex} 0"
+        if page + 1 >= pages:
+            buttons[-1].disabled = True
+        await ctx.send(
+            embeds=[embed],
+            components=[novus.ActionRow(buttons)],
+            allowed_mentions=novus.AllowedMentions.none(),
+        )
+
+    async def send_transcript(
+            self,
+            ctx: novus.types.CommandI,
+            log_id: uuid.UUID,
+            format: TranscriptFormat) -> None:
+        """
+        Send a whole chat log as a file. Messages are read with a
+        server-side cursor (or inflated from the archive a chunk at a time)
+        and written out as they arrive, so the whole log is never held in
+        memory.
+
+        Parameters
+        ----------
+        ctx
+            The interaction to respond to.
+        log_id : uuid.UUID
+            The ID of the chat log.
+        format : TranscriptFormat
+            Whether to make a plain text or an HTML transcript.
+        """
+
+        await ctx.defer()
+        assert ctx.guild
+        extension = "txt" if format == "text" else "html"
+        with tempfile.TemporaryDirectory(prefix="voxelmod-log-") as directory:
+            path = os.path.join(directory, f"chat-log-{log_id}.{extension}")
+            with open(path, "w", encoding="utf-8") as output:
+                async with db.Database.acquire() as conn:
+                    log = await self.fetch_log(conn, log_id, ctx.guild.id)
+                    if log is None:
+                        return await ctx.send("There's no chat log with that code.")
+                    self.write_transcript_header(output, log_id, format)
+                    if log["data"] is not None:
+                        for message in iter_chat_log_archive(log["data"]):
+                            self.write_transcript_message(output, message, format)
+                    else:
+                        async with conn.transaction():
+                            cursor = conn.cursor(
+                                """
+                                SELECT
+                                    logged_messages.message_id,
+                                    logged_messages.author_id,
+                                    logged_messages.author_name,
+                                    logged_messages.message_content
+                                FROM
+                                    chat_logs
+                                CROSS JOIN
+                                    UNNEST(chat_logs.message_ids, chat_logs.content_hashes)
+                                    WITH ORDINALITY AS log_message (message_id, content_hash, position)
+                                JOIN
+                                    logged_messages
+                                ON
+                                    logged_messages.message_id = log_message.message_id
+                                    AND logged_messages.content_hash = log_message.content_hash
+                                WHERE
+                                    chat_logs.log_id = $1
+                                ORDER BY
+                                    log_message.position
+                                """,
+                                log_id,
+                                prefetch=500,
+                            )
+                            async for row in cursor:
+                                self.write_transcript_message(output, row, format)
+                    self.write_transcript_footer(output, format)
+            with open(path, "rb") as transcript:
+                await ctx.send(
+                    f"Here's chat log `{log_id}`.",
+                    files=[novus.File(transcript, os.path.basename(path))],
+                )
+
+    @staticmethod
+    def write_transcript_header(
+            output: IO[str],
+            log_id: uuid.UUID,
+            format: TranscriptFormat) -> None:
+        if format == "html":
+            output.write(HTML_HEADER.format(log_id))
+        else:
+            output.write(f"Chat log {log_id}\n\n")
+
+    @staticmethod
+    def write_transcript_message(
+            output: IO[str],
+            row: Any,
+            format: TranscriptFormat) -> None:
+        time = f"{snowflake_to_datetime(row['message_id']):%Y-%m-%d %H:%M:%S} UTC"
+        content = row["message_content"] or ""
+        if format == "html":
+            output.write(HTML_MESSAGE.format(
+                author=html.escape(f"{row['author_name']} ({row['author_id']})"),
+                time=time,
+                content=html.escape(content),
+            ))
+        else:
+            output.write(f"[{time}] {row['author_name']} ({row['author_id']}): {content}\n")
+
+    @staticmethod
+    def write_transcript_footer(output: IO[str], format: TranscriptFormat) -> None:
+        if format == "html":
+            output.write(HTML_FOOTER)
+
+    @client.event.filtered_component(r"P_LSEARCH \d+( -?\d+)?")
+    async def logs_search_paginator(self, ctx: novus.types.ComponentI):
+        """
+        Handle the next page button on a log search being clicked. The
+        search query is kept in the footer of the results embed.
+        """
+
+        _, message_id, *content_hash = ctx.data.custom_id.split(" ")
+        before = (int(message_id), int(content_hash[0]) if content_hash else MIN_CONTENT_HASH)
+        assert ctx.message
+        query = ctx.message.embeds[0].footer.text
+        await self.search_logs(ctx, query, before)
+
+    @client.command(
+        name="logs search",
+        options=[
+            novus.ApplicationCommandOption(
+                name="query",
+                description="The words to search for in logged messages (\"quotes\", OR and -exclude all work).",
+                type=novus.ApplicationOptionType.STRING,
+                max_length=200,
+            ),
+        ],
+        default_member_permissions=novus.Permissions(moderate_members=True),
+        dm_permission=False,
+    )
+    async def logs_search(
+            self,
+            ctx: novus.types.CommandI,
+            query: str) -> None:
+        """
+        Search every message that's been saved in a chat log in the guild.
+        """
+
+        await self.search_logs(ctx, query)
+
+    async def search_logs(
+            self,
+            ctx: novus.types.CommandI | novus.Interaction[novus.MessageComponentData],
+            query: str,
+            before: tuple[int, int] | None = None) -> None:
+        """
+        Show a page of the logged messages that match a search, newest
+        first.
+
+        Parameters
+        ----------
+        ctx
+            The interaction to respond to.
+        query : str
+            The search query, in web search syntax.
+        before : tuple[int, int] | None
+            The ID and content hash of the message version to show results
+            older than.
+        """
+
+        await ctx.defer_update()
+        assert ctx.guild
+        async with db.Database.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT
+                    message_id,
+                    content_hash,
+                    channel_id,
+                    author_id,
+                    author_name,
+                    message_content
+                FROM
+                    logged_messages
+                WHERE
+                    guild_id = $1
+                    AND message_search @@ WEBSEARCH_TO_TSQUERY('simple', $2)
+                    AND (message_id, content_hash) < ($3, $4)
+                ORDER BY
+                    message_id DESC,
+                    content_hash DESC
+                LIMIT 6
+                """,
+                ctx.guild.id,
+                query,
+                *(before or ((1 << 63) - 1, MIN_CONTENT_HASH)),
+            )
+        if not rows:
+            return await ctx.send("No logged messages matched that search.")
+
+        # Make into an embed, keeping the query for the next page
+        embed = novus.Embed()
+        embed.set_footer(query)
+        for r in rows[:5]:
+            content = r["message_content"] or "*No content*"
+            if len(content) > 900:
+                content = content[:900] + "..."
+            link = ""
+            if r["channel_id"]:
+                link = (
+                    f"\n[Jump](https://discord.com/channels/"
+                    f"{ctx.guild.id}/{r['channel_id']}/{r['message_id']})"
+                )
+            embed.add_field(
+                f"{r['author_name']} ({r['author_id']})",
+                f"{content}{link}",
+                inline=False,
+            )
+
+        # Add a button for the next page
+        last = rows[min(len(rows), 5) - 1]
+        button = novus.Button(
+            label="\N{RIGHTWARDS ARROW}",
+            custom_id=f"P_LSEARCH {last['message_id']} {last['content_hash']}",
+        )
+        if len(rows) <= 5:
+            button.disabled = True
+        await ctx.send(
+            embeds=[embed],
+            components=[novus.ActionRow([button])],
+            allowed_mentions=novus.AllowedMentions.none(),
+        )
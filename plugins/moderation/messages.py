@@ -18,23 +18,86 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
 import collections
-from typing import Any
+import io
+from typing import Any, Callable
 
 import novus
-from novus.ext import client, database as db
+from novus.ext import client
 
-from utils.message_queuer import MaxLenList
+from utils.cached_message import CachedMessage
+from utils.chat_log_writer import chat_log_writer
+from utils.guild_settings import GuildSettings, guild_settings
+from utils.log_buffer import log_buffer
+from utils.message_cache import MessageCache
+from utils.rest_scheduler import Priority, RequestDropped, rest_scheduler
+from utils.time_utils import snowflake_to_datetime
+from utils.webhook_pool import WebhookUnavailable, webhook_pool
 
 
 class MessageHandler(client.Plugin):
 
-    message_cache: dict[int, MaxLenList[novus.Message]]
-    message_cache = collections.defaultdict(lambda: MaxLenList(5_000))
+    message_cache: MessageCache[CachedMessage]
+    message_cache = MessageCache(sizeof=CachedMessage.approximate_size)
+
+    async def on_load(self) -> None:
+        """
+        Apply the message cache budget from the config.
+        """
+
+        config = self.bot.config
+        self.message_cache.max_messages = getattr(
+            config,
+            "message_cache_max_messages",
+            self.message_cache.max_messages,
+        )
+        self.message_cache.max_bytes = getattr(
+            config,
+            "message_cache_max_bytes",
+            self.message_cache.max_bytes,
+        )
+        self.message_cache.idle_after = 60 * getattr(
+            config,
+            "message_cache_idle_minutes",
+            self.message_cache.idle_after / 60,
+        )
+
+    async def on_unload(self) -> None:
+        """
+        Send any log embeds and write any chat logs that are still queued
+        before we shut down.
+        """
+
+        await log_buffer.close()
+        await chat_log_writer.close()
+
+    @client.loop(60 * 5)
+    async def message_cache_prune_loop(self) -> None:
+        """
+        Drop the cached messages for any channels that have gone idle.
+        """
+
+        dropped = self.message_cache.prune()
+        usage = self.message_cache.usage
+        self.log.info(
+            "Message cache holding %s messages (~%s bytes) over %s channels (%s idle channels dropped)",
+            usage.messages, usage.bytes, usage.channels, dropped,
+        )
+        stats = log_buffer.stats
+        self.log.info(
+            "Log buffer holding %s embeds for %s channels (%s embeds sent in %s messages)",
+            stats.queued_embeds, stats.queued_channels, stats.embeds_sent, stats.messages_sent,
+        )
+        rest_stats = rest_scheduler.stats
+        self.log.info(
+            "REST scheduler has %s in flight; queued %s, completed %s, failed %s, dropped %s (by priority)",
+            rest_stats.in_flight, rest_stats.queued, rest_stats.completed,
+            rest_stats.failed, rest_stats.dropped,
+        )
 
     def try_get_message(
             self,
             channel_id: int,
-            message_id: int) -> novus.Message | None:
+            message_id: int) -> CachedMessage | None:
         """
         Try and get a message from the cache.
 
@@ -47,18 +110,90 @@ class MessageHandler(client.Plugin):
 
         Returns
         -------
-        novus.Message | None
+        CachedMessage | None
             The retrieved message, if one could be found.
         """
 
-        for i in self.message_cache[channel_id]:
-            if i.id == message_id:
-                return i
-        return None
+        return self.message_cache.get_message(channel_id, message_id)
+
+    async def send_log(
+            self,
+            settings: GuildSettings,
+            log_channel: novus.Channel,
+            *,
+            make_files: Callable[[], list[novus.File]] | None = None,
+            **kwargs: Any) -> None:
+        """
+        Send a message to the guild's message log channel, through its
+        webhooks if the guild has turned them on.
+
+        Parameters
+        ----------
+        settings : GuildSettings
+            The guild's settings.
+        log_channel : novus.Channel
+            The message log channel.
+        make_files : Callable[[], list[novus.File]] | None
+            Makes the files to attach, fresh for each attempt at sending.
+        **kwargs
+            The message to send.
+        """
+
+        if settings.log_webhooks:
+            try:
+                await webhook_pool.send(
+                    log_channel,
+                    settings.guild_id,
+                    "message_webhook_ids",
+                    priority=Priority.LOW,
+                    make_files=make_files,
+                    **kwargs,
+                )
+                return
+            except WebhookUnavailable:
+                self.log.info(
+                    "Can't use webhooks in log channel %s; sending as the bot",
+                    log_channel.id, exc_info=True,
+                )
+        if make_files is not None:
+            kwargs["files"] = make_files()
+        await rest_scheduler.call(
+            log_channel.send(**kwargs),
+            priority=Priority.LOW,
+            route=f"channels/{log_channel.id}/messages",
+        )
+
+    def queue_log(
+            self,
+            settings: GuildSettings,
+            log_channel: novus.Channel,
+            embeds: list[novus.Embed]) -> None:
+        """
+        Queue embeds to be sent to the guild's message log channel with the
+        next batch.
+
+        Parameters
+        ----------
+        settings : GuildSettings
+            The guild's settings.
+        log_channel : novus.Channel
+            The message log channel.
+        embeds : list[novus.Embed]
+            The embeds for a single event.
+        """
+
+        if not settings.log_webhooks:
+            return log_buffer.add(log_channel, embeds)
+        log_buffer.add(
+            log_channel,
+            embeds,
+            send=lambda batch: self.send_log(settings, log_channel, embeds=batch),
+            concurrency=webhook_pool.per_channel,
+        )
 
     @staticmethod
     def message_to_embed(
-            message: novus.Message,
+            message: novus.Message | CachedMessage,
             *,
             channel: novus.abc.Snowflake | None = None,
             **kwargs: Any) -> novus.Embed:
@@ -67,7 +202,7 @@ class MessageHandler(client.Plugin):
 
         Parameters
         ----------
-        message : novus.Message
+        message : novus.Message | CachedMessage
             The message that you want to convert.
         channel : novus.abc.Snowflake | None
             Whether or not a field should be added to show the channel the
@@ -81,21 +216,19 @@ class MessageHandler(client.Plugin):
             The created embed.
         """
 
+        if isinstance(message, novus.Message):
+            message = CachedMessage.from_message(message)
         e = novus.Embed(
             description=message.content,
             **kwargs,
         ).set_author(
-            name=str(message.author),
-            icon_url=(
-                str(message.author.avatar)
-                if message.author.avatar
-                else None
-            ),
+            name=message.author_name,
+            icon_url=message.author_avatar,
         )
         if message.attachments:
             e.add_field(
                 "Attachments",
-                "\n".join([f"[{i.filename}]({i.url})" for i in message.attachments]),
+                "\n".join([f"[{filename}]({url})" for filename, url in message.attachments]),
                 inline=False,
             )
         if channel:
@@ -113,7 +246,10 @@ class MessageHandler(client.Plugin):
 
         if message.guild is None:
             return
-        self.message_cache[message.channel.id].append(message)
+        self.message_cache.append(
+            message.channel.id,
+            CachedMessage.from_message(message),
+        )
 
     @client.event.message_delete
     async def on_message_delete(
@@ -123,31 +259,11 @@ class MessageHandler(client.Plugin):
         Handle messages being deleted.
         """
 
-        # Make sure the author is not a bot
-        if message.author.bot:
-            return
-
-        # See if we have a message logs channel
-        assert message.channel.guild
-        async with db.Database.acquire() as conn:
-            rows = await conn.fetch(
-                """
-                SELECT
-                    message_channel_id
-                FROM
-                    guild_settings
-                WHERE
-                    guild_id = $1
-                LIMIT 1
-                """,
-                message.channel.guild.id,
-            )
-        if not rows or rows[0]["message_channel_id"] is None:
-            return
-        log_channel_id = rows[0]["message_channel_id"]
-
         # Make sure we have a valid message
-        if not isinstance(message, novus.Message):
+        cached_message: CachedMessage | None
+        if isinstance(message, novus.Message):
+            cached_message = CachedMessage.from_message(message)
+        else:
             cached_message = self.try_get_message(message.channel.id, message.id)
             if cached_message is None:
                 self.log.info(
@@ -155,18 +271,110 @@ class MessageHandler(client.Plugin):
                     message.channel.id, message.id,
                 )
                 return
-            message = cached_message
+
+        # It's gone now, so there's no point caching it any more
+        self.message_cache.discard(message.channel.id, message.id)
+
+        # Make sure the author is not a bot
+        if cached_message.author_bot:
+            return
+
+        # See if we have a message logs channel
+        assert message.channel.guild
+        settings = await guild_settings.get(message.channel.guild.id)
+        if settings.message_channel_id is None:
+            return
+        log_channel_id = settings.message_channel_id
 
         # Log message to channel
         log_channel = novus.Channel.partial(self.bot.state, log_channel_id)
         embed = self.message_to_embed(
-            message,
+            cached_message,
             channel=message.channel,
             title="Message Deleted",
             color=0xee1111,
         )
-        await log_channel.send(embeds=[embed])
+        self.queue_log(settings, log_channel, [embed])
+
+
+    @client.event.message_delete_bulk
+    async def on_message_delete_bulk(
+            self,
+            messages: list[novus.Message]):
+        """
+        Handle a lot of messages being deleted at once, logging them all in
+        one post with a transcript attached.
+        """
+
+        if not messages:
+            return
+        channel = messages[0].channel
+
+        # Get what we can from the cache in one pass, and stop caching it
+        deleted: list[CachedMessage] = []
+        missing = 0
+        for message in messages:
+            cached_message: CachedMessage | None
+            if isinstance(message, novus.Message):
+                cached_message = CachedMessage.from_message(message)
+            else:
+                cached_message = self.try_get_message(channel.id, message.id)
+            self.message_cache.discard(channel.id, message.id)
+            if cached_message is None:
+                missing += 1
+            elif not cached_message.author_bot:
+                deleted.append(cached_message)
+        if not deleted and not missing:
+            return
+        deleted.sort(key=lambda m: m.id)
+
+        # See if we have a message logs channel
+        assert channel.guild
+        settings = await guild_settings.get(channel.guild.id)
+        if settings.message_channel_id is None:
+            return
+        log_channel = novus.Channel.partial(self.bot.state, settings.message_channel_id)
+
+        # Summarise who was deleted
+        authors = collections.Counter(m.author_id for m in deleted)
+        embed = novus.Embed(
+            title="Messages Bulk Deleted",
+            color=0xee1111,
+        ).add_field(
+            "Channel",
+            f"<#{channel.id}>",
+        ).add_field(
+            "Messages",
+            (
+                f"{len(messages)} ({missing} not cached)"
+                if missing else str(len(messages))
+            ),
+        )
+        if authors:
+            embed.add_field(
+                "Authors",
+                "\n".join(
+                    f"<@{author_id}> ({count})"
+                    for author_id, count in authors.most_common(10)
+                ) + (f"\n...and {len(authors) - 10} more" if len(authors) > 10 else ""),
+                inline=False,
+            )
 
+        # And make a transcript of everything we had cached
+        make_files: Callable[[], list[novus.File]] | None = None
+        if deleted:
+            transcript = io.StringIO()
+            for m in deleted:
+                timestamp = f"{snowflake_to_datetime(m.id):%Y-%m-%d %H:%M:%S}"
+                transcript.write(f"[{timestamp} UTC] {m.author_name} ({m.author_id}): {m.content}\n")
+                for filename, url in m.attachments:
+                    transcript.write(f"    Attachment: {filename} {url}\n")
+            data = transcript.getvalue().encode()
+            make_files = lambda: [novus.File(io.BytesIO(data), f"deleted-messages-{channel.id}.txt")]
+        try:
+            await self.send_log(settings, log_channel, embeds=[embed], make_files=make_files)
+        except RequestDropped:
+            self.log.warning("Dropped the bulk delete log for channel %s", channel.id)
 
     @client.event.message_edit
     async def on_message_update(
@@ -182,48 +390,44 @@ class MessageHandler(client.Plugin):
             return
 
         # See if we should even bother
+        channel = message.channel
+        before_content: str
         if before is None:
-            cached_message = self.try_get_message(message.channel.id, message.id)
+            cached_message = self.try_get_message(channel.id, message.id)
             if cached_message is None:
                 self.log.info(
                     "Failed to get message %s-%s from cache",
-                    message.channel.id, message.id,
+                    channel.id, message.id,
                 )
                 return
-            before = cached_message
-
-        # See if we have a message logs channel
-        channel = message.channel
-        assert channel.guild
-        async with db.Database.acquire() as conn:
-            rows = await conn.fetch(
-                """
-                SELECT
-                    message_channel_id
-                FROM
-                    guild_settings
-                WHERE
-                    guild_id = $1
-                LIMIT 1
-                """,
-                channel.guild.id,
-            )
-        if not rows or rows[0]["message_channel_id"] is None:
-            return
-        log_channel_id = rows[0]["message_channel_id"]
+            before_content = cached_message.content
+        else:
+            before_content = before.content
 
         # Make sure we have a valid message
-        if not isinstance(message, novus.Message):
-            for i in self.message_cache[channel.id]:
-                if i.id == message.id:
-                    message = i
-                    break
-            else:
+        after: CachedMessage
+        if isinstance(message, novus.Message):
+            after = CachedMessage.from_message(message)
+        else:
+            cached_message = self.try_get_message(channel.id, message.id)
+            if cached_message is None:
                 self.log.info(
                     "Failed to get message %s-%s from cache",
                     channel.id, message.id,
                 )
                 return
+            after = cached_message
+
+        # Keep the cache up to date so the next edit has the right "before"
+        if self.try_get_message(channel.id, after.id) is not None:
+            self.message_cache.append(channel.id, after)
+
+        # See if we have a message logs channel
+        assert channel.guild
+        settings = await guild_settings.get(channel.guild.id)
+        if settings.message_channel_id is None:
+            return
+        log_channel_id = settings.message_channel_id
 
         # Log message to channel
         log_channel = novus.Channel.partial(self.bot.state, log_channel_id)
@@ -232,24 +436,19 @@ class MessageHandler(client.Plugin):
                 title="Message Edited",
                 color=0x666666,
             ).set_author(
-                name=str(message.author),
-                icon_url=(
-                    str(message.author.avatar)
-                    if message.author.avatar
-                    else None
-                ),
+                name=after.author_name,
+                icon_url=after.author_avatar,
             ).add_field(
                 "Channel",
-                f"{channel.mention} ([jump to message]({message.jump_url}))",
-            )
-        ]
-        if before:
-            embeds.append(novus.Embed(
+                f"{channel.mention} ([jump to message]({after.jump_url}))",
+            ),
+            novus.Embed(
                 color=0x11ee11,
-                description=before.content,
-            ))
+                description=before_content,
+            ),
+        ]
         embeds.append(novus.Embed(
             color=0xee11ee,
-            description=message.content,
+            description=after.content,
         ))
-        await log_channel.send(embeds=embeds)
+        self.queue_log(settings, log_channel, embeds)
@@ -0,0 +1,208 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime as dt
+
+import novus
+from novus.ext import client, database as db
+
+from utils import ActionType
+
+
+ROLLUP_NAME = "moderator_daily_stats"
+
+
+class ModStats(client.Plugin):
+
+    @client.loop(60 * 5)
+    async def rollup_loop(self) -> None:
+        """
+        Roll up any new actions into the daily moderator stats.
+        """
+
+        await self.refresh_rollup()
+
+    async def refresh_rollup(self) -> None:
+        """
+        Add every action since the last watermark to the daily moderator
+        stats, moving the watermark forward in the same statement.
+
+        The watermark is a transaction ID rather than a time: each action
+        keeps the ID of the transaction that wrote it, and everything below
+        the oldest transaction that's still running has either committed or
+        rolled back. An action is rolled up once its transaction has
+        finished, however late that was after its timestamp. Only one
+        process can refresh the rollup at a time.
+        """
+
+        async with db.Database.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT PG_ADVISORY_XACT_LOCK(HASHTEXT($1))", ROLLUP_NAME)
+                await conn.execute(
+                    """
+                    WITH watermarks AS (
+                        SELECT
+                            COALESCE(
+                                (
+                                    SELECT
+                                        watermark
+                                    FROM
+                                        rollup_watermarks
+                                    WHERE
+                                        name = $1
+                                ),
+                                '0'::XID8
+                            ) AS low,
+                            PG_SNAPSHOT_XMIN(PG_CURRENT_SNAPSHOT()) AS high
+                    ),
+                    new_stats AS (
+                        INSERT INTO
+                            moderator_daily_stats
+                            (
+                                guild_id,
+                                moderator_id,
+                                day,
+                                action_type,
+                                count
+                            )
+                        SELECT
+                            actions.guild_id,
+                            actions.moderator_id,
+                            actions.timestamp::DATE,
+                            actions.action_type,
+                            COUNT(*)
+                        FROM
+                            actions,
+                            watermarks
+                        WHERE
+                            actions.xact_id >= watermarks.low
+                            AND actions.xact_id < watermarks.high
+                        GROUP BY
+                            actions.guild_id,
+                            actions.moderator_id,
+                            actions.timestamp::DATE,
+                            actions.action_type
+                        ON CONFLICT (guild_id, day, moderator_id, action_type)
+                        DO UPDATE
+                        SET
+                            count = moderator_daily_stats.count + excluded.count
+                    )
+                    INSERT INTO
+                        rollup_watermarks
+                        (
+                            name,
+                            watermark
+                        )
+                    SELECT
+                        $1,
+                        high
+                    FROM
+                        watermarks
+                    ON CONFLICT (name)
+                    DO UPDATE
+                    SET
+                        watermark = excluded.watermark
+                    """,
+                    ROLLUP_NAME,
+                )
+
+    @client.command(
+        name="modstats",
+        options=[
+            novus.ApplicationCommandOption(
+                name="moderator",
+                type=novus.ApplicationOptionType.USER,
+                description="The moderator that you want to see the stats of.",
+                required=False,
+            ),
+        ],
+        default_member_permissions=novus.Permissions(moderate_members=True),
+        dm_permission=False,
+    )
+    async def modstats(
+            self,
+            interaction: novus.types.CommandI,
+            moderator: novus.GuildMember | None = None) -> None:
+        """
+        Shows how many actions each moderator has taken recently.
+        """
+
+        await interaction.defer()
+        assert interaction.guild
+        async with db.Database.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT
+                    moderator_id,
+                    action_type,
+                    SUM(count) FILTER (WHERE day > $2::DATE - 7) AS week,
+                    SUM(count) FILTER (WHERE day > $2::DATE - 30) AS month,
+                    SUM(count) AS year
+                FROM
+                    moderator_daily_stats
+                WHERE
+                    guild_id = $1
+                    AND day > $2::DATE - 365
+                    AND count > 0
+                    AND ($3::BIGINT IS NULL OR moderator_id = $3)
+                GROUP BY
+                    moderator_id,
+                    action_type
+                """,
+                interaction.guild.id,
+                dt.utcnow().date(),
+                moderator.id if moderator else None,
+            )
+        if not rows:
+            return await interaction.send("There are no moderator actions from the last year.")
+
+        # Group the counts by moderator
+        stats: dict[int, dict[str, tuple[int, int, int]]] = {}
+        for r in rows:
+            stats.setdefault(r["moderator_id"], {})[r["action_type"]] = (
+                r["week"] or 0,
+                r["month"] or 0,
+                r["year"] or 0,
+            )
+
+        # Busiest moderators first, as many as fit in an embed
+        embed = novus.Embed(
+            description="Actions taken in the last 7 / 30 / 365 days.",
+        )
+        ordered = sorted(
+            stats.items(),
+            key=lambda i: sum(c[2] for c in i[1].values()),
+            reverse=True,
+        )
+        for moderator_id, counts in ordered[:25]:
+            lines = []
+            for action_type in ActionType:
+                if action_type.name not in counts:
+                    continue
+                week, month, year = counts[action_type.name]
+                lines.append(f"`{action_type.name}` {week} / {month} / {year}")
+            embed.add_field(
+                f"Moderator {moderator_id}",
+                f"<@{moderator_id}>\n" + "\n".join(lines),
+                inline=True,
+            )
+        await interaction.send(
+            embeds=[embed],
+            allowed_mentions=novus.AllowedMentions.none(),
+        )
@@ -21,14 +21,17 @@ import asyncio
 from datetime import datetime as dt
 
 import novus
-from novus.ext import client, database as db
+from novus.ext import client
 
 from utils import (
     Action,
     ActionType,
+    Priority,
     create_chat_log,
     get_datetime_until,
     delete_messages as delete_messages_util,
+    purge_user_messages,
+    rest_scheduler,
 )
 
 
@@ -60,6 +63,12 @@ class Mute(client.Plugin):
                 description="Whether or not you want to delete messages from the user on their mute.",
                 required=False,
             ),
+            novus.ApplicationCommandOption(
+                name="delete_everywhere",
+                type=novus.ApplicationOptionType.BOOLEAN,
+                description="Whether deleted messages should be cleared from every channel, not just this one.",
+                required=False,
+            ),
         ],
         default_member_permissions=novus.Permissions(moderate_members=True),
         dm_permission=False,
@@ -70,19 +79,41 @@ class Mute(client.Plugin):
             user: novus.GuildMember,
             reason: str | None = None,
             duration: str = "",
-            delete_messages: bool = False) -> None:
+            delete_messages: bool = False,
+            delete_everywhere: bool = False) -> None:
         """
         Mutes a member from chatting in the guild until a certain time.
         """
 
         await interaction.defer()
-        async with db.Database.acquire() as conn:
-            log_id = await create_chat_log(conn, interaction.channel)
+
+        # Deleting messages from every channel needs more than a timeout,
+        # from both the moderator and us
+        if delete_messages and delete_everywhere:
+            assert isinstance(interaction.user, novus.GuildMember)
+            permissions = interaction.user.permissions
+            if permissions is None or not permissions.manage_messages:
+                await interaction.send(
+                    "You need the manage messages permission to delete messages from every channel."
+                )
+                return
+            if not interaction.app_permissions.manage_messages:
+                await interaction.send(
+                    "I'm missing the relevant permissions to delete that user's messages."
+                )
+                return
+
+        log_id = await create_chat_log(interaction.channel)
 
         # Get duration
+        assert interaction.guild
         future = dt.utcnow() + get_datetime_until(duration)
         try:
-            await user.edit(timeout_until=future, reason=reason)
+            await rest_scheduler.call(
+                user.edit(timeout_until=future, reason=reason),
+                priority=Priority.MODERATION,
+                route=f"guilds/{interaction.guild.id}/members",
+            )
         except novus.Forbidden:
             await interaction.send(
                 "I'm missing the relevant permissions to timeout that user."
@@ -90,7 +121,16 @@ class Mute(client.Plugin):
             return
 
         # Delete messages from the user
-        if delete_messages and interaction.app_permissions.manage_messages:
+        if delete_messages and delete_everywhere:
+            asyncio.create_task(
+                purge_user_messages(
+                    self.bot.state,
+                    interaction.guild.id,
+                    user.id,
+                    reason="The user has been muted.",
+                )
+            )
+        elif delete_messages and interaction.app_permissions.manage_messages:
             asyncio.create_task(
                 delete_messages_util(
                     interaction.channel,
@@ -101,16 +141,14 @@ class Mute(client.Plugin):
 
         # Create an action for the infraction
         assert interaction.guild
-        async with db.Database.acquire() as conn:
-            await Action.create(
-                conn,
-                guild_id=interaction.guild.id,
-                user_id=user.id,
-                action_type=ActionType.MUTE,
-                reason=reason,
-                moderator_id=interaction.user.id,
-                log_id=log_id
-            )
+        await Action.create(
+            guild_id=interaction.guild.id,
+            user_id=user.id,
+            action_type=ActionType.MUTE,
+            reason=reason,
+            moderator_id=interaction.user.id,
+            log_id=log_id
+        )
 
         # Send a confirmation message
         relative = novus.utils.format_timestamp(future, "R")
@@ -143,18 +181,20 @@ class Mute(client.Plugin):
 
         # Create an action for the infraction
         assert interaction.guild
-        async with db.Database.acquire() as conn:
-            await Action.create(
-                conn,
-                guild_id=interaction.guild.id,
-                user_id=user.id,
-                action_type=ActionType.UNMUTE,
-                moderator_id=interaction.user.id,
-            )
+        await Action.create(
+            guild_id=interaction.guild.id,
+            user_id=user.id,
+            action_type=ActionType.UNMUTE,
+            moderator_id=interaction.user.id,
+        )
 
         # Try unmuting the user
         try:
-            await user.edit(timeout_until=None)
+            await rest_scheduler.call(
+                user.edit(timeout_until=None),
+                priority=Priority.MODERATION,
+                route=f"guilds/{interaction.guild.id}/members",
+            )
         except novus.Forbidden:
             await interaction.send(
                 "I'm missing the relevant permissions to timeout that user."
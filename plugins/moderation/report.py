@@ -18,15 +18,65 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
 from datetime import datetime as dt, timedelta
+from typing import Any
 
 import novus
-from novus.ext import client, database as db
-
-from utils import Action, ActionType, create_chat_log
+from novus.ext import client
+
+from plugins.moderation.messages import MessageHandler
+from utils import (
+    Action,
+    ActionType,
+    GuildSettings,
+    Priority,
+    WebhookUnavailable,
+    create_chat_log,
+    guild_settings,
+    rest_scheduler,
+    webhook_pool,
+)
 
 
 class Report(client.Plugin):
 
+    async def send_report(
+            self,
+            settings: GuildSettings,
+            channel: novus.Channel,
+            **kwargs: Any) -> None:
+        """
+        Send a message to the guild's report channel, through its webhooks
+        if the guild has turned them on.
+
+        Parameters
+        ----------
+        settings : GuildSettings
+            The guild's settings.
+        channel : novus.Channel
+            The report channel.
+        **kwargs
+            The message to send.
+        """
+
+        if settings.log_webhooks:
+            try:
+                await webhook_pool.send(
+                    channel,
+                    settings.guild_id,
+                    "report_webhook_ids",
+                    **kwargs,
+                )
+                return
+            except WebhookUnavailable:
+                self.log.info(
+                    "Can't use webhooks in report channel %s; sending as the bot",
+                    channel.id, exc_info=True,
+                )
+        await rest_scheduler.call(
+            channel.send(**kwargs),
+            route=f"channels/{channel.id}/messages",
+        )
+
     @client.command(
         name="Report this message.",
         type=novus.ApplicationCommandType.MESSAGE,
@@ -39,8 +89,7 @@ class Report(client.Plugin):
         Report a message to the moderators of the guild.
         """
 
-        async with db.Database.acquire() as conn:
-            log_id = await create_chat_log(conn, message.channel)
+        log_id = await create_chat_log(message.channel)
         await interaction.send_modal(
             title="Message Report",
             custom_id=(
@@ -108,8 +157,7 @@ class Report(client.Plugin):
         """
 
         await interaction.defer(ephemeral=True)
-        async with db.Database.acquire() as conn:
-            log_id = await create_chat_log(conn, interaction.channel)
+        log_id = await create_chat_log(interaction.channel)
         await self.handle_report(
             interaction,
             user.id,
@@ -131,34 +179,18 @@ class Report(client.Plugin):
 
         # Create an action for the infraction
         assert interaction.guild
-        async with db.Database.acquire() as conn:
-            await Action.create(
-                conn,
-                guild_id=interaction.guild.id,
-                user_id=user_id,
-                action_type=ActionType.REPORT,
-                reason=reason,
-                moderator_id=interaction.user.id,
-                log_id=log_id
-            )
-
-            # Get the report channel ID
-            rows = await conn.fetch(
-                """
-                SELECT
-                    report_channel_id,
-                    staff_role_id
-                FROM
-                    guild_settings
-                WHERE
-                    guild_id = $1
-                LIMIT 1
-                """,
-                interaction.guild.id,
-            )
+        await Action.create(
+            guild_id=interaction.guild.id,
+            user_id=user_id,
+            action_type=ActionType.REPORT,
+            reason=reason,
+            moderator_id=interaction.user.id,
+            log_id=log_id
+        )
 
-        # Get channel ID
-        if not rows or rows[0]["report_channel_id"] is None:
+        # Get the report channel ID
+        settings = await guild_settings.get(interaction.guild.id)
+        if settings.report_channel_id is None:
             await interaction.send(
                 (
                     "Your report has been logged, but there is no report "
@@ -169,9 +201,14 @@ class Report(client.Plugin):
             )
             return
 
-        # Create message content
+        # Create message content, linking to a real message if we have one
         fake_message_id = interaction.id
         message_jump_url = f"https://discord.com/channels/{interaction.guild.id}/{channel_id}/{fake_message_id}"
+        channel_cache = MessageHandler.message_cache.get_channel(channel_id)
+        if channel_cache is not None:
+            nearby_message = channel_cache.nearest(interaction.id)
+            if nearby_message is not None:
+                message_jump_url = nearby_message.jump_url
         embed = (
             novus.Embed(color=0xe621_00, description=f"[Jump to a nearby message]({message_jump_url})")
             .add_field("Reporter", interaction.user.mention)
@@ -181,8 +218,8 @@ class Report(client.Plugin):
             .add_field("Log Code", log_id or ":kaeShrug:", inline=False)
         )
         content_kwargs = {}
-        if rows[0]["staff_role_id"]:
-            role_id = rows[0]["staff_role_id"]
+        if settings.staff_role_id:
+            role_id = settings.staff_role_id
             content_kwargs = {"content": f"<@&{role_id}>"}
 
         # Get buttons
@@ -198,10 +235,12 @@ class Report(client.Plugin):
         ]
 
         # Send report message
-        report_channel_id = rows[0]["report_channel_id"]
+        report_channel_id = settings.report_channel_id
         channel = novus.Channel.partial(self.bot.state, report_channel_id)
         try:
-            await channel.send(
+            await self.send_report(
+                settings,
+                channel,
                 **content_kwargs,
                 embeds=[embed,],
                 components=components,
@@ -293,10 +332,14 @@ class Report(client.Plugin):
         # Get duration
         future = dt.utcnow() + timedelta(seconds=seconds)
         try:
-            await novus.GuildMember.edit(  # pyright: ignore
-                fake_user,
-                timeout_until=future,
-                reason=reason,
+            await rest_scheduler.call(
+                novus.GuildMember.edit(  # pyright: ignore
+                    fake_user,
+                    timeout_until=future,
+                    reason=reason,
+                ),
+                priority=Priority.MODERATION,
+                route=f"guilds/{ctx.guild.id}/members",
             )
         except novus.Forbidden:
             await ctx.send(
@@ -331,9 +374,13 @@ class Report(client.Plugin):
 
         # Ban the user
         try:
-            await novus.GuildMember.ban(  # pyright: ignore
-                fake_user,
-                reason=reason,
+            await rest_scheduler.call(
+                novus.GuildMember.ban(  # pyright: ignore
+                    fake_user,
+                    reason=reason,
+                ),
+                priority=Priority.MODERATION,
+                route=f"guilds/{ctx.guild.id}/bans",
             )
         except novus.Forbidden:
             await ctx.send(
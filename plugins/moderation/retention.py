@@ -0,0 +1,739 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime as dt, timedelta
+import re
+from typing import Any
+
+from novus.ext import client, database as db
+
+from utils import compress_chat_log, history_cache
+
+
+PARTITION_NAME = re.compile(r"^actions_y(\d{4})m(\d{2})$")
+
+# Every stored (not generated) column of the actions table
+ACTION_COLUMNS = (
+    "id",
+    "guild_id",
+    "user_id",
+    "action_type",
+    "reason",
+    "moderator_id",
+    "log_id",
+    "timestamp",
+    "xact_id",
+)
+
+
+# Take the counts of some expired actions (from the relation given) off
+# their users' action summaries
+SUBTRACT_SUMMARIES = """
+    UPDATE
+        user_action_summary
+    SET
+        report_count = user_action_summary.report_count - expired.report_count,
+        warn_count = user_action_summary.warn_count - expired.warn_count,
+        mute_count = user_action_summary.mute_count - expired.mute_count,
+        unmute_count = user_action_summary.unmute_count - expired.unmute_count,
+        ban_count = user_action_summary.ban_count - expired.ban_count,
+        unban_count = user_action_summary.unban_count - expired.unban_count
+    FROM
+        (
+            SELECT
+                guild_id,
+                user_id,
+                COUNT(*) FILTER (WHERE action_type = 'REPORT') AS report_count,
+                COUNT(*) FILTER (WHERE action_type = 'WARN') AS warn_count,
+                COUNT(*) FILTER (WHERE action_type = 'MUTE') AS mute_count,
+                COUNT(*) FILTER (WHERE action_type = 'UNMUTE') AS unmute_count,
+                COUNT(*) FILTER (WHERE action_type = 'BAN') AS ban_count,
+                COUNT(*) FILTER (WHERE action_type = 'UNBAN') AS unban_count
+            FROM
+                {0}
+            GROUP BY
+                guild_id,
+                user_id
+        ) AS expired
+    WHERE
+        user_action_summary.guild_id = expired.guild_id
+        AND user_action_summary.user_id = expired.user_id
+"""
+
+
+def month_start(time: dt, offset: int = 0) -> dt:
+    """
+    Get the start of the month that a time is in, moved by a number of
+    months.
+
+    Parameters
+    ----------
+    time : dt
+        The time to get the month of.
+    offset : int
+        How many months to move by.
+
+    Returns
+    -------
+    dt
+        Midnight on the first day of the month.
+    """
+
+    months = time.year * 12 + time.month - 1 + offset
+    return dt(months // 12, months % 12 + 1, 1)
+
+
+class Retention(client.Plugin):
+    """
+    Looks after the monthly partitions of the actions table, making them
+    ahead of time and dropping (or archiving) them once no guild wants to
+    keep them any more. Any actions that land in the default partition are
+    moved into a partition for their month, so that they expire too.
+
+    Each guild can set how many days of actions to keep. Anything older
+    than that is hidden from /history straight away; the partition it's in
+    is removed once it's older than the longest retention of any guild, and
+    until then it's deleted a batch at a time. Either way the expired
+    actions are taken off the user summaries and the moderator stats.
+
+    Chat logs are looked after too: they're deleted once they're older
+    than their guild's chat log retention, and before that they can be
+    packed into a single compressed blob per log once they're old enough
+    that they're rarely read (trading away searching them). Both are done in small batches so that no one
+    statement holds locks (or the database connection) for long.
+    """
+
+    @property
+    def default_action_retention_days(self) -> int | None:
+        """
+        How many days of actions to keep for guilds that haven't set their
+        own retention. ``None`` keeps them forever.
+        """
+
+        return getattr(self.bot.config, "action_retention_days", None)
+
+    @property
+    def default_chat_log_retention_days(self) -> int | None:
+        """
+        How many days of chat logs to keep for guilds that haven't set their
+        own retention. ``None`` keeps them forever.
+        """
+
+        return getattr(self.bot.config, "chat_log_retention_days", None)
+
+    @property
+    def action_batch_size(self) -> int:
+        """
+        The most expired actions to delete in one go.
+        """
+
+        return getattr(self.bot.config, "action_batch_size", 1_000)
+
+    @property
+    def chat_log_batch_size(self) -> int:
+        """
+        The most chat logs to delete or compress in one go.
+        """
+
+        return getattr(self.bot.config, "chat_log_batch_size", 500)
+
+    @client.loop(60 * 60)
+    async def action_partition_loop(self) -> None:
+        """
+        Make the partitions for the coming months and get rid of any that
+        have expired.
+        """
+
+        await self.create_action_partitions()
+        await self.expire_action_partitions()
+
+    async def create_action_partitions(self) -> None:
+        """
+        Make sure that there's a partition for this month and the next few,
+        and for any month that has actions sat in the default partition.
+        """
+
+        ahead = getattr(self.bot.config, "action_partitions_ahead", 3)
+        now = dt.utcnow()
+        months = {month_start(now, offset) for offset in range(ahead + 1)}
+        async with db.Database.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT DISTINCT
+                    DATE_TRUNC('month', timestamp) AS month
+                FROM
+                    actions_default
+                """
+            )
+            months.update(r["month"] for r in rows)
+            for start in sorted(months):
+                name = f"actions_y{start:%Y}m{start:%m}"
+                if await conn.fetchval("SELECT TO_REGCLASS($1)", name) is not None:
+                    continue
+                try:
+                    await self.create_action_partition(conn, name, start, month_start(start, 1))
+                except Exception as e:
+                    self.log.error(
+                        "Failed to create actions partition for %s",
+                        f"{start:%Y-%m}", exc_info=e,
+                    )
+
+    async def create_action_partition(self, conn: Any, name: str, start: dt, end: dt) -> None:
+        """
+        Make a partition of the actions table for a month. A partition can't
+        be made while the default partition has rows that belong in it, so
+        any that it has are moved across.
+
+        Parameters
+        ----------
+        conn : asyncpg.Connection
+            An open database connection.
+        name : str
+            The name of the partition.
+        start : dt
+            The start of the month.
+        end : dt
+            The start of the next month.
+        """
+
+        async with conn.transaction():
+            # Stop any more actions landing in the default partition while
+            # we're moving them
+            await conn.execute("LOCK TABLE actions IN SHARE ROW EXCLUSIVE MODE")
+            await conn.execute(
+                """
+                CREATE TEMPORARY TABLE
+                    actions_moving
+                ON COMMIT DROP
+                AS
+                    SELECT
+                        {0}
+                    FROM
+                        actions_default
+                WITH NO DATA
+                """.format(", ".join(ACTION_COLUMNS)),
+            )
+            moved = await conn.execute(
+                """
+                WITH moved AS (
+                    DELETE FROM
+                        actions_default
+                    WHERE
+                        timestamp >= $1
+                        AND timestamp < $2
+                    RETURNING
+                        {0}
+                )
+                INSERT INTO
+                    actions_moving
+                SELECT
+                    *
+                FROM
+                    moved
+                """.format(", ".join(ACTION_COLUMNS)),
+                start,
+                end,
+            )
+            await conn.execute(
+                """
+                CREATE TABLE
+                    {0}
+                PARTITION OF
+                    actions
+                FOR VALUES
+                    FROM ('{1:%Y-%m-%d}')
+                    TO ('{2:%Y-%m-%d}')
+                """.format(name, start, end),
+            )
+            await conn.execute(
+                """
+                INSERT INTO
+                    actions
+                    ({0})
+                SELECT
+                    *
+                FROM
+                    actions_moving
+                """.format(", ".join(ACTION_COLUMNS)),
+            )
+        self.log.info(
+            "Created actions partition %s, moving %s actions from the default partition",
+            name, moved.split()[-1],
+        )
+
+    async def expire_action_partitions(self) -> None:
+        """
+        Drop or archive every partition whose newest possible action is
+        older than the longest retention any guild has, and delete the
+        expired actions of any guild with a shorter retention from the
+        partitions that are left.
+        """
+
+        # Work out how long the longest retention is; if guilds keep actions
+        # forever by default then no partition can ever be dropped
+        default = self.default_action_retention_days
+        async with db.Database.acquire() as conn:
+            longest, shortest = await conn.fetchrow(
+                """
+                SELECT
+                    MAX(action_retention_days),
+                    MIN(action_retention_days)
+                FROM
+                    guild_settings
+                """
+            )
+        now = dt.utcnow()
+        partition_cutoff = None
+        if default is not None:
+            partition_cutoff = now - timedelta(days=max(default, longest or 0))
+
+        # Anything before the start of the cutoff's month is in a partition
+        # that's about to be dropped, so it doesn't need deleting by hand
+        retentions = [i for i in (default, shortest) if i is not None]
+        if retentions:
+            await self.expire_actions(
+                now,
+                month_start(partition_cutoff) if partition_cutoff else dt.min,
+                now - timedelta(days=min(retentions)),
+            )
+        if partition_cutoff is None:
+            return
+
+        async with db.Database.acquire() as conn:
+
+            # Find the expired partitions
+            rows = await conn.fetch(
+                """
+                SELECT
+                    child.relname
+                FROM
+                    pg_inherits
+                JOIN
+                    pg_class parent
+                ON
+                    parent.oid = pg_inherits.inhparent
+                JOIN
+                    pg_class child
+                ON
+                    child.oid = pg_inherits.inhrelid
+                WHERE
+                    parent.relname = 'actions'
+                """
+            )
+            expired: dict[str, dt] = {}
+            for row in rows:
+                match = PARTITION_NAME.match(row["relname"])
+                if match is None:
+                    continue
+                start = dt(int(match.group(1)), int(match.group(2)), 1)
+                if month_start(start, 1) <= partition_cutoff:
+                    expired[row["relname"]] = start
+            if not expired:
+                return
+
+            # And get rid of them
+            archive_schema = getattr(self.bot.config, "action_archive_schema", None)
+            for name, start in sorted(expired.items()):
+                async with conn.transaction():
+                    await conn.execute(f"ALTER TABLE actions DETACH PARTITION {name}")
+                    await conn.execute(SUBTRACT_SUMMARIES.format(name))
+                    await conn.execute(
+                        """
+                        DELETE FROM
+                            moderator_daily_stats
+                        WHERE
+                            day >= $1
+                            AND day < $2
+                        """,
+                        start.date(),
+                        month_start(start, 1).date(),
+                    )
+                    if archive_schema:
+                        await conn.execute(f"CREATE SCHEMA IF NOT EXISTS {archive_schema}")
+                        await conn.execute(f"ALTER TABLE {name} SET SCHEMA {archive_schema}")
+                        self.log.info("Archived actions partition %s to %s", name, archive_schema)
+                    else:
+                        await conn.execute(f"DROP TABLE {name}")
+                        self.log.info("Dropped actions partition %s", name)
+        history_cache.clear()
+
+    async def expire_actions(self, now: dt, after: dt, before: dt) -> None:
+        """
+        Delete the actions that are older than their guild's retention, a
+        batch at a time, taking them off the user summaries and moderator
+        stats as they go.
+
+        Parameters
+        ----------
+        now : dt
+            The time to count each guild's retention back from.
+        after : dt
+            Only delete actions from this time on.
+        before : dt
+            Only delete actions from before this time (the shortest
+            retention of any guild), so that most of the table is skipped.
+        """
+
+        total = 0
+        deleted = self.action_batch_size
+        while deleted >= self.action_batch_size:
+            async with db.Database.acquire() as conn:
+                async with conn.transaction():
+
+                    # Hold off the stats rollup so that every action is
+                    # either rolled up before it's deleted or not at all
+                    await conn.execute("SELECT PG_ADVISORY_XACT_LOCK(HASHTEXT($1))", "moderator_daily_stats")
+                    deleted = await conn.fetchval(
+                        """
+                        WITH expired AS (
+                            SELECT
+                                actions.id,
+                                actions.timestamp
+                            FROM
+                                actions
+                            LEFT JOIN
+                                guild_settings
+                            ON
+                                guild_settings.guild_id = actions.guild_id
+                            WHERE
+                                actions.timestamp >= $2::TIMESTAMP
+                                AND actions.timestamp < $3::TIMESTAMP
+                                AND actions.timestamp < $1::TIMESTAMP - MAKE_INTERVAL(
+                                    days => COALESCE(guild_settings.action_retention_days, $4::INTEGER)
+                                )
+                            LIMIT $5
+                            FOR UPDATE OF actions SKIP LOCKED
+                        ),
+                        deleted AS (
+                            DELETE FROM
+                                actions
+                            USING
+                                expired
+                            WHERE
+                                actions.id = expired.id
+                                AND actions.timestamp = expired.timestamp
+                            RETURNING
+                                actions.guild_id,
+                                actions.user_id,
+                                actions.moderator_id,
+                                actions.action_type,
+                                actions.timestamp,
+                                actions.xact_id
+                        ),
+                        summaries AS (
+                            {0}
+                        ),
+                        stats AS (
+                            UPDATE
+                                moderator_daily_stats
+                            SET
+                                count = moderator_daily_stats.count - expired.count
+                            FROM
+                                (
+                                    SELECT
+                                        guild_id,
+                                        moderator_id,
+                                        timestamp::DATE AS day,
+                                        action_type,
+                                        COUNT(*) AS count
+                                    FROM
+                                        deleted
+                                    WHERE
+                                        -- Only the ones that have been rolled up
+                                        xact_id < (
+                                            SELECT
+                                                watermark
+                                            FROM
+                                                rollup_watermarks
+                                            WHERE
+                                                name = 'moderator_daily_stats'
+                                        )
+                                    GROUP BY
+                                        guild_id,
+                                        moderator_id,
+                                        timestamp::DATE,
+                                        action_type
+                                ) AS expired
+                            WHERE
+                                moderator_daily_stats.guild_id = expired.guild_id
+                                AND moderator_daily_stats.moderator_id = expired.moderator_id
+                                AND moderator_daily_stats.day = expired.day
+                                AND moderator_daily_stats.action_type = expired.action_type
+                        )
+                        SELECT
+                            COUNT(*)
+                        FROM
+                            deleted
+                        """.format(SUBTRACT_SUMMARIES.format("deleted")),
+                        now,
+                        after,
+                        before,
+                        self.default_action_retention_days,
+                        self.action_batch_size,
+                    )
+            total += deleted
+        if total:
+            self.log.info("Deleted %s expired actions", total)
+            history_cache.clear()
+
+    @client.loop(60 * 15)
+    async def chat_log_loop(self) -> None:
+        """
+        Delete any chat logs that have expired and compress the ones that
+        are getting old.
+        """
+
+        await self.expire_chat_logs()
+        await self.compress_chat_logs()
+
+    @staticmethod
+    async def delete_orphaned_messages(
+            conn: Any,
+            message_ids: list[int],
+            content_hashes: list[int]) -> None:
+        """
+        Delete the given versions of logged messages, apart from the ones
+        that are still in an uncompressed chat log.
+
+        Parameters
+        ----------
+        conn : asyncpg.Connection
+            An open database connection.
+        message_ids : list[int]
+            The IDs of the messages that might not be needed any more.
+        content_hashes : list[int]
+            The content hash of each of the messages in ``message_ids``.
+        """
+
+        if not message_ids:
+            return
+        await conn.execute(
+            """
+            DELETE FROM
+                logged_messages
+            USING
+                UNNEST($1::BIGINT[], $2::BIGINT[]) AS candidate (message_id, content_hash)
+            WHERE
+                logged_messages.message_id = candidate.message_id
+                AND logged_messages.content_hash = candidate.content_hash
+                AND NOT EXISTS (
+                    SELECT
+                        1
+                    FROM
+                        chat_logs
+                    CROSS JOIN
+                        UNNEST(chat_logs.message_ids, chat_logs.content_hashes)
+                        AS log_message (message_id, content_hash)
+                    WHERE
+                        chat_logs.message_ids @> ARRAY[logged_messages.message_id]
+                        AND log_message.message_id = logged_messages.message_id
+                        AND log_message.content_hash = logged_messages.content_hash
+                )
+            """,
+            message_ids,
+            content_hashes,
+        )
+
+    async def expire_chat_logs(self) -> None:
+        """
+        Delete every chat log (compressed or not) that's older than its
+        guild's chat log retention, a batch at a time.
+        """
+
+        default = self.default_chat_log_retention_days
+        async with db.Database.acquire() as conn:
+            shortest = await conn.fetchval(
+                """
+                SELECT
+                    MIN(chat_log_retention_days)
+                FROM
+                    guild_settings
+                """
+            )
+        retentions = [i for i in (default, shortest) if i is not None]
+        if not retentions:
+            return
+        now = dt.utcnow()
+
+        # Nothing newer than the shortest retention can have expired, which
+        # lets the timestamp index skip most of the table
+        earliest_cutoff = now - timedelta(days=min(retentions))
+        for table in ("chat_logs", "chat_log_archives"):
+            deleted = self.chat_log_batch_size
+            while deleted >= self.chat_log_batch_size:
+                async with db.Database.acquire() as conn:
+                    async with conn.transaction():
+                        rows = await conn.fetch(
+                            """
+                            WITH expired AS (
+                                SELECT
+                                    log_id
+                                FROM
+                                    {0}
+                                LEFT JOIN
+                                    guild_settings
+                                ON
+                                    guild_settings.guild_id = {0}.guild_id
+                                WHERE
+                                    {0}.timestamp < $2::TIMESTAMP
+                                    AND {0}.timestamp < $1::TIMESTAMP - MAKE_INTERVAL(
+                                        days => COALESCE(guild_settings.chat_log_retention_days, $3::INTEGER)
+                                    )
+                                LIMIT $4
+                                FOR UPDATE OF {0} SKIP LOCKED
+                            )
+                            DELETE FROM
+                                {0}
+                            WHERE
+                                log_id IN (SELECT log_id FROM expired)
+                            RETURNING
+                                {1}
+                            """.format(
+                                table,
+                                (
+                                    "message_ids, content_hashes"
+                                    if table == "chat_logs"
+                                    else "NULL AS message_ids, NULL AS content_hashes"
+                                ),
+                            ),
+                            now,
+                            earliest_cutoff,
+                            default,
+                            self.chat_log_batch_size,
+                        )
+                        await self.delete_orphaned_messages(
+                            conn,
+                            [i for r in rows if r["message_ids"] for i in r["message_ids"]],
+                            [i for r in rows if r["message_ids"] for i in r["content_hashes"]],
+                        )
+                deleted = len(rows)
+                if rows:
+                    self.log.info("Deleted %s expired rows from %s", len(rows), table)
+
+    async def compress_chat_logs(self) -> None:
+        """
+        Pack every chat log older than the compression age into a single
+        compressed blob, a batch at a time, and get rid of the rows that it
+        replaces.
+
+        Compressed logs can still be viewed and exported, but their messages
+        are taken out of ``logged_messages``, so they no longer turn up in
+        ``/logs search``. Because of that, compression is off unless
+        ``chat_log_compress_after_days`` is set.
+        """
+
+        compress_after = getattr(self.bot.config, "chat_log_compress_after_days", None)
+        if compress_after is None:
+            return
+        cutoff = dt.utcnow() - timedelta(days=compress_after)
+        compressed = self.chat_log_batch_size
+        while compressed >= self.chat_log_batch_size:
+            async with db.Database.acquire() as conn:
+                async with conn.transaction():
+                    logs = await conn.fetch(
+                        """
+                        SELECT
+                            log_id,
+                            guild_id,
+                            channel_id,
+                            message_ids,
+                            content_hashes,
+                            timestamp
+                        FROM
+                            chat_logs
+                        WHERE
+                            timestamp < $1
+                        ORDER BY
+                            timestamp
+                        LIMIT $2
+                        FOR UPDATE SKIP LOCKED
+                        """,
+                        cutoff,
+                        self.chat_log_batch_size,
+                    )
+                    if not logs:
+                        return
+                    keys = list({
+                        i
+                        for r in logs
+                        for i in zip(r["message_ids"], r["content_hashes"])
+                    })
+                    message_ids = [i[0] for i in keys]
+                    content_hashes = [i[1] for i in keys]
+                    message_rows = await conn.fetch(
+                        """
+                        SELECT
+                            logged_messages.message_id,
+                            logged_messages.content_hash,
+                            logged_messages.author_id,
+                            logged_messages.author_name,
+                            logged_messages.message_content
+                        FROM
+                            logged_messages
+                        JOIN
+                            UNNEST($1::BIGINT[], $2::BIGINT[]) AS wanted (message_id, content_hash)
+                        ON
+                            logged_messages.message_id = wanted.message_id
+                            AND logged_messages.content_hash = wanted.content_hash
+                        """,
+                        message_ids,
+                        content_hashes,
+                    )
+                    messages = {(r["message_id"], r["content_hash"]): r for r in message_rows}
+
+                    # Build the blobs and swap them in for the logs
+                    records = []
+                    for r in logs:
+                        log_messages = [
+                            messages[i]
+                            for i in zip(r["message_ids"], r["content_hashes"])
+                            if i in messages
+                        ]
+                        records.append((
+                            r["log_id"],
+                            r["guild_id"],
+                            r["channel_id"],
+                            len(log_messages),
+                            r["timestamp"],
+                            compress_chat_log(log_messages),
+                        ))
+                    await conn.copy_records_to_table(
+                        "chat_log_archives",
+                        records=records,
+                        columns=(
+                            "log_id",
+                            "guild_id",
+                            "channel_id",
+                            "message_count",
+                            "timestamp",
+                            "data",
+                        ),
+                    )
+                    await conn.execute(
+                        """
+                        DELETE FROM
+                            chat_logs
+                        WHERE
+                            log_id = ANY($1::UUID[])
+                        """,
+                        [r["log_id"] for r in logs],
+                    )
+                    await self.delete_orphaned_messages(conn, message_ids, content_hashes)
+            compressed = len(logs)
+            self.log.info("Compressed %s chat logs", len(logs))
@@ -18,7 +18,7 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
 import novus
-from novus.ext import client, database as db
+from novus.ext import client
 
 from utils import Action, ActionType, create_chat_log
 
@@ -53,19 +53,16 @@ class Warn(client.Plugin):
         """
 
         await interaction.defer()
-        async with db.Database.acquire() as conn:
-            log_id = await create_chat_log(conn, interaction.channel)  # pyright: ignore
+        log_id = await create_chat_log(interaction.channel)  # pyright: ignore
 
         # Create an action for the infraction
         assert interaction.guild
-        async with db.Database.acquire() as conn:
-            await Action.create(
-                conn,
-                guild_id=interaction.guild.id,
-                user_id=user.id,
-                action_type=ActionType.WARN,
-                reason=reason,
-                moderator_id=interaction.user.id,
-                log_id=log_id
-            )
+        await Action.create(
+            guild_id=interaction.guild.id,
+            user_id=user.id,
+            action_type=ActionType.WARN,
+            reason=reason,
+            moderator_id=interaction.user.id,
+            log_id=log_id
+        )
         await interaction.send(f"A warning has been added to **{user.mention}**.")
@@ -20,7 +20,7 @@ from __future__ import annotations
 import novus as n
 from novus.ext import client, database as db
 
-from utils import get_datetime_until
+from utils import get_datetime_until, rest_scheduler
 
 
 class Reminders(client.Plugin):
@@ -159,20 +159,26 @@ class Reminders(client.Plugin):
 
             # Make sure the user is in the server
             try:
-                member = await n.Guild.fetch_member(fake_guild, row["user_id"])
+                member = await rest_scheduler.call(
+                    n.Guild.fetch_member(fake_guild, row["user_id"]),
+                    route=f"guilds/{fake_guild.id}/members",
+                )
             except n.NotFound:
                 continue
 
             # Try and send the reminder
             try:
-                await channel.send(
-                    f"<@{member.id}>",
-                    embeds=[
-                        (
-                            n.Embed(title="Reminder", color=0x7DD7D5)
-                            .add_field("Reminder", reminder)
-                        )
-                    ]
+                await rest_scheduler.call(
+                    channel.send(
+                        f"<@{member.id}>",
+                        embeds=[
+                            (
+                                n.Embed(title="Reminder", color=0x7DD7D5)
+                                .add_field("Reminder", reminder)
+                            )
+                        ]
+                    ),
+                    route=f"channels/{channel.id}/messages",
                 )
             except n.Forbidden:
                 self.log.info("Could not send reminder in channel %s", channel.id)
@@ -17,16 +17,120 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
 
+from typing import Any
+
 import novus as n
 from novus.ext import client, database as db
 from novus import types as t
 
+from utils import invalidation_bus, rest_scheduler
+
 
 class RolePicker(client.Plugin):
     """
     A plugin for role picker commands.
     """
 
+    async def on_load(self) -> None:
+        """
+        Set up the role picker cache, and drop cached role pickers when
+        another process changes them.
+        """
+
+        # Each guild's role pickers, keyed by their lowercase name (as the
+        # names are case insensitive); loaded the first time a guild uses one
+        self.role_pickers: dict[int, dict[str, Any]] = {}
+
+        # Bumped whenever a guild's cached role pickers are forgotten (or
+        # all of them are), so that a read that started before then doesn't
+        # put stale role pickers back in the cache
+        self.role_picker_versions: dict[int, int] = {}
+        self.role_picker_epoch: int = 0
+
+        invalidation_bus.subscribe("role_pickers", self.forget_role_pickers, self.reset_role_pickers)
+
+    async def on_unload(self) -> None:
+        """
+        Stop listening for role picker changes.
+        """
+
+        invalidation_bus.unsubscribe("role_pickers", self.forget_role_pickers)
+
+    def forget_role_pickers(self, guild_id: int | str) -> None:
+        """
+        Drop a guild's cached role pickers, so they're read again the next
+        time they're used.
+        """
+
+        guild_id = int(guild_id)
+        self.role_pickers.pop(guild_id, None)
+        self.role_picker_versions[guild_id] = self.role_picker_versions.get(guild_id, 0) + 1
+
+    def reset_role_pickers(self) -> None:
+        """
+        Drop every guild's cached role pickers.
+        """
+
+        self.role_pickers.clear()
+        self.role_picker_versions.clear()
+        self.role_picker_epoch += 1
+
+    async def get_role_pickers(self, guild_id: int) -> dict[str, Any]:
+        """
+        Get all of a guild's role pickers, from the cache if we can.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild.
+
+        Returns
+        -------
+        dict[str, asyncpg.Record]
+            The guild's role pickers (with their ``name``, ``role_ids`` and
+            ``type``), keyed by their lowercase name.
+        """
+
+        try:
+            return self.role_pickers[guild_id]
+        except KeyError:
+            pass
+        version = (self.role_picker_epoch, self.role_picker_versions.get(guild_id, 0))
+        async with db.Database.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT
+                    name,
+                    role_ids,
+                    type
+                FROM
+                    role_pickers
+                WHERE
+                    guild_id=$1
+                """,
+                guild_id,
+            )
+        pickers = {row["name"].lower(): row for row in rows}
+        if version == (self.role_picker_epoch, self.role_picker_versions.get(guild_id, 0)):
+            self.role_pickers[guild_id] = pickers
+        return pickers
+
+    async def role_pickers_changed(self, conn: Any, guild_id: int) -> None:
+        """
+        Forget a guild's cached role pickers after they've been changed,
+        here and in every other process.
+
+        Parameters
+        ----------
+        conn : asyncpg.Connection
+            The connection that the change was made on.
+        guild_id : int
+            The ID of the guild.
+        """
+
+        self.forget_role_pickers(guild_id)
+        await invalidation_bus.notify(conn, "role_pickers", guild_id)
+
     def format_role_picker(self, name: str, role_ids: list[int], type_: str) -> dict:
         """
         Return a kwargs for sending a role picker edit menu.
@@ -77,7 +181,10 @@ class RolePicker(client.Plugin):
         Return a select menu for users to pick roles from.
         """
 
-        guild_roles = await guild.fetch_roles()
+        guild_roles = await rest_scheduler.call(
+            guild.fetch_roles(),
+            route=f"guilds/{guild.id}/roles",
+        )
         return n.StringSelectMenu(
             custom_id=f"ROLE_PICKER_SELECT {name}",
             options=[
@@ -133,21 +240,19 @@ class RolePicker(client.Plugin):
 
         # Make sure that the name they're trying to use doesn't already exist
         if ignore_conflicts == "0":
-            async with db.Database.acquire() as conn:
-                row = await conn.fetchrow(
-                    "SELECT 1 FROM role_pickers WHERE guild_id=$1 AND name=$2",
-                    interaction.guild.id, name,
+            if name.lower() in await self.get_role_pickers(interaction.guild.id):
+                await interaction.send(
+                    f"A role picker with the name `{name}` already exists.",
+                    ephemeral=True,
                 )
-                if row:
-                    await interaction.send(
-                        f"A role picker with the name `{name}` already exists.",
-                        ephemeral=True,
-                    )
-                    return
+                return
 
         # Make sure that all of the roles the user has selected are below the user's maximum role
         member_role_ids = interaction.user.role_ids  # pyright: ignore
-        guild_roles: list[n.Role] = await interaction.guild.fetch_roles()
+        guild_roles: list[n.Role] = await rest_scheduler.call(
+            interaction.guild.fetch_roles(),
+            route=f"guilds/{interaction.guild.id}/roles",
+        )
         member_highest_role_position = max(
             (role.position for role in guild_roles if role.id in member_role_ids),
             default=-1,
@@ -191,6 +296,7 @@ class RolePicker(client.Plugin):
                 selected_roles,
                 type_,
             )
+            await self.role_pickers_changed(conn, interaction.guild.id)
 
         # Update the message to show the selected roles
         await interaction.update(
@@ -224,6 +330,7 @@ class RolePicker(client.Plugin):
                 interaction.guild.id,
                 name,
             )
+            await self.role_pickers_changed(conn, interaction.guild.id)
 
         # Update the message to show the selected roles
         await interaction.update(
@@ -261,6 +368,7 @@ class RolePicker(client.Plugin):
                 ctx.guild.id,
                 name,
             )
+            await self.role_pickers_changed(conn, ctx.guild.id)
 
         # Check if anything was deleted
         if result.endswith("0"):
@@ -293,22 +401,8 @@ class RolePicker(client.Plugin):
         Edit a role picker group.
         """
 
-        # Fetch the role picker from the database
-        async with db.Database.acquire() as conn:
-            row = await conn.fetchrow(
-                """
-                SELECT
-                    role_ids,
-                    type
-                FROM
-                    role_pickers
-                WHERE
-                    guild_id=$1
-                    AND name=$2
-                """,
-                ctx.guild.id,
-                name,
-            )
+        # Get the role picker
+        row = (await self.get_role_pickers(ctx.guild.id)).get(name.lower())
 
         # Check if the role picker exists
         if not row:
@@ -347,22 +441,8 @@ class RolePicker(client.Plugin):
         Post a role picker group.
         """
 
-        # Fetch the role picker from the database
-        async with db.Database.acquire() as conn:
-            row = await conn.fetchrow(
-                """
-                SELECT
-                    role_ids,
-                    type
-                FROM
-                    role_pickers
-                WHERE
-                    guild_id=$1
-                    AND name=$2
-                """,
-                ctx.guild.id,
-                name,
-            )
+        # Get the role picker
+        row = (await self.get_role_pickers(ctx.guild.id)).get(name.lower())
 
         # Check if the role picker exists
         if not row:
@@ -374,18 +454,20 @@ class RolePicker(client.Plugin):
 
         # Send the role picker message
         await ctx.send("Posting role picker...", ephemeral=True)
-        await ctx.channel.send(
-            content or "",
-            components=[
-                n.ActionRow([
-                    await self.get_user_role_picker(
-                        ctx.guild,  # pyright: ignore
-                        name,
-                        row["role_ids"],
-                        row["type"] == "MULTIPLE",
-                    )
-                ]),
-            ],
+        picker = await self.get_user_role_picker(
+            ctx.guild,  # pyright: ignore
+            name,
+            row["role_ids"],
+            row["type"] == "MULTIPLE",
+        )
+        await rest_scheduler.call(
+            ctx.channel.send(
+                content or "",
+                components=[
+                    n.ActionRow([picker]),
+                ],
+            ),
+            route=f"channels/{ctx.channel.id}/messages",
         )
 
     @client.event.filtered_component(r"ROLE_PICKER_SELECT")
@@ -397,22 +479,8 @@ class RolePicker(client.Plugin):
         # Get the name from the custom ID
         _, name = interaction.data.custom_id.split(" ")
 
-        # Fetch the role picker from the database
-        async with db.Database.acquire() as conn:
-            row = await conn.fetchrow(
-                """
-                SELECT
-                    role_ids,
-                    type
-                FROM
-                    role_pickers
-                WHERE
-                    guild_id=$1
-                    AND name=$2
-                """,
-                interaction.guild.id,
-                name,
-            )
+        # Get the role picker
+        row = (await self.get_role_pickers(interaction.guild.id)).get(name.lower())
 
         # Check if the role picker exists
         if not row:
@@ -452,9 +520,12 @@ class RolePicker(client.Plugin):
                 message = f"I've added <@&{selected_role_id}> to you."
 
         # Update the user's roles
-        await interaction.user.edit(  # pyright: ignore
-            roles=list(new_role_ids),
-            reason="Role picker selection"
+        await rest_scheduler.call(
+            interaction.user.edit(  # pyright: ignore
+                roles=list(new_role_ids),
+                reason="Role picker selection"
+            ),
+            route=f"guilds/{interaction.guild.id}/members",
         )
         await interaction.send(message, ephemeral=True)
 
@@ -468,26 +539,10 @@ class RolePicker(client.Plugin):
         Autocomplete for role picker names.
         """
 
-        current = ctx.data.options[0].options[0].value
-        async with db.Database.acquire() as conn:
-            rows = await conn.fetch(
-                """
-                SELECT
-                    name
-                FROM
-                    role_pickers
-                WHERE
-                    guild_id=$1
-                    AND name ILIKE $2
-                ORDER BY
-                    name ASC
-                LIMIT 25
-                """,
-                ctx.guild.id,
-                f"%{current}%",
-            )
-
+        current = str(ctx.data.options[0].options[0].value).lower()
+        pickers = await self.get_role_pickers(ctx.guild.id)
+        names = sorted(key for key in pickers if current in key)
         return [
-            n.ApplicationCommandChoice(name=row["name"], value=row["name"])
-            for row in rows
+            n.ApplicationCommandChoice(name=pickers[key]["name"], value=pickers[key]["name"])
+            for key in names[:25]
         ]
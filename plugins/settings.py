@@ -21,15 +21,46 @@ from typing import Any
 
 import novus as n
 from novus import types as t
-from novus.ext import client, database as db
+from novus.ext import client
+
+from utils import (
+    WebhookColumn,
+    configure_rest,
+    guild_settings,
+    invalidation_bus,
+    webhook_pool,
+)
 
 
 class Settings(client.Plugin):
 
+    async def on_load(self) -> None:
+        """
+        Apply the REST limits from the config, start listening for settings
+        that other processes change, and load every guild's settings up
+        front.
+        """
+
+        configure_rest(self.bot.config)
+        invalidation_bus.start(self.bot.config.database_dsn)
+
+        # If the database isn't up yet they're loaded on first use instead
+        try:
+            await guild_settings.preload()
+        except Exception as e:
+            self.log.warning("Failed to preload guild settings", exc_info=e)
+
+    async def on_unload(self) -> None:
+        """
+        Stop listening for settings changes.
+        """
+
+        await invalidation_bus.close()
+
     @staticmethod
     async def set_guild_item(column: str, guild_id: int, value: Any) -> None:
         """
-        Set an item in the database.
+        Set an item in the database, and in the guild settings cache.
 
         Parameters
         ----------
@@ -41,27 +72,39 @@ class Settings(client.Plugin):
             The value that you want to set.
         """
 
-        async with db.Database.acquire() as conn:
-            await conn.execute(
-                """
-                INSERT INTO
-                    guild_settings
-                    (
-                        guild_id,
-                        {0}
-                    )
-                VALUES
-                    (
-                        $1,
-                        $2
-                    )
-                ON CONFLICT (guild_id)
-                DO UPDATE
-                SET
-                    {0} = excluded.{0}
-                """.format(column),
+        await guild_settings.set(guild_id, column, value)
+
+    async def set_log_channel(
+            self,
+            column: str,
+            webhook_column: WebhookColumn,
+            guild_id: int,
+            channel_id: int) -> None:
+        """
+        Set a channel that logs or reports are sent to, retiring the webhooks
+        that were made for the old one.
+
+        Parameters
+        ----------
+        column : str
+            The name of the column that the channel ID is kept in.
+        webhook_column : WebhookColumn
+            The name of the column that the channel's webhook IDs are kept in.
+        guild_id : int
+            The ID of the guild that you want to set the channel for.
+        channel_id : int
+            The ID of the new channel.
+        """
+
+        settings = await guild_settings.get(guild_id)
+        old_channel_id = getattr(settings, column)
+        await self.set_guild_item(column, guild_id, channel_id)
+        if old_channel_id and old_channel_id != channel_id:
+            await webhook_pool.retire(
+                self.bot.state,
+                old_channel_id,
                 guild_id,
-                value,
+                webhook_column,
             )
 
     @client.command(
@@ -86,8 +129,9 @@ class Settings(client.Plugin):
 
         await interaction.defer(ephemeral=True)
         assert interaction.guild
-        await self.set_guild_item(
+        await self.set_log_channel(
             "report_channel_id",
+            "report_webhook_ids",
             interaction.guild.id,
             channel.id,
         )
@@ -118,8 +162,9 @@ class Settings(client.Plugin):
 
         await interaction.defer(ephemeral=True)
         assert interaction.guild
-        await self.set_guild_item(
+        await self.set_log_channel(
             "message_channel_id",
+            "message_webhook_ids",
             interaction.guild.id,
             channel.id,
         )
@@ -215,3 +260,94 @@ class Settings(client.Plugin):
             allowed_mentions=n.AllowedMentions.none(),
             ephemeral=True,
         )
+
+    @client.command(
+        name="settings retention actions",
+        options=[
+            n.ApplicationCommandOption(
+                name="days",
+                type=n.ApplicationOptionType.INTEGER,
+                description="How many days of moderation history to keep (leave empty to use the default).",
+                min_value=1,
+                required=False,
+            ),
+        ],
+        default_member_permissions=n.Permissions(manage_guild=True),
+    )
+    async def action_retention_settings(
+            self,
+            ctx: t.CommandI,
+            days: int | None = None) -> None:
+        """
+        Set how long moderation history is kept for.
+        """
+
+        await ctx.defer(ephemeral=True)
+        assert ctx.guild
+        await self.set_guild_item("action_retention_days", ctx.guild.id, days)
+        if days is None:
+            message = "Moderation history will be kept for the default amount of time."
+        else:
+            message = f"Moderation history will be kept for **{days}** days."
+        await ctx.send(message, ephemeral=True)
+
+    @client.command(
+        name="settings retention logs",
+        options=[
+            n.ApplicationCommandOption(
+                name="days",
+                type=n.ApplicationOptionType.INTEGER,
+                description="How many days of chat logs to keep (leave empty to use the default).",
+                min_value=1,
+                required=False,
+            ),
+        ],
+        default_member_permissions=n.Permissions(manage_guild=True),
+    )
+    async def chat_log_retention_settings(
+            self,
+            ctx: t.CommandI,
+            days: int | None = None) -> None:
+        """
+        Set how long chat logs are kept for.
+        """
+
+        await ctx.defer(ephemeral=True)
+        assert ctx.guild
+        await self.set_guild_item("chat_log_retention_days", ctx.guild.id, days)
+        if days is None:
+            message = "Chat logs will be kept for the default amount of time."
+        else:
+            message = f"Chat logs will be kept for **{days}** days."
+        await ctx.send(message, ephemeral=True)
+
+    @client.command(
+        name="settings logs webhooks",
+        options=[
+            n.ApplicationCommandOption(
+                name="enabled",
+                type=n.ApplicationOptionType.BOOLEAN,
+                description="Whether to send message logs and reports through webhooks.",
+            ),
+        ],
+        default_member_permissions=n.Permissions(manage_guild=True),
+    )
+    async def log_webhooks_settings(
+            self,
+            ctx: t.CommandI,
+            enabled: bool) -> None:
+        """
+        Set whether message logs and reports are sent through webhooks.
+        """
+
+        await ctx.defer(ephemeral=True)
+        assert ctx.guild
+        await self.set_guild_item("log_webhooks", ctx.guild.id, enabled)
+        if enabled:
+            message = (
+                "Message logs and reports will be sent through webhooks. "
+                "I'll need the Manage Webhooks permission in those channels."
+            )
+        else:
+            message = "Message logs and reports will be sent by me directly."
+        await ctx.send(message, ephemeral=True)
@@ -20,13 +20,65 @@ from __future__ import annotations
 from .action_utils import *
 from .time_utils import *
 from .message_queuer import *
+from .message_cache import *
+from .cached_message import *
 from .clear_utils import *
+from .chat_log_writer import *
+from .history_cache import *
+from .export_utils import *
+from .chat_log_archive import *
+from .invalidation_bus import *
+from .guild_settings import *
+from .log_buffer import *
+from .rest_scheduler import *
+from .rest_setup import *
+from .webhook_pool import *
 
 __all__: tuple[str, ...] = (
     'Action',
+    'ActionJournal',
+    'ActionSummary',
     'ActionType',
+    'CachedMessage',
+    'ChannelMessageCache',
+    'ChatLogWriter',
+    'DeleteResult',
+    'ExportFormat',
+    'GuildSettings',
+    'GuildSettingsCache',
+    'HistoryCache',
+    'HistoryCacheStats',
+    'InvalidationBus',
+    'LogBuffer',
+    'LogBufferStats',
     'MaxLenList',
+    'MessageCache',
+    'MessageCacheUsage',
+    'Priority',
+    'RequestDropped',
+    'RestScheduler',
+    'RestSchedulerStats',
+    'WebhookColumn',
+    'WebhookPool',
+    'WebhookUnavailable',
+    'action_journal',
+    'chat_log_writer',
+    'compress_chat_log',
+    'configure_rest',
     'create_chat_log',
+    'datetime_to_snowflake',
     'delete_messages',
+    'embed_length',
+    'export_query',
+    'export_records',
     'get_datetime_until',
+    'guild_settings',
+    'history_cache',
+    'invalidation_bus',
+    'iter_chat_log_archive',
+    'log_buffer',
+    'purge_user_messages',
+    'rest_scheduler',
+    'snowflake_to_datetime',
+    'webhook_pool',
 )
@@ -17,24 +17,32 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
 
-from __future__ import annotations
-
+import asyncio
 from enum import Enum
-from datetime import datetime as dt
+from datetime import datetime as dt, timedelta
 from typing import TYPE_CHECKING, Any
 from typing_extensions import Self
 import uuid
 
 import novus
+from novus.ext import database as db
 
 from plugins.moderation.messages import MessageHandler
 
+from .chat_log_writer import chat_log_writer
+from .history_cache import history_cache
+
 if TYPE_CHECKING:
     import asyncpg
 
+    from .cached_message import CachedMessage
+
 __all__ = (
     "ActionType",
     "Action",
+    "ActionJournal",
+    "ActionSummary",
+    "action_journal",
     "create_chat_log",
 )
 
@@ -120,7 +128,6 @@ class Action:
     @classmethod
     async def create(
             cls,
-            db: asyncpg.Connection,
             *,
             guild_id: int,
             user_id: int,
@@ -128,14 +135,16 @@ class Action:
             moderator_id: int,
             log_id: str | None = None,
             reason: str | None = None,
-            timestamp: novus.utils.DiscordDatetime | None = None) -> Action:
+            timestamp: novus.utils.DiscordDatetime | None = None,
+            temporary_ban_until: novus.utils.DiscordDatetime | None = None) -> Action:
         """
         Create and store a new action, returning the created action.
 
+        Actions are written through the :class:`ActionJournal`, so any
+        actions created at the same time are stored together.
+
         Parameters
         ----------
-        db
-            An open database connection.
         guild_id: int
             The ID of the guild where the action took place.
         user_id: int
@@ -146,8 +155,13 @@ class Action:
             The reason that the action happened.
         moderator_id: int
             The moderator who performed the action.
+        log_id: str | None
+            The code of the chat log for the action.
         timestamp: dt | None
             The timestamp that the action occured.
+        temporary_ban_until: dt | None
+            When the user's temporary ban should be lifted, if the action
+            is a temporary ban.
 
         Returns
         -------
@@ -155,57 +169,373 @@ class Action:
             The action that was created.
         """
 
+        action = cls(
+            guild_id=guild_id,
+            user_id=user_id,
+            action_type=action_type,
+            reason=reason or None,
+            moderator_id=moderator_id,
+            timestamp=(timestamp or novus.utils.utcnow()).naive,
+        )
+        await action_journal.submit(
+            action,
+            log_id=log_id,
+            temporary_ban_until=(
+                temporary_ban_until.naive
+                if temporary_ban_until
+                else None
+            ),
+        )
+        return action
+
+
+class ActionSummary:
+    """
+    How many of each action a user has had in a guild.
+
+    Attributes
+    ----------
+    guild_id: int
+    user_id: int
+    counts: dict[ActionType, int]
+    last_action_time: dt | None
+    """
+
+    guild_id: int
+    user_id: int
+    counts: dict[ActionType, int]
+    last_action_time: dt | None
+
+    def __init__(
+            self,
+            guild_id: int,
+            user_id: int,
+            counts: dict[ActionType, int],
+            last_action_time: dt | None):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.counts = counts
+        self.last_action_time = last_action_time
+
+    def __str__(self) -> str:
+        parts = [
+            f"{count} {action_type.name.lower()}{'s' if count != 1 else ''}"
+            for action_type, count in self.counts.items()
+            if count and action_type not in (ActionType.UNMUTE, ActionType.UNBAN)
+        ]
+        return ", ".join(parts) or "no infractions"
+
+    @classmethod
+    def from_row(cls, row: dict[str, Any]) -> Self:
+        return cls(
+            guild_id=row["guild_id"],
+            user_id=row["user_id"],
+            counts={
+                i: row[f"{i.name.lower()}_count"]
+                for i in ActionType
+            },
+            last_action_time=row["last_action_time"],
+        )
+
+    @classmethod
+    async def fetch(
+            cls,
+            db: asyncpg.Connection,
+            guild_id: int,
+            user_id: int) -> ActionSummary:
+        """
+        Get the action summary for a user.
+
+        Parameters
+        ----------
+        db
+            An open database connection.
+        guild_id: int
+            The ID of the guild to get the summary for.
+        user_id: int
+            The ID of the user to get the summary for.
+
+        Returns
+        -------
+        ActionSummary
+            The user's summary. All of the counts are zero if they've never
+            had an action.
+        """
+
         rows = await db.fetch(
             """
-            INSERT INTO
-                actions
-                (  
-                    guild_id,
-                    user_id,
-                    action_type,
-                    moderator_id,
-                    log_id,
-                    reason,
-                    timestamp
-                )
-            VALUES
-                (
-                    $1,
-                    $2,
-                    $3,
-                    $4,
-                    $5,
-                    $6,
-                    $7
-                )
-            RETURNING
+            SELECT
                 *
+            FROM
+                user_action_summary
+            WHERE
+                guild_id = $1
+                AND user_id = $2
             """,
             guild_id,
             user_id,
-            action_type.name,
-            moderator_id,
-            log_id or None,
-            reason or None,
-            timestamp.naive if timestamp else novus.utils.utcnow().naive,
         )
-
+        if not rows:
+            return cls(
+                guild_id=guild_id,
+                user_id=user_id,
+                counts={i: 0 for i in ActionType},
+                last_action_time=None,
+            )
         return cls.from_row(rows[0])
 
 
+class _JournalEntry:
+    """
+    An action that's waiting to be written.
+    """
+
+    __slots__ = ("action", "id", "log_id", "temporary_ban_until", "future")
+
+    def __init__(
+            self,
+            action: Action,
+            log_id: str | None,
+            temporary_ban_until: dt | None,
+            future: asyncio.Future[None]):
+        self.action = action
+        self.id = uuid.uuid4()
+        self.log_id = uuid.UUID(log_id) if log_id else None
+        self.temporary_ban_until = temporary_ban_until
+        self.future = future
+
+
+class ActionJournal:
+    """
+    Stores actions in batches, invalidating the cached history of each
+    user that an action is written for.
+
+    Every action submitted while a write is in progress is queued, and the
+    whole queue is written in one statement as soon as the database is free.
+    A single action costs one round trip, and a burst of actions (a raid
+    being banned, say) costs one round trip per batch rather than one per
+    action.
+
+    Parameters
+    ----------
+    max_batch : int
+        The most actions to write in a single statement.
+    """
+
+    def __init__(self, max_batch: int = 500):
+        self.max_batch = max_batch
+        self._pending: list[_JournalEntry] = []
+        self._task: asyncio.Task | None = None
+
+    async def submit(
+            self,
+            action: Action,
+            *,
+            log_id: str | None = None,
+            temporary_ban_until: dt | None = None) -> None:
+        """
+        Store an action, waiting until it's been written.
+
+        Parameters
+        ----------
+        action : Action
+            The action to store.
+        log_id : str | None
+            The code of the chat log for the action.
+        temporary_ban_until : dt | None
+            When the user's temporary ban should be lifted, as a naive UTC
+            datetime.
+        """
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_JournalEntry(action, log_id, temporary_ban_until, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        await asyncio.shield(future)
+
+    async def _run(self) -> None:
+        """
+        Write batches until the queue is empty.
+        """
+
+        # Let anything submitted alongside the first action join the batch
+        await asyncio.sleep(0)
+        while self._pending:
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            try:
+                await self._write(batch)
+            except Exception as e:
+                for entry in batch:
+                    if not entry.future.done():
+                        entry.future.set_exception(e)
+                continue
+            finally:
+                # Even a failed write might have been committed
+                for entry in batch:
+                    history_cache.invalidate(entry.action.guild_id, entry.action.user_id)
+            for entry in batch:
+                if not entry.future.done():
+                    entry.future.set_result(None)
+
+    @staticmethod
+    async def _write(batch: list[_JournalEntry]) -> None:
+        """
+        Write a batch of actions, any temporary bans that go with them, and
+        the changes to each user's action summary, in one statement.
+        """
+
+        # A row can only be upserted once per statement, so only keep the
+        # latest temporary ban for each user
+        bans: dict[tuple[int, int], dt] = {}
+        for entry in batch:
+            if entry.temporary_ban_until is not None:
+                key = (entry.action.guild_id, entry.action.user_id)
+                bans[key] = entry.temporary_ban_until
+
+        async with db.Database.acquire() as conn:
+            await conn.execute(
+                """
+                WITH new_actions AS (
+                    INSERT INTO
+                        actions
+                        (
+                            id,
+                            guild_id,
+                            user_id,
+                            action_type,
+                            moderator_id,
+                            log_id,
+                            reason,
+                            timestamp
+                        )
+                    SELECT
+                        *
+                    FROM
+                        UNNEST(
+                            $1::UUID[],
+                            $2::BIGINT[],
+                            $3::BIGINT[],
+                            $4::TEXT[],
+                            $5::BIGINT[],
+                            $6::UUID[],
+                            $7::TEXT[],
+                            $8::TIMESTAMP[]
+                        )
+                ),
+                new_temporary_bans AS (
+                    INSERT INTO
+                        temporary_bans
+                        (
+                            guild_id,
+                            user_id,
+                            expiry_time
+                        )
+                    SELECT
+                        *
+                    FROM
+                        UNNEST(
+                            $9::BIGINT[],
+                            $10::BIGINT[],
+                            $11::TIMESTAMP[]
+                        )
+                    ON CONFLICT (guild_id, user_id)
+                    DO UPDATE
+                    SET
+                        expiry_time = excluded.expiry_time
+                ),
+                new_summaries AS (
+                    INSERT INTO
+                        user_action_summary
+                        (
+                            guild_id,
+                            user_id,
+                            report_count,
+                            warn_count,
+                            mute_count,
+                            unmute_count,
+                            ban_count,
+                            unban_count,
+                            last_action_time
+                        )
+                    SELECT
+                        guild_id,
+                        user_id,
+                        COUNT(*) FILTER (WHERE action_type = 'REPORT'),
+                        COUNT(*) FILTER (WHERE action_type = 'WARN'),
+                        COUNT(*) FILTER (WHERE action_type = 'MUTE'),
+                        COUNT(*) FILTER (WHERE action_type = 'UNMUTE'),
+                        COUNT(*) FILTER (WHERE action_type = 'BAN'),
+                        COUNT(*) FILTER (WHERE action_type = 'UNBAN'),
+                        MAX(timestamp)
+                    FROM
+                        UNNEST(
+                            $2::BIGINT[],
+                            $3::BIGINT[],
+                            $4::TEXT[],
+                            $8::TIMESTAMP[]
+                        ) AS new (guild_id, user_id, action_type, timestamp)
+                    GROUP BY
+                        guild_id,
+                        user_id
+                    ON CONFLICT (guild_id, user_id)
+                    DO UPDATE
+                    SET
+                        report_count = user_action_summary.report_count + excluded.report_count,
+                        warn_count = user_action_summary.warn_count + excluded.warn_count,
+                        mute_count = user_action_summary.mute_count + excluded.mute_count,
+                        unmute_count = user_action_summary.unmute_count + excluded.unmute_count,
+                        ban_count = user_action_summary.ban_count + excluded.ban_count,
+                        unban_count = user_action_summary.unban_count + excluded.unban_count,
+                        last_action_time = GREATEST(
+                            user_action_summary.last_action_time,
+                            excluded.last_action_time
+                        )
+                )
+                SELECT
+                    1
+                """,
+                [i.id for i in batch],
+                [i.action.guild_id for i in batch],
+                [i.action.user_id for i in batch],
+                [i.action.action_type.name for i in batch],
+                [i.action.moderator_id for i in batch],
+                [i.log_id for i in batch],
+                [i.action.reason for i in batch],
+                [i.action.timestamp for i in batch],
+                [i[0] for i in bans],
+                [i[1] for i in bans],
+                list(bans.values()),
+            )
+
+
+action_journal = ActionJournal()
+
+
 async def create_chat_log(
-        db: asyncpg.Connection,
         channel: novus.Channel,
-        num_messages: int = 100) -> str:
+        num_messages: int = 100,
+        *,
+        since: timedelta | None = timedelta(minutes=15),
+        wait: bool = False) -> str:
     """
     Create a log from the text channel.
 
+    The log is queued and written to the database in the background, so
+    the code is returned straight away.
+
     Parameters
     ----------
     channel: novus.GuildTextChannel
         The channel that you want to make a chat log from.
     num_messages: int
-        The number of messages that you want to log.
+        The minimum number of recent messages that you want to log.
+    since: timedelta | None
+        Also log every message sent within this long ago, even if that's
+        more than ``num_messages``.
+    wait: bool
+        Whether or not to wait until the log has been written to the
+        database before returning.
 
     Returns
     -------
@@ -213,40 +543,31 @@ async def create_chat_log(
         A code assocaited with the chat log.
     """
 
-    messages_found: list[novus.Message] = MessageHandler.message_cache[channel.id][:-num_messages]
+    messages_found: list[CachedMessage] = []
+    channel_cache = MessageHandler.message_cache.get_channel(channel.id)
+    if channel_cache is not None:
+        messages_found = channel_cache.latest(num_messages)
+        if since is not None:
+            recent = channel_cache.between(novus.utils.utcnow() - since)
+            if len(recent) > len(messages_found):
+                messages_found = recent
 
     message_log_id = str(uuid.uuid4())
-    message_args: list[tuple] = []
-    for message in messages_found:
-        message_args.append((
-            message_log_id,
-            message.id,
-            message.author.id,
-            message.author.username,
-            message.content,
-        ))
-
-    await db.executemany(
-        """
-        INSERT INTO
-            message_logs
-            (
-                log_id,
-                message_id,
-                author_id,
-                author_name,
-                message_content
-            )
-        VALUES
+    chat_log_writer.add(
+        message_log_id,
+        guild_id=channel.guild.id if channel.guild else None,
+        channel_id=channel.id,
+        messages=[
             (
-                $1,
-                $2,
-                $3,
-                $4,
-                $5
+                message.id,
+                message.author_id,
+                message.author_name,
+                message.content,
             )
-        """,
-        message_args,
+            for message in messages_found
+        ],
     )
+    if wait:
+        await chat_log_writer.wait_for(message_log_id)
 
     return message_log_id
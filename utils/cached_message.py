@@ -0,0 +1,176 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import sys
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    import novus
+
+__all__ = (
+    "CachedMessage",
+)
+
+
+class CachedMessage:
+    """
+    A small, read-only copy of the parts of a message that the logs use.
+
+    Attributes
+    ----------
+    id : int
+        The ID of the message.
+    channel_id : int
+        The ID of the channel the message was sent in.
+    guild_id : int | None
+        The ID of the guild the message was sent in.
+    author_id : int
+        The ID of the message author.
+    author_name : str
+        The display string for the message author.
+    author_avatar : str | None
+        The URL of the author's avatar, if they have one.
+    author_bot : bool
+        Whether or not the author is a bot.
+    content : str
+        The content of the message.
+    attachments : tuple[tuple[str, str], ...]
+        The filename and URL of each attachment on the message.
+    """
+
+    __slots__ = (
+        "id",
+        "channel_id",
+        "guild_id",
+        "author_id",
+        "author_name",
+        "author_avatar",
+        "author_bot",
+        "content",
+        "attachments",
+    )
+
+    id: int
+    channel_id: int
+    guild_id: int | None
+    author_id: int
+    author_name: str
+    author_avatar: str | None
+    author_bot: bool
+    content: str
+    attachments: tuple[tuple[str, str], ...]
+
+    def __init__(
+            self,
+            *,
+            id: int,
+            channel_id: int,
+            guild_id: int | None,
+            author_id: int,
+            author_name: str,
+            author_avatar: str | None,
+            author_bot: bool,
+            content: str,
+            attachments: tuple[tuple[str, str], ...] = ()):
+        setter = object.__setattr__
+        setter(self, "id", id)
+        setter(self, "channel_id", channel_id)
+        setter(self, "guild_id", guild_id)
+        setter(self, "author_id", author_id)
+        setter(self, "author_name", author_name)
+        setter(self, "author_avatar", author_avatar)
+        setter(self, "author_bot", author_bot)
+        setter(self, "content", content)
+        setter(self, "attachments", attachments)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{self.__class__.__name__} is read-only")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{self.__class__.__name__} is read-only")
+
+    def __repr__(self) -> str:
+        return (
+            f"<{self.__class__.__name__} id={self.id} "
+            f"channel_id={self.channel_id} author_id={self.author_id}>"
+        )
+
+    @classmethod
+    def from_message(cls, message: novus.Message) -> CachedMessage:
+        """
+        Take a snapshot of a message.
+
+        Author names and avatars are interned, since the same few authors
+        make up most of a channel's history.
+
+        Parameters
+        ----------
+        message : novus.Message
+            The message that you want to copy.
+
+        Returns
+        -------
+        CachedMessage
+            The snapshot of the message.
+        """
+
+        author = message.author
+        return cls(
+            id=message.id,
+            channel_id=message.channel.id,
+            guild_id=message.guild.id if message.guild else None,
+            author_id=author.id,
+            author_name=sys.intern(str(author)),
+            author_avatar=sys.intern(str(author.avatar)) if author.avatar else None,
+            author_bot=author.bot,
+            content=message.content or "",
+            attachments=tuple(
+                (i.filename, i.url)
+                for i in message.attachments
+            ),
+        )
+
+    @property
+    def jump_url(self) -> str:
+        """
+        A link to the message.
+        """
+
+        return (
+            f"https://discord.com/channels/"
+            f"{self.guild_id or '@me'}/{self.channel_id}/{self.id}"
+        )
+
+    def approximate_size(self) -> int:
+        """
+        Roughly how many bytes the snapshot is holding on to. Interned author
+        strings are shared between snapshots so aren't counted.
+
+        Returns
+        -------
+        int
+            The approximate size of the snapshot.
+        """
+
+        size = sys.getsizeof(self) + sys.getsizeof(self.content)
+        if self.attachments:
+            size += sys.getsizeof(self.attachments)
+            for filename, url in self.attachments:
+                size += sys.getsizeof(filename) + sys.getsizeof(url)
+        return size
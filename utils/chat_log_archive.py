@@ -0,0 +1,108 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import json
+import zlib
+from typing import Any, Iterable, Iterator, Mapping
+
+__all__ = (
+    "compress_chat_log",
+    "iter_chat_log_archive",
+)
+
+
+# How much compressed data to inflate at a time when reading an archive
+READ_CHUNK_SIZE = 16 * 1024
+
+
+def compress_chat_log(messages: Iterable[Mapping[str, Any]]) -> bytes:
+    """
+    Pack the messages of a chat log into a single compressed blob.
+
+    The blob is zlib-compressed JSON, one message per line, so that it can
+    be read back a message at a time with :func:`iter_chat_log_archive`.
+
+    Parameters
+    ----------
+    messages : Iterable[Mapping[str, Any]]
+        The messages in the log, in order. Each needs a ``message_id``,
+        ``author_id``, ``author_name`` and ``message_content``.
+
+    Returns
+    -------
+    bytes
+        The compressed log.
+    """
+
+    compressor = zlib.compressobj(9)
+    parts: list[bytes] = []
+    for m in messages:
+        line = json.dumps(
+            [
+                m["message_id"],
+                m["author_id"],
+                m["author_name"],
+                m["message_content"],
+            ],
+            separators=(",", ":"),
+        )
+        parts.append(compressor.compress(line.encode() + b"\n"))
+    parts.append(compressor.flush())
+    return b"".join(parts)
+
+
+def iter_chat_log_archive(data: bytes) -> Iterator[dict[str, Any]]:
+    """
+    Read the messages back out of a blob made by
+    :func:`compress_chat_log`. The blob is inflated a chunk at a time, so
+    only one chunk of the log is ever decompressed at once.
+
+    Parameters
+    ----------
+    data : bytes
+        The compressed log.
+
+    Yields
+    ------
+    dict[str, Any]
+        Each message, with the same keys as a ``logged_messages`` row.
+    """
+
+    decompressor = zlib.decompressobj()
+    view = memoryview(data)
+    pending = b""
+    for start in range(0, len(view), READ_CHUNK_SIZE):
+        pending += decompressor.decompress(view[start:start + READ_CHUNK_SIZE])
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield _load_message(line)
+    pending += decompressor.flush()
+    for line in pending.split(b"\n"):
+        if line:
+            yield _load_message(line)
+
+
+def _load_message(line: bytes) -> dict[str, Any]:
+    message_id, author_id, author_name, message_content = json.loads(line)
+    return {
+        "message_id": message_id,
+        "author_id": author_id,
+        "author_name": author_name,
+        "message_content": message_content,
+    }
@@ -0,0 +1,383 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import hashlib
+import logging
+import uuid
+from datetime import datetime as dt
+
+from novus.ext import database as db
+
+
+__all__ = (
+    "ChatLogWriter",
+    "chat_log_writer",
+)
+
+
+log = logging.getLogger("utils.chat_log_writer")
+
+
+class _PendingLog:
+    """
+    A chat log that's waiting to be written.
+    """
+
+    __slots__ = ("log_id", "guild_id", "channel_id", "messages", "timestamp", "attempts")
+
+    def __init__(
+            self,
+            log_id: str,
+            guild_id: int | None,
+            channel_id: int,
+            messages: list[tuple]):
+        self.log_id = log_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.messages = messages
+        self.timestamp = dt.utcnow()
+        self.attempts = 0
+
+
+class ChatLogWriter:
+    """
+    Writes chat logs to the database in the background.
+
+    Logs are queued in memory and written in batches with ``COPY``, so
+    creating a log never has to wait on the database. Anyone that needs a
+    log to actually be stored can wait on it with :meth:`wait_for`.
+
+    Each version of a message is only stored once in ``logged_messages``,
+    however many logs it's in, keyed by its ID and a hash of its content
+    (see :meth:`content_hash`); ``chat_logs`` just keeps the message IDs and
+    content hashes for each log. A message that's edited between two logs
+    is stored once per version, so each log shows what it actually saw.
+
+    Parameters
+    ----------
+    batch_size : int
+        The number of messages to aim for in a single write.
+    flush_interval : float
+        The maximum number of seconds a log sits in the queue.
+    max_attempts : int
+        The number of times a failing log is retried before it's dropped.
+    """
+
+    MESSAGE_COLUMNS = (
+        "message_id",
+        "author_id",
+        "author_name",
+        "message_content",
+    )
+    LOG_COLUMNS = (
+        "log_id",
+        "guild_id",
+        "channel_id",
+        "message_ids",
+        "content_hashes",
+        "timestamp",
+    )
+
+    def __init__(
+            self,
+            batch_size: int = 10_000,
+            flush_interval: float = 1.0,
+            max_attempts: int = 3):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self._queue: collections.deque[_PendingLog] = collections.deque()
+        self._queued_rows: int = 0
+        self._waiters: dict[str, asyncio.Future[None]] = {}
+        self._wakeup: asyncio.Event | None = None
+        self._write_lock: asyncio.Lock | None = None
+        self._task: asyncio.Task | None = None
+        self._closing: bool = False
+
+    @staticmethod
+    def content_hash(content: str | None) -> int:
+        """
+        Hash the content of a message, the same way as
+        ``('x' || LEFT(MD5(COALESCE(message_content, '')), 16))::BIT(64)::BIGINT``
+        does in the database.
+
+        Parameters
+        ----------
+        content : str | None
+            The content of the message.
+
+        Returns
+        -------
+        int
+            The hash, as a signed 64 bit integer.
+        """
+
+        digest = hashlib.md5((content or "").encode()).digest()
+        return int.from_bytes(digest[:8], "big", signed=True)
+
+    @property
+    def queued_rows(self) -> int:
+        """
+        The number of messages that are waiting to be written.
+        """
+
+        return self._queued_rows
+
+    def add(
+            self,
+            log_id: str,
+            *,
+            guild_id: int | None,
+            channel_id: int,
+            messages: list[tuple]) -> None:
+        """
+        Queue a chat log to be written.
+
+        Parameters
+        ----------
+        log_id : str
+            The ID of the chat log.
+        guild_id : int | None
+            The ID of the guild that the log was made in.
+        channel_id : int
+            The ID of the channel that the log was made in.
+        messages : list[tuple]
+            The messages in the log, oldest first, with their fields in the
+            same order as :attr:`MESSAGE_COLUMNS`.
+        """
+
+        self._queue.append(_PendingLog(log_id, guild_id, channel_id, messages))
+        self._queued_rows += len(messages)
+        self._waiters[log_id] = asyncio.get_running_loop().create_future()
+        self._start()
+        assert self._wakeup
+        if self._queued_rows >= self.batch_size:
+            self._wakeup.set()
+
+    async def wait_for(self, log_id: str) -> None:
+        """
+        Wait until a queued chat log has been written to the database.
+        Returns immediately if the log isn't queued.
+
+        Parameters
+        ----------
+        log_id : str
+            The ID of the chat log.
+
+        Raises
+        ------
+        Exception
+            The log couldn't be written.
+        """
+
+        waiter = self._waiters.get(log_id)
+        if waiter is not None:
+            await asyncio.shield(waiter)
+
+    async def flush(self) -> None:
+        """
+        Write everything that's currently queued.
+        """
+
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        async with self._write_lock:
+            while self._queue:
+                await self._write_batch()
+
+    async def close(self) -> None:
+        """
+        Stop the background writer and flush anything that's left.
+        """
+
+        # Let the writer finish whatever it's in the middle of rather than
+        # cancelling it, since a cancelled write would lose its batch
+        if self._task is not None:
+            self._closing = True
+            assert self._wakeup
+            self._wakeup.set()
+            try:
+                await self._task
+            finally:
+                self._closing = False
+                self._task = None
+
+        # Failed logs are retried until they run out of attempts, so this
+        # always finishes
+        while self._queue:
+            try:
+                await self.flush()
+            except Exception as e:
+                log.exception("Failed to flush chat logs on close", exc_info=e)
+
+    def _start(self) -> None:
+        """
+        Start the background writer if it isn't already running.
+        """
+
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        """
+        Flush the queue whenever it's full or the interval passes.
+        """
+
+        assert self._wakeup
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._closing:
+                return
+            try:
+                await self.flush()
+            except Exception as e:
+                log.exception("Failed to flush chat logs", exc_info=e)
+                if not self._closing:
+                    await asyncio.sleep(self.flush_interval)
+
+    async def _write_batch(self) -> None:
+        """
+        Take a batch of logs off the front of the queue and write them.
+        """
+
+        # Take whole logs until the batch is big enough
+        batch: list[_PendingLog] = []
+        batch_rows = 0
+        while self._queue and batch_rows < self.batch_size:
+            pending = self._queue.popleft()
+            batch.append(pending)
+            batch_rows += len(pending.messages)
+        self._queued_rows -= batch_rows
+
+        # Hash each message's content, and only send each version once
+        hashes: dict[str, list[int]] = {}
+        new_messages: dict[tuple[int, int], tuple] = {}
+        for pending in batch:
+            log_hashes = hashes[pending.log_id] = []
+            for message in pending.messages:
+                content_hash = self.content_hash(message[3])
+                log_hashes.append(content_hash)
+                new_messages[(message[0], content_hash)] = (
+                    message[0],
+                    content_hash,
+                    pending.guild_id,
+                    pending.channel_id,
+                    *message[1:],
+                )
+
+        # Write them
+        try:
+            async with db.Database.acquire() as conn:
+                async with conn.transaction():
+                    if new_messages:
+                        await conn.execute(
+                            """
+                            CREATE TEMPORARY TABLE
+                                logged_messages_staging
+                                (
+                                    message_id BIGINT,
+                                    content_hash BIGINT,
+                                    guild_id BIGINT,
+                                    channel_id BIGINT,
+                                    author_id BIGINT,
+                                    author_name TEXT,
+                                    message_content TEXT
+                                )
+                            ON COMMIT DROP
+                            """,
+                        )
+                        await conn.copy_records_to_table(
+                            "logged_messages_staging",
+                            records=list(new_messages.values()),
+                        )
+                        await conn.execute(
+                            """
+                            INSERT INTO
+                                logged_messages
+                                (
+                                    message_id,
+                                    content_hash,
+                                    guild_id,
+                                    channel_id,
+                                    author_id,
+                                    author_name,
+                                    message_content
+                                )
+                            SELECT
+                                *
+                            FROM
+                                logged_messages_staging
+                            ON CONFLICT
+                                (message_id, content_hash)
+                            DO NOTHING
+                            """,
+                        )
+                    await conn.copy_records_to_table(
+                        "chat_logs",
+                        records=[
+                            (
+                                uuid.UUID(pending.log_id),
+                                pending.guild_id,
+                                pending.channel_id,
+                                [i[0] for i in pending.messages],
+                                hashes[pending.log_id],
+                                pending.timestamp,
+                            )
+                            for pending in batch
+                        ],
+                        columns=self.LOG_COLUMNS,
+                    )
+        except Exception as e:
+            self._retry(batch, e)
+            raise
+
+        # And let anyone waiting know
+        for pending in batch:
+            waiter = self._waiters.pop(pending.log_id, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+
+    def _retry(self, batch: list[_PendingLog], error: Exception) -> None:
+        """
+        Put a failed batch back on the queue, dropping any logs that have
+        run out of attempts.
+        """
+
+        for pending in reversed(batch):
+            pending.attempts += 1
+            if pending.attempts < self.max_attempts:
+                self._queue.appendleft(pending)
+                self._queued_rows += len(pending.messages)
+                continue
+            log.error("Dropping chat log %s after %s attempts", pending.log_id, pending.attempts)
+            waiter = self._waiters.pop(pending.log_id, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_exception(error)
+                waiter.exception()  # Don't warn if nobody was waiting
+
+
+chat_log_writer = ChatLogWriter()
@@ -17,59 +17,344 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+import asyncio
+import logging
+from datetime import timedelta
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Iterator, Sequence
 
-from .message_queuer import MaxLenList
+import novus
+
+from plugins.moderation.messages import MessageHandler
+from .rest_scheduler import Priority, rest_scheduler
+from .time_utils import datetime_to_snowflake
 
 if TYPE_CHECKING:
-    import novus
+    from novus.api import HTTPConnection
 
 __all__ = (
+    "DeleteResult",
     "delete_messages",
+    "purge_user_messages",
 )
 
 
-async def delete_messages(
-            channel: novus.abc.StateSnowflake,
-            user: novus.abc.Snowflake | None,
-            num_messages: int = 100,
-            reason: str | None = None) -> None:
+log = logging.getLogger("utils.clear_utils")
+
+BULK_DELETE_LIMIT = 100
+BULK_DELETE_MAX_AGE = timedelta(days=14)
+FETCH_PAGE_SIZE = 100
+MAX_SCANNED_MESSAGES = 5_000
+
+
+def _chunks(items: Sequence[int], size: int) -> Iterator[Sequence[int]]:
+    """
+    Split a sequence into chunks of at most the given size.
+    """
+
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _bulk_delete_cutoff() -> int:
+    """
+    Get the oldest message ID that can still be bulk deleted, with a little
+    leeway for requests that take a while to go out.
+    """
+
+    return datetime_to_snowflake(
+        novus.utils.utcnow()
+        - BULK_DELETE_MAX_AGE
+        + timedelta(minutes=5)
+    )
+
+
+class DeleteResult:
+    """
+    The running totals for a message deletion.
+
+    Attributes
+    ----------
+    found : int
+        The number of messages that were found to delete.
+    bulk_deleted : int
+        The number of messages deleted via bulk deletes.
+    single_deleted : int
+        The number of messages deleted one at a time.
+    failed : int
+        The number of messages that couldn't be deleted.
+    """
+
+    found: int
+    bulk_deleted: int
+    single_deleted: int
+    failed: int
+
+    def __init__(self):
+        self.found = 0
+        self.bulk_deleted = 0
+        self.single_deleted = 0
+        self.failed = 0
+
+    @property
+    def deleted(self) -> int:
         """
-        Delete messages from a user in the interaction channel.
-
-        Parameters
-        ----------
-        channel : novus.abc.StateSnowflake
-            The channel that you want to delete messages in.
-        user : novus.abc.Snowflake
-            The user whose messages you want to delete.
-            If no one is provided, the bot will ignore author checks
-        num_messages : int
-            The number of messages to delete.
-        reason : str
-            The reason for deleting these messages
+        The total number of messages that were deleted.
         """
 
-        # Get messages
-        messages = await novus.Channel.fetch_messages(channel)  # pyright: ignore
-
-        # Filter to only ones sent by the user
-        delete_ids: MaxLenList[int] = MaxLenList(num_messages)
-        last_message: novus.Message | None = None
-        for last_message in messages:
-            if user and last_message.author.id != user.id:
-                continue
-            delete_ids.append(last_message.id)
-
-        # Delete appropriately
-        if not delete_ids:
-            return  # No messages to delete
-        elif len(delete_ids) == 1:
-            assert last_message
-            await last_message.delete(reason=reason)
-        else:
-            await novus.Channel.bulk_delete_messages(
+        return self.bulk_deleted + self.single_deleted
+
+    @property
+    def remaining(self) -> int:
+        """
+        The number of found messages that haven't been dealt with yet.
+        """
+
+        return self.found - self.deleted - self.failed
+
+
+async def _collect_message_ids(
+        channel: novus.abc.StateSnowflake,
+        user: novus.abc.Snowflake | None,
+        num_messages: int) -> list[int]:
+    """
+    Get the IDs of the most recent messages in a channel (optionally from a
+    single user), newest first. The message cache is used for as long as it
+    can be, and the channel history is only fetched past the oldest cached
+    message.
+    """
+
+    found: list[int] = []
+    scanned = 0
+    before_id: int | None = None
+
+    # Walk backwards through the cache
+    channel_cache = MessageHandler.message_cache.get_channel(channel.id)
+    if channel_cache is not None:
+        while len(found) < num_messages and scanned < MAX_SCANNED_MESSAGES:
+            page = channel_cache.before(before_id or 1 << 64, FETCH_PAGE_SIZE)
+            if not page:
+                break
+            for message in reversed(page):
+                scanned += 1
+                if user is None or message.author_id == user.id:
+                    found.append(message.id)
+                    if len(found) >= num_messages:
+                        break
+            before_id = page[0].id
+
+    # Page back through the channel history for whatever's left
+    while len(found) < num_messages and scanned < MAX_SCANNED_MESSAGES:
+        messages = await rest_scheduler.call(
+            novus.Channel.fetch_messages(  # pyright: ignore
                 channel,
-                delete_ids,
-                reason=reason,
+                limit=FETCH_PAGE_SIZE,
+                before=before_id,
+            ),
+            priority=Priority.MODERATION,
+            route=f"channels/{channel.id}/messages",
+        )
+        if not messages:
+            break
+        for message in messages:
+            scanned += 1
+            if user is None or message.author.id == user.id:
+                found.append(message.id)
+                if len(found) >= num_messages:
+                    break
+        before_id = min(i.id for i in messages)
+        if len(messages) < FETCH_PAGE_SIZE:
+            break
+    return found
+
+
+async def delete_messages(
+        channel: novus.abc.StateSnowflake,
+        user: novus.abc.Snowflake | None,
+        num_messages: int = 100,
+        reason: str | None = None,
+        *,
+        on_progress: Callable[[DeleteResult], Awaitable[Any]] | None = None) -> DeleteResult:
+    """
+    Delete messages from a user in the interaction channel.
+
+    Messages are deleted in bulk, 100 at a time. Messages too old to be bulk
+    deleted are deleted one by one instead, one request at a time so that
+    they're paced by the rate limit.
+
+    Parameters
+    ----------
+    channel : novus.abc.StateSnowflake
+        The channel that you want to delete messages in.
+    user : novus.abc.Snowflake
+        The user whose messages you want to delete.
+        If no one is provided, the bot will ignore author checks
+    num_messages : int
+        The number of messages to delete.
+    reason : str
+        The reason for deleting these messages
+    on_progress : Callable[[DeleteResult], Awaitable[Any]] | None
+        A coroutine function that's given the running totals after each
+        request.
+
+    Returns
+    -------
+    DeleteResult
+        The totals for the deletion.
+    """
+
+    result = DeleteResult()
+    message_ids = await _collect_message_ids(channel, user, int(num_messages))
+    result.found = len(message_ids)
+    cutoff = _bulk_delete_cutoff()
+    bulk_ids = [i for i in message_ids if i >= cutoff]
+    single_ids = [i for i in message_ids if i < cutoff]
+
+    # Bulk delete everything we can
+    for chunk in _chunks(bulk_ids, BULK_DELETE_LIMIT):
+        if len(chunk) == 1:
+            single_ids.insert(0, chunk[0])
+            continue
+        try:
+            await rest_scheduler.call(
+                novus.Channel.bulk_delete_messages(
+                    channel,
+                    chunk,
+                    reason=reason,
+                ),
+                priority=Priority.MODERATION,
+                route=f"channels/{channel.id}/messages",
+            )
+        except novus.Forbidden:
+            result.failed = result.found - result.deleted
+            return result
+        except novus.HTTPException:
+            result.failed += len(chunk)
+        else:
+            result.bulk_deleted += len(chunk)
+        if on_progress:
+            await on_progress(result)
+
+    # And delete the rest individually
+    for message_id in single_ids:
+        try:
+            await rest_scheduler.call(
+                channel.state.channel.delete_message(
+                    channel.id,
+                    message_id,
+                    reason=reason,
+                ),
+                priority=Priority.MODERATION,
+                route=f"channels/{channel.id}/messages",
             )
+        except novus.Forbidden:
+            result.failed = result.found - result.deleted
+            return result
+        except novus.HTTPException:
+            result.failed += 1
+        else:
+            result.single_deleted += 1
+        if on_progress and (result.deleted + result.failed) % 10 == 0:
+            await on_progress(result)
+    return result
+
+
+async def purge_user_messages(
+        state: HTTPConnection,
+        guild_id: int,
+        user_id: int,
+        *,
+        reason: str | None = None,
+        max_concurrency: int = 3) -> int:
+    """
+    Delete a user's recent messages from every channel in a guild, using the
+    message cache rather than fetching each channel's history.
+
+    Messages are grouped per channel and deleted in bulk, 100 at a time.
+    Anything too old to be bulk deleted is skipped.
+
+    Parameters
+    ----------
+    state : novus.api.HTTPConnection
+        The connection to make requests with.
+    guild_id : int
+        The ID of the guild to purge messages from.
+    user_id : int
+        The ID of the user whose messages should be deleted.
+    reason : str | None
+        The reason for deleting these messages.
+    max_concurrency : int
+        The maximum number of channels to delete from at once.
+
+    Returns
+    -------
+    int
+        The number of messages that were deleted.
+    """
+
+    # Group the user's messages by channel
+    cutoff = _bulk_delete_cutoff()
+    channel_message_ids: dict[int, list[int]] = {}
+    for message in MessageHandler.message_cache.by_author(guild_id, user_id):
+        if message.id < cutoff:
+            continue
+        channel_message_ids.setdefault(message.channel_id, []).append(message.id)
+    if not channel_message_ids:
+        return 0
+
+    # Delete from each channel, a few channels at a time
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def purge_channel(channel_id: int, message_ids: list[int]) -> int:
+        deleted = 0
+        failed = 0
+        channel = novus.Channel.partial(state, channel_id)
+        async with semaphore:
+            for chunk in _chunks(message_ids, BULK_DELETE_LIMIT):
+                try:
+                    if len(chunk) == 1:
+                        request = state.channel.delete_message(
+                            channel_id,
+                            chunk[0],
+                            reason=reason,
+                        )
+                    else:
+                        request = novus.Channel.bulk_delete_messages(
+                            channel,
+                            chunk,
+                            reason=reason,
+                        )
+                    await rest_scheduler.call(
+                        request,
+                        priority=Priority.MODERATION,
+                        route=f"channels/{channel_id}/messages",
+                    )
+                except (novus.Forbidden, novus.NotFound):
+                    # We can't delete here, so don't keep trying
+                    failed = len(message_ids) - deleted
+                    break
+                except novus.HTTPException:
+                    failed += len(chunk)
+                    continue
+                deleted += len(chunk)
+        if failed:
+            log.warning(
+                "Failed to delete %s of %s messages from channel %s",
+                failed, len(message_ids), channel_id,
+            )
+        return deleted
+
+    # One channel going wrong shouldn't stop the rest being counted
+    results = await asyncio.gather(
+        *(
+            purge_channel(channel_id, message_ids)
+            for channel_id, message_ids in channel_message_ids.items()
+        ),
+        return_exceptions=True,
+    )
+    deleted = 0
+    for result in results:
+        if isinstance(result, BaseException):
+            log.error("Failed to purge messages from a channel", exc_info=result)
+        else:
+            deleted += result
+    return deleted
@@ -0,0 +1,166 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import csv
+from datetime import datetime as dt
+import gzip
+import json
+import os
+from typing import TYPE_CHECKING, Any, AsyncIterable, Literal, Mapping, Sequence
+
+if TYPE_CHECKING:
+    import asyncpg
+
+__all__ = (
+    "ExportFormat",
+    "export_query",
+    "export_records",
+)
+
+
+ExportFormat = Literal["csv", "ndjson"]
+
+
+async def export_query(
+        conn: asyncpg.Connection,
+        query: str,
+        *args: Any,
+        path: str | os.PathLike[str],
+        format: ExportFormat = "csv") -> int:
+    """
+    Stream the results of a query into a gzipped CSV or NDJSON file with
+    ``COPY``. Rows go straight from the database into the file, so the
+    export takes the same amount of memory however many rows there are.
+
+    Parameters
+    ----------
+    conn : asyncpg.Connection
+        An open database connection.
+    query : str
+        The query to export the results of.
+    *args : Any
+        Arguments for the query.
+    path : str | os.PathLike[str]
+        Where to write the file.
+    format : ExportFormat
+        Whether to write CSV (with a header) or one JSON object per line.
+
+    Returns
+    -------
+    int
+        The number of rows that were exported.
+    """
+
+    with gzip.open(path, "wb") as output:
+        if format == "csv":
+            status = await conn.copy_from_query(
+                query,
+                *args,
+                output=output,
+                format="csv",
+                header=True,
+            )
+        else:
+            # Postgres will make the JSON, but the text format would escape
+            # its backslashes; CSV with a quote and delimiter that can't
+            # appear in JSON writes it untouched
+            status = await conn.copy_from_query(
+                f"SELECT ROW_TO_JSON(export) FROM ({query}) export",
+                *args,
+                output=output,
+                format="csv",
+                quote="\x01",
+                delimiter="\x02",
+            )
+    return int(status.split()[-1])
+
+
+def _timestamp_text(value: dt, sep: str) -> str:
+    """
+    Write a timestamp the way Postgres does, with the trailing zeros of its
+    fraction of a second dropped (and no fraction at all if it's zero),
+    rather than the six digits or nothing that Python gives.
+    """
+
+    text = value.replace(microsecond=0).isoformat(sep=sep)
+    if value.microsecond:
+        text += f".{value.microsecond:06d}".rstrip("0")
+    return text
+
+
+def _export_value(value: Any, format: ExportFormat) -> Any:
+    """
+    Turn a value into what Postgres would have written for it.
+    """
+
+    if value is None:
+        return None if format == "ndjson" else ""
+    if isinstance(value, dt):
+        return _timestamp_text(value, "T" if format == "ndjson" else " ")
+    if isinstance(value, (int, float, bool, str)):
+        return value
+    return str(value)
+
+
+async def export_records(
+        records: AsyncIterable[Mapping[str, Any]],
+        path: str | os.PathLike[str],
+        format: ExportFormat = "csv",
+        *,
+        columns: Sequence[str],
+        header: bool = False) -> int:
+    """
+    Append records to a gzipped CSV or NDJSON file, in the same shape as
+    :func:`export_query` writes. This is for rows that Postgres can't make
+    itself (such as ones that need decompressing first), and they're
+    written as they arrive.
+
+    Parameters
+    ----------
+    records : AsyncIterable[Mapping[str, Any]]
+        The rows to write.
+    path : str | os.PathLike[str]
+        The file to append to.
+    format : ExportFormat
+        Whether to write CSV or one JSON object per line.
+    columns : Sequence[str]
+        The keys to write from each record, in order.
+    header : bool
+        Whether to write a CSV header first. Leave this off when appending
+        to a file made by :func:`export_query`.
+
+    Returns
+    -------
+    int
+        The number of rows that were exported.
+    """
+
+    count = 0
+    with gzip.open(path, "at", encoding="utf-8", newline="") as output:
+        writer = csv.writer(output, lineterminator="\n")
+        if format == "csv" and header:
+            writer.writerow(columns)
+        async for record in records:
+            values = [_export_value(record[c], format) for c in columns]
+            if format == "csv":
+                writer.writerow(values)
+            else:
+                output.write(json.dumps(dict(zip(columns, values))) + "\n")
+            count += 1
+    return count
@@ -0,0 +1,247 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, NamedTuple
+
+from novus.ext import database as db
+
+from .history_cache import history_cache
+from .invalidation_bus import invalidation_bus
+
+__all__ = (
+    "GuildSettings",
+    "GuildSettingsCache",
+    "guild_settings",
+)
+
+
+class GuildSettings(NamedTuple):
+    """
+    The settings for a guild, as stored in the ``guild_settings`` table.
+    Guilds that have never changed a setting get every field as ``None``.
+    """
+
+    guild_id: int
+    report_channel_id: int | None = None
+    staff_role_id: int | None = None
+    message_channel_id: int | None = None
+    custom_role_allowed_role_id: int | None = None
+    custom_role_beneath_role_id: int | None = None
+    action_retention_days: int | None = None
+    chat_log_retention_days: int | None = None
+    log_webhooks: bool | None = None
+    message_webhook_ids: list[int] | None = None
+    report_webhook_ids: list[int] | None = None
+
+    @classmethod
+    def from_row(cls, row: Any) -> GuildSettings:
+        """
+        Make settings from a ``guild_settings`` row, ignoring any columns
+        that aren't settings.
+        """
+
+        return cls(**{
+            field: row[field]
+            for field in cls._fields
+            if field in row.keys()
+        })
+
+
+class GuildSettingsCache:
+    """
+    Every guild's settings, held in memory so that reading them doesn't
+    need a trip to the database.
+
+    The whole table is loaded in one query by :meth:`preload` when the bot
+    starts, or failing that the first time any guild is asked for. After
+    that a guild without a row is known to have the default settings, so
+    it's cached as such rather than looked up again.
+    Changes made through :meth:`set` are written to the database and then
+    to the cache, and other processes are told to reload the guild through
+    the invalidation bus.
+    """
+
+    def __init__(self):
+        self._settings: dict[int, GuildSettings] = {}
+        self._loaded: bool = False
+        self._lock: asyncio.Lock | None = None
+
+    def __len__(self) -> int:
+        return len(self._settings)
+
+    async def preload(self) -> None:
+        """
+        Load every guild's settings, if they aren't loaded already.
+        """
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._loaded:
+                return
+            async with db.Database.acquire() as conn:
+                rows = await conn.fetch(
+                    """
+                    SELECT
+                        *
+                    FROM
+                        guild_settings
+                    """
+                )
+            self._settings = {
+                r["guild_id"]: GuildSettings.from_row(r)
+                for r in rows
+            }
+            self._loaded = True
+
+    async def get(self, guild_id: int) -> GuildSettings:
+        """
+        Get the settings for a guild.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild.
+
+        Returns
+        -------
+        GuildSettings
+            The guild's settings.
+        """
+
+        if not self._loaded:
+            await self.preload()
+        try:
+            return self._settings[guild_id]
+        except KeyError:
+            settings = self._settings[guild_id] = GuildSettings(guild_id)
+            return settings
+
+    async def set(self, guild_id: int, column: str, value: Any) -> None:
+        """
+        Set one of a guild's settings, in the database and then in the
+        cache.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild.
+        column : str
+            The name of the setting.
+        value : Any
+            The new value of the setting.
+
+        Raises
+        ------
+        ValueError
+            The column isn't a guild setting.
+        """
+
+        if column not in GuildSettings._fields or column == "guild_id":
+            raise ValueError(f"{column!r} is not a guild setting")
+        async with db.Database.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO
+                    guild_settings
+                    (
+                        guild_id,
+                        {0}
+                    )
+                VALUES
+                    (
+                        $1,
+                        $2
+                    )
+                ON CONFLICT (guild_id)
+                DO UPDATE
+                SET
+                    {0} = excluded.{0}
+                """.format(column),
+                guild_id,
+                value,
+            )
+            await invalidation_bus.notify(conn, "guild_settings", guild_id)
+
+        # Wait for any preload that's already running, so it can't put
+        # back the old value after we've updated it
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if column == "action_retention_days":
+                # Cached history pages are cut off by the old retention
+                history_cache.invalidate_guild(guild_id)
+            if not self._loaded:
+                return
+            current = self._settings.get(guild_id) or GuildSettings(guild_id)
+            self._settings[guild_id] = current._replace(**{column: value})
+
+    async def reload(self, guild_id: int | str) -> None:
+        """
+        Read a guild's settings from the database again, after another
+        process has changed them.
+
+        Parameters
+        ----------
+        guild_id : int | str
+            The ID of the guild.
+        """
+
+        guild_id = int(guild_id)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._loaded:
+                history_cache.invalidate_guild(guild_id)
+                return
+            async with db.Database.acquire() as conn:
+                row = await conn.fetchrow(
+                    """
+                    SELECT
+                        *
+                    FROM
+                        guild_settings
+                    WHERE
+                        guild_id = $1
+                    """,
+                    guild_id,
+                )
+            old = self._settings.get(guild_id)
+            if row is None:
+                new = self._settings[guild_id] = GuildSettings(guild_id)
+            else:
+                new = self._settings[guild_id] = GuildSettings.from_row(row)
+            if old is None or old.action_retention_days != new.action_retention_days:
+                history_cache.invalidate_guild(guild_id)
+
+    def clear(self) -> None:
+        """
+        Forget every guild's settings, so that they're loaded again the
+        next time they're asked for. Cached history pages are dropped too,
+        since any guild's retention might have changed.
+        """
+
+        self._settings.clear()
+        self._loaded = False
+        history_cache.clear()
+
+
+guild_settings = GuildSettingsCache()
+invalidation_bus.subscribe("guild_settings", guild_settings.reload, guild_settings.clear)
@@ -0,0 +1,249 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import collections
+from typing import Any, Hashable, NamedTuple
+
+__all__ = (
+    "HistoryCache",
+    "HistoryCacheStats",
+    "history_cache",
+)
+
+
+class HistoryCacheStats(NamedTuple):
+    """
+    How well the history cache is doing.
+    """
+
+    entries: int
+    hits: int
+    misses: int
+    invalidations: int
+
+
+class HistoryCache:
+    """
+    A size-bounded LRU cache of history pages, keyed by guild, user and
+    page cursor.
+
+    Every (guild, user) pair has a version that's bumped whenever it's
+    invalidated, and every guild has an epoch that's bumped whenever its
+    whole history is (such as when its retention changes). Pages are only
+    stored if neither has changed since they were read, so a page read
+    while an action was being written can't be cached after the
+    invalidation for that action.
+
+    Versions come from one counter and only the newest ``max_entries``
+    are kept; once a user's version is dropped it reads as the highest
+    version dropped so far, so it can never go backwards.
+
+    Parameters
+    ----------
+    max_entries : int
+        The most pages to hold.
+    """
+
+    def __init__(self, max_entries: int = 5_000):
+        self.max_entries = max_entries
+        self._pages: collections.OrderedDict[tuple[int, int, Hashable], Any] = collections.OrderedDict()
+        self._keys: dict[tuple[int, int], set[Hashable]] = {}
+        self._versions: dict[tuple[int, int], int] = {}
+        self._version_floor: int = 0
+        self._next_version: int = 0
+        self._guild_epochs: dict[int, int] = {}
+        self._epoch: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.invalidations: int = 0
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    @property
+    def stats(self) -> HistoryCacheStats:
+        """
+        The current size of the cache and its hit and miss counts.
+        """
+
+        return HistoryCacheStats(
+            entries=len(self._pages),
+            hits=self.hits,
+            misses=self.misses,
+            invalidations=self.invalidations,
+        )
+
+    def version(self, guild_id: int, user_id: int) -> tuple[int, int, int]:
+        """
+        Get the current version of a user's history. Take this before
+        reading a page and pass it to :meth:`put`.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild.
+        user_id : int
+            The ID of the user.
+
+        Returns
+        -------
+        tuple[int, int, int]
+            The version of the user's history.
+        """
+
+        return (
+            self._epoch,
+            self._guild_epochs.get(guild_id, 0),
+            self._versions.get((guild_id, user_id), self._version_floor),
+        )
+
+    def get(self, guild_id: int, user_id: int, cursor: Hashable) -> Any | None:
+        """
+        Get a cached page.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild.
+        user_id : int
+            The ID of the user.
+        cursor : Hashable
+            Whatever identifies the page.
+
+        Returns
+        -------
+        Any | None
+            The page, if it's cached.
+        """
+
+        key = (guild_id, user_id, cursor)
+        try:
+            page = self._pages[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._pages.move_to_end(key)
+        self.hits += 1
+        return page
+
+    def put(
+            self,
+            guild_id: int,
+            user_id: int,
+            cursor: Hashable,
+            page: Any,
+            *,
+            version: tuple[int, int, int]) -> None:
+        """
+        Cache a page, as long as the user's history hasn't been invalidated
+        since it was read.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild.
+        user_id : int
+            The ID of the user.
+        cursor : Hashable
+            Whatever identifies the page.
+        page : Any
+            The page to cache.
+        version : tuple[int, int, int]
+            The version from :meth:`version` from before the page was read.
+        """
+
+        if version != self.version(guild_id, user_id):
+            return
+        key = (guild_id, user_id, cursor)
+        self._pages[key] = page
+        self._pages.move_to_end(key)
+        self._keys.setdefault((guild_id, user_id), set()).add(cursor)
+        while len(self._pages) > self.max_entries:
+            (old_guild_id, old_user_id, old_cursor), _ = self._pages.popitem(last=False)
+            keys = self._keys[(old_guild_id, old_user_id)]
+            keys.discard(old_cursor)
+            if not keys:
+                del self._keys[(old_guild_id, old_user_id)]
+                self._forget_version((old_guild_id, old_user_id))
+
+    def _forget_version(self, user: tuple[int, int]) -> None:
+        """
+        Stop keeping a user's version, raising the floor so that it still
+        can't go backwards.
+        """
+
+        version = self._versions.pop(user, None)
+        if version is not None:
+            self._version_floor = max(self._version_floor, version)
+
+    def invalidate(self, guild_id: int, user_id: int) -> None:
+        """
+        Drop all of the cached pages for a user.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild.
+        user_id : int
+            The ID of the user.
+        """
+
+        user = (guild_id, user_id)
+        self._next_version += 1
+        self._versions.pop(user, None)
+        self._versions[user] = self._next_version
+        self.invalidations += 1
+        for cursor in self._keys.pop(user, ()):
+            del self._pages[(guild_id, user_id, cursor)]
+
+        # Only keep the newest versions
+        while len(self._versions) > self.max_entries:
+            self._forget_version(next(iter(self._versions)))
+
+    def invalidate_guild(self, guild_id: int) -> None:
+        """
+        Drop all of the cached pages for every user in a guild.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild.
+        """
+
+        self._guild_epochs[guild_id] = self._guild_epochs.get(guild_id, 0) + 1
+        self.invalidations += 1
+        for user in [i for i in self._keys if i[0] == guild_id]:
+            for cursor in self._keys.pop(user):
+                del self._pages[(*user, cursor)]
+            self._forget_version(user)
+
+    def clear(self) -> None:
+        """
+        Drop every cached page.
+        """
+
+        self._epoch += 1
+        self._versions.clear()
+        self._guild_epochs.clear()
+        self._pages.clear()
+        self._keys.clear()
+        self.invalidations += 1
+
+
+history_cache = HistoryCache()
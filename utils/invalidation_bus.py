@@ -0,0 +1,224 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import inspect
+import logging
+import uuid
+from typing import Any, Awaitable, Callable
+
+import asyncpg
+
+__all__ = (
+    "InvalidationBus",
+    "invalidation_bus",
+)
+
+
+log = logging.getLogger("utils.invalidation_bus")
+
+KeyCallback = Callable[[str], "Awaitable[Any] | Any"]
+ResetCallback = Callable[[], "Awaitable[Any] | Any"]
+
+
+class InvalidationBus:
+    """
+    Tells every bot process when a cached table has changed, using
+    Postgres ``LISTEN``/``NOTIFY``.
+
+    Writers call :meth:`notify` on the connection that they made the change
+    with, so the notification is only sent if the change is committed.
+    Every process listens on its own dedicated connection and passes the
+    changed key to whatever subscribed to that table. A process doesn't
+    hear its own notifications; it's expected to have updated its own cache
+    already.
+
+    If the listening connection drops then notifications could have been
+    missed, so every subscriber is reset before listening again.
+
+    Parameters
+    ----------
+    channel : str
+        The name of the notification channel.
+    reconnect_delay : float
+        How many seconds to wait before reconnecting after the listening
+        connection is lost.
+    """
+
+    def __init__(
+            self,
+            channel: str = "voxelmod_invalidate",
+            reconnect_delay: float = 5.0):
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.origin = uuid.uuid4().hex
+        self._subscribers: dict[str, list[tuple[KeyCallback, ResetCallback | None]]] = {}
+        self._task: asyncio.Task | None = None
+        self._callbacks: set[asyncio.Task] = set()
+
+    def subscribe(
+            self,
+            table: str,
+            on_change: KeyCallback,
+            on_reset: ResetCallback | None = None) -> None:
+        """
+        Ask to be told when a table is changed by another process.
+
+        Parameters
+        ----------
+        table : str
+            The name of the table.
+        on_change : Callable[[str], Any]
+            Called with the key that was changed. Can be a coroutine
+            function.
+        on_reset : Callable[[], Any] | None
+            Called when notifications might have been missed, so the whole
+            cache should be dropped. Can be a coroutine function.
+        """
+
+        self._subscribers.setdefault(table, []).append((on_change, on_reset))
+
+    def unsubscribe(self, table: str, on_change: KeyCallback) -> None:
+        """
+        Stop being told when a table is changed.
+
+        Parameters
+        ----------
+        table : str
+            The name of the table.
+        on_change : Callable[[str], Any]
+            The callback that was given to :meth:`subscribe`.
+        """
+
+        self._subscribers[table] = [
+            i
+            for i in self._subscribers.get(table, ())
+            if i[0] != on_change
+        ]
+
+    async def notify(self, conn: asyncpg.Connection, table: str, key: Any) -> None:
+        """
+        Tell every other process that a key in a table has changed.
+
+        Parameters
+        ----------
+        conn : asyncpg.Connection
+            The connection that the change was made on.
+        table : str
+            The name of the table.
+        key : Any
+            The key that was changed, which is sent as a string.
+        """
+
+        await conn.execute(
+            "SELECT PG_NOTIFY($1, $2)",
+            self.channel,
+            f"{self.origin} {table} {key}",
+        )
+
+    def start(self, dsn: str) -> None:
+        """
+        Start listening for notifications, if we aren't already.
+
+        Parameters
+        ----------
+        dsn : str
+            The database to connect to.
+        """
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(dsn))
+
+    async def close(self) -> None:
+        """
+        Stop listening for notifications.
+        """
+
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self, dsn: str) -> None:
+        while True:
+            lost = asyncio.Event()
+            conn: asyncpg.Connection | None = None
+            try:
+                conn = await asyncpg.connect(dsn)
+                conn.add_termination_listener(lambda _: lost.set())
+                await conn.add_listener(self.channel, self._on_notification)
+
+                # Anything could have changed while we weren't listening
+                self._reset()
+                await lost.wait()
+                log.warning("Lost the invalidation connection; reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error("Failed to listen for invalidations", exc_info=e)
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            self._reset()
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _on_notification(
+            self,
+            conn: asyncpg.Connection,
+            pid: int,
+            channel: str,
+            payload: str) -> None:
+        try:
+            origin, table, key = payload.split(" ", 2)
+        except ValueError:
+            log.warning("Ignoring malformed invalidation %r", payload)
+            return
+        if origin == self.origin:
+            return
+        for on_change, _ in self._subscribers.get(table, ()):
+            self._call(on_change, key)
+
+    def _reset(self) -> None:
+        for subscribers in self._subscribers.values():
+            for _, on_reset in subscribers:
+                if on_reset is not None:
+                    self._call(on_reset)
+
+    def _call(self, callback: Callable[..., Any], *args: Any) -> None:
+        try:
+            result = callback(*args)
+        except Exception as e:
+            log.error("Invalidation callback failed", exc_info=e)
+            return
+        if inspect.isawaitable(result):
+            task = asyncio.ensure_future(result)
+            self._callbacks.add(task)
+            task.add_done_callback(self._callback_done)
+
+    def _callback_done(self, task: asyncio.Task) -> None:
+        self._callbacks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Invalidation callback failed", exc_info=task.exception())
+
+
+invalidation_bus = InvalidationBus()
@@ -0,0 +1,265 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import logging
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, NamedTuple
+
+from .rest_scheduler import Priority, rest_scheduler
+
+if TYPE_CHECKING:
+    import novus
+
+__all__ = (
+    "LogBuffer",
+    "LogBufferStats",
+    "Sender",
+    "embed_length",
+    "log_buffer",
+)
+
+
+log = logging.getLogger("utils.log_buffer")
+
+Sender = Callable[[list["novus.Embed"]], Awaitable[Any]]
+
+# Discord's limits for the embeds on a single message
+MAX_EMBEDS = 10
+MAX_EMBED_CHARACTERS = 6_000
+
+
+def embed_length(embed: novus.Embed) -> int:
+    """
+    Count the characters in an embed, the same way that Discord does for
+    its 6000 character limit.
+
+    Parameters
+    ----------
+    embed : novus.Embed
+        The embed to measure.
+
+    Returns
+    -------
+    int
+        The number of characters.
+    """
+
+    total = len(embed.title or "") + len(embed.description or "")
+    if embed.footer is not None:
+        total += len(embed.footer.text or "")
+    if embed.author is not None:
+        total += len(embed.author.name or "")
+    for field in embed.fields:
+        total += len(field.name or "") + len(field.value or "")
+    return total
+
+
+class LogBufferStats(NamedTuple):
+    """
+    How much the log buffer is holding, and how much it's sent.
+    """
+
+    queued_embeds: int
+    queued_channels: int
+    messages_sent: int
+    embeds_sent: int
+
+
+class _QueuedLog:
+
+    __slots__ = ("embeds", "length")
+
+    def __init__(self, embeds: list[novus.Embed]):
+        self.embeds = embeds
+        self.length = sum(embed_length(e) for e in embeds)
+
+
+class LogBuffer:
+    """
+    Collects the embeds going to each log channel and sends them packed
+    into as few messages as possible, rather than one message per event.
+
+    Each channel is flushed when it has a full message's worth of embeds
+    waiting, or a short while after its first embed was queued, whichever
+    is sooner. The embeds for one event are always sent in the same
+    message. Messages go out in the order they were queued unless a
+    channel allows more than one send at a time (such as when it's sent to
+    through several webhooks).
+
+    Parameters
+    ----------
+    flush_interval : float
+        The most seconds that an embed waits before being sent.
+    """
+
+    def __init__(self, flush_interval: float = 2.0):
+        self.flush_interval = flush_interval
+        self._queues: dict[int, collections.deque[_QueuedLog]] = {}
+        self._queued: dict[int, int] = {}
+        self._wakeups: dict[int, asyncio.Event] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._senders: dict[int, tuple[Sender, int]] = {}
+        self._closing: bool = False
+        self.messages_sent: int = 0
+        self.embeds_sent: int = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        The number of embeds that are waiting to be sent.
+        """
+
+        return sum(self._queued.values())
+
+    @property
+    def stats(self) -> LogBufferStats:
+        """
+        The current size of the buffer and how much it's sent.
+        """
+
+        return LogBufferStats(
+            queued_embeds=self.queue_depth,
+            queued_channels=len(self._queues),
+            messages_sent=self.messages_sent,
+            embeds_sent=self.embeds_sent,
+        )
+
+    def add(
+            self,
+            channel: novus.Channel,
+            embeds: list[novus.Embed],
+            *,
+            send: Sender | None = None,
+            concurrency: int = 1) -> None:
+        """
+        Queue the embeds for one event to be sent to a log channel.
+
+        Parameters
+        ----------
+        channel : novus.Channel
+            The channel to send the embeds to.
+        embeds : list[novus.Embed]
+            The embeds, which will be kept together in one message.
+        send : Sender | None
+            How to send the channel's messages, if not as the bot user.
+            The latest one given for a channel is used.
+        concurrency : int
+            How many of the channel's messages can be sent at once with
+            ``send``.
+        """
+
+        if not embeds:
+            return
+        if send is None:
+            self._senders.pop(channel.id, None)
+        else:
+            self._senders[channel.id] = (send, max(1, concurrency))
+        queue = self._queues.setdefault(channel.id, collections.deque())
+        queue.append(_QueuedLog(embeds))
+        self._queued[channel.id] = self._queued.get(channel.id, 0) + len(embeds)
+        if channel.id not in self._tasks:
+            self._wakeups[channel.id] = asyncio.Event()
+            self._tasks[channel.id] = asyncio.create_task(self._drain(channel))
+        elif self._queued[channel.id] >= MAX_EMBEDS:
+            self._wakeups[channel.id].set()
+
+    async def close(self) -> None:
+        """
+        Send everything that's queued straight away, and wait for it to go.
+        """
+
+        self._closing = True
+        try:
+            for wakeup in self._wakeups.values():
+                wakeup.set()
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        finally:
+            self._closing = False
+
+    def _take_batch(self, channel_id: int) -> list[novus.Embed]:
+        """
+        Pop as many queued events as fit in one message.
+        """
+
+        queue = self._queues[channel_id]
+        batch: list[novus.Embed] = []
+        length = 0
+        while queue:
+            item = queue[0]
+            fits = (
+                len(batch) + len(item.embeds) <= MAX_EMBEDS
+                and length + item.length <= MAX_EMBED_CHARACTERS
+            )
+            if batch and not fits:
+                break
+            queue.popleft()
+            batch.extend(item.embeds)
+            length += item.length
+        self._queued[channel_id] -= len(batch)
+        return batch
+
+    async def _send(self, channel: novus.Channel, batch: list[novus.Embed]) -> None:
+        try:
+            sender = self._senders.get(channel.id)
+            if sender is not None:
+                await sender[0](batch)
+            else:
+                await rest_scheduler.call(
+                    channel.send(embeds=batch),
+                    priority=Priority.LOW,
+                    route=f"channels/{channel.id}/messages",
+                )
+        except Exception as e:
+            log.error(
+                "Failed to send %s log embeds to channel %s",
+                len(batch), channel.id, exc_info=e,
+            )
+        else:
+            self.messages_sent += 1
+            self.embeds_sent += len(batch)
+
+    async def _drain(self, channel: novus.Channel) -> None:
+        wakeup = self._wakeups[channel.id]
+        sending: set[asyncio.Task] = set()
+        try:
+            while self._queues.get(channel.id) or sending:
+                concurrency = self._senders.get(channel.id, (None, 1))[1]
+                if not self._queues.get(channel.id) or len(sending) >= concurrency:
+                    _, sending = await asyncio.wait(sending, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                if self._queued[channel.id] < MAX_EMBEDS and not self._closing:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), self.flush_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                wakeup.clear()
+                sending.add(asyncio.create_task(self._send(channel, self._take_batch(channel.id))))
+        finally:
+            for task in sending:
+                task.cancel()
+            del self._tasks[channel.id]
+            del self._wakeups[channel.id]
+            if not self._queues.get(channel.id):
+                self._queues.pop(channel.id, None)
+                self._queued.pop(channel.id, None)
+                self._senders.pop(channel.id, None)
+
+
+log_buffer = LogBuffer()
@@ -0,0 +1,673 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import bisect
+import collections
+import sys
+import time
+from datetime import datetime as dt
+from typing import Callable, Generic, Iterable, Iterator, NamedTuple, Protocol, TypeVar
+
+from .time_utils import datetime_to_snowflake
+
+
+__all__ = (
+    "ChannelMessageCache",
+    "MessageCache",
+    "MessageCacheUsage",
+)
+
+
+class _HasID(Protocol):
+    id: int
+
+
+class _HasAuthor(_HasID, Protocol):
+    guild_id: int | None
+    author_id: int
+
+
+MI = TypeVar("MI", bound=_HasID)
+AM = TypeVar("AM", bound=_HasAuthor)
+
+
+class ChannelMessageCache(Generic[MI]):
+    """
+    A bounded cache of messages for a single channel.
+
+    Message IDs are kept in a ring buffer in snowflake order so that the
+    oldest message can be evicted in constant time, and the messages
+    themselves are indexed by ID so that lookups never scan the channel.
+    Discarded messages leave a gap in the ring that's skipped over until it
+    either rotates out or the ring is compacted.
+
+    Parameters
+    ----------
+    max_entries : int
+        The maximum number of messages kept for the channel.
+    """
+
+    def __init__(self, max_entries: int = 5_000):
+        self.max_entries: int = max(1, max_entries)
+        self._ids: list[int] = []
+        self._start: int = 0
+        self._messages: dict[int, MI] = {}
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self._messages
+
+    def __iter__(self) -> Iterator[MI]:
+        ids, start, size = self._ids, self._start, len(self._ids)
+        for i in range(size):
+            message = self._messages.get(ids[(start + i) % size])
+            if message is not None:
+                yield message
+
+    def _ordered_ids(self) -> list[int]:
+        """
+        Get the message IDs in the ring as a plain list, oldest first.
+        """
+
+        return self._ids[self._start:] + self._ids[:self._start]
+
+    def get(self, message_id: int) -> MI | None:
+        """
+        Get a message from the cache by its ID.
+
+        Parameters
+        ----------
+        message_id : int
+            The ID of the message you want to retrieve.
+
+        Returns
+        -------
+        MI | None
+            The cached message, if one could be found.
+        """
+
+        return self._messages.get(message_id)
+
+    def append(self, message: MI) -> MI | None:
+        """
+        Add a message to the cache, evicting the oldest message if the cache
+        is full.
+
+        Parameters
+        ----------
+        message : MI
+            The message to add.
+
+        Returns
+        -------
+        MI | None
+            The message that was evicted to make room, if any.
+        """
+
+        message_id = message.id
+
+        # Messages we already have are just swapped out in place
+        if message_id in self._messages:
+            self._messages[message_id] = message
+            return None
+
+        # Gateway messages almost always arrive in order, but if one doesn't
+        # then we take the slow path so that the ring stays sorted
+        if self._ids and message_id <= self._ids[self._start - 1]:
+            return self._insert_unordered(message)
+
+        # Grow the ring until it's full, then overwrite the oldest slot
+        self._messages[message_id] = message
+        if len(self._ids) < self.max_entries:
+            self._ids.append(message_id)
+            return None
+        evicted_id = self._ids[self._start]
+        self._ids[self._start] = message_id
+        self._start = (self._start + 1) % len(self._ids)
+        return self._messages.pop(evicted_id, None)
+
+    def _insert_unordered(self, message: MI) -> MI | None:
+        """
+        Insert a message whose ID is older than the newest cached message.
+        """
+
+        ordered = self._ordered_ids()
+        index = bisect.bisect_left(ordered, message.id)
+        self._messages[message.id] = message
+        if index < len(ordered) and ordered[index] == message.id:
+            return None  # Filling in a gap left by a discarded message
+        ordered.insert(index, message.id)
+        evicted: MI | None = None
+        if len(ordered) > self.max_entries:
+            evicted = self._messages.pop(ordered.pop(0), None)
+        self._ids = ordered
+        self._start = 0
+        return evicted
+
+    def discard(self, message_id: int) -> MI | None:
+        """
+        Remove a message from the cache, such as when it's been deleted.
+
+        Parameters
+        ----------
+        message_id : int
+            The ID of the message to remove.
+
+        Returns
+        -------
+        MI | None
+            The message that was removed, if it was cached.
+        """
+
+        message = self._messages.pop(message_id, None)
+        if message is not None and len(self._messages) * 2 < len(self._ids):
+            self._ids = [i for i in self._ordered_ids() if i in self._messages]
+            self._start = 0
+        return message
+
+    def _id_at(self, index: int) -> int:
+        """
+        Get the message ID at a given position in the ring, oldest first.
+        """
+
+        return self._ids[(self._start + index) % len(self._ids)]
+
+    def _bisect(self, message_id: int) -> int:
+        """
+        Get the position of the first message ID in the ring that's at least
+        the one given.
+        """
+
+        low, high = 0, len(self._ids)
+        while low < high:
+            middle = (low + high) // 2
+            if self._id_at(middle) < message_id:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _slice(self, start: int, stop: int) -> list[MI]:
+        """
+        Get the cached messages between two positions in the ring, oldest
+        first.
+        """
+
+        size = len(self._ids)
+        if start >= stop:
+            return []
+        first = (self._start + start) % size
+        count = stop - start
+        if first + count <= size:
+            ids = self._ids[first:first + count]
+        else:
+            ids = self._ids[first:] + self._ids[:first + count - size]
+        get = self._messages.get
+        return [message for i in ids if (message := get(i)) is not None]
+
+    def _slice_back(self, stop: int, limit: int) -> list[MI]:
+        """
+        Get up to ``limit`` cached messages before a position in the ring,
+        oldest first.
+        """
+
+        found: list[MI] = []
+        while len(found) < limit and stop > 0:
+            start = max(stop - (limit - len(found)), 0)
+            found = self._slice(start, stop) + found
+            stop = start
+        return found
+
+    def latest(self, limit: int) -> list[MI]:
+        """
+        Get the most recent messages from the cache.
+
+        Parameters
+        ----------
+        limit : int
+            The maximum number of messages to return.
+
+        Returns
+        -------
+        list[MI]
+            The cached messages, oldest first.
+        """
+
+        return self._slice_back(len(self._ids), limit)
+
+    def between(self, start: dt, end: dt | None = None) -> list[MI]:
+        """
+        Get the cached messages that were sent between two times.
+
+        Parameters
+        ----------
+        start : datetime.datetime
+            The earliest time to get messages from.
+        end : datetime.datetime | None
+            The latest time to get messages from. If not given, this returns
+            everything since the start time.
+
+        Returns
+        -------
+        list[MI]
+            The matching messages, oldest first.
+        """
+
+        low = self._bisect(datetime_to_snowflake(start))
+        high = len(self._ids)
+        if end is not None:
+            high = self._bisect(datetime_to_snowflake(end, high=True) + 1)
+        return self._slice(low, high)
+
+    def before(self, message_id: int, limit: int) -> list[MI]:
+        """
+        Get the cached messages sent before a given message.
+
+        Parameters
+        ----------
+        message_id : int
+            The ID (or snowflake) to get messages before. The message itself
+            is not included.
+        limit : int
+            The maximum number of messages to return.
+
+        Returns
+        -------
+        list[MI]
+            The messages directly before the given ID, oldest first.
+        """
+
+        return self._slice_back(self._bisect(message_id), limit)
+
+    def nearest(self, snowflake: int) -> MI | None:
+        """
+        Get the cached message whose ID is closest to a given snowflake. This
+        is useful for linking to a real message near something that isn't
+        one (such as an interaction).
+
+        Parameters
+        ----------
+        snowflake : int
+            The snowflake to look near.
+
+        Returns
+        -------
+        MI | None
+            The closest message, if the cache has any.
+        """
+
+        index = self._bisect(snowflake)
+        older = self._slice_back(index, 1)
+        newer = self._slice(index, min(index + 1, len(self._ids)))
+        while not newer and index < len(self._ids):
+            index += 1
+            newer = self._slice(index, min(index + 1, len(self._ids)))
+        candidates = older + newer
+        if not candidates:
+            return None
+        return min(candidates, key=lambda i: abs(i.id - snowflake))
+
+    def resize(self, max_entries: int) -> list[MI]:
+        """
+        Change the maximum size of the cache.
+
+        Parameters
+        ----------
+        max_entries : int
+            The new maximum number of messages kept for the channel.
+
+        Returns
+        -------
+        list[MI]
+            Any messages that were evicted because of the resize.
+        """
+
+        self.max_entries = max(1, max_entries)
+        ordered = [i for i in self._ordered_ids() if i in self._messages]
+        overflow = max(len(ordered) - self.max_entries, 0)
+        evicted = [self._messages.pop(i) for i in ordered[:overflow]]
+        self._ids = ordered[overflow:]
+        self._start = 0
+        return evicted
+
+
+def _approximate_size(message: _HasID) -> int:
+    """
+    A rough guess at how much memory a cached message is holding on to.
+    """
+
+    content: str = getattr(message, "content", None) or ""
+    return 2_048 + sys.getsizeof(content)
+
+
+class MessageCacheUsage(NamedTuple):
+    """
+    A snapshot of how much of its budget a message cache is using.
+    """
+
+    channels: int
+    messages: int
+    bytes: int
+    max_messages: int
+    max_bytes: int | None
+
+
+class MessageCache(Generic[AM]):
+    """
+    A set of per-channel message caches that share one memory budget.
+
+    Channels are kept in order of when they last saw a message. When the
+    budget is exceeded the least recently active channel is shrunk, and
+    then dropped entirely once it's idle or down to its minimum size.
+    Channels that were shrunk grow back when there's room again.
+
+    Every cached message is also indexed by its guild and author, so that a
+    user's recent messages can be found across all channels.
+
+    Parameters
+    ----------
+    max_messages : int
+        The maximum number of messages cached across all channels.
+    max_bytes : int | None
+        The (approximate) maximum size of all cached messages, if any.
+    channel_max_entries : int
+        The largest number of messages cached for a single channel.
+    channel_min_entries : int
+        Channels are dropped rather than shrunk below this many messages.
+    idle_after : float
+        The number of seconds without a message before a channel counts as
+        idle.
+    sizeof : Callable[[AM], int] | None
+        A function estimating the size of a cached message, in bytes.
+    """
+
+    def __init__(
+            self,
+            max_messages: int = 250_000,
+            *,
+            max_bytes: int | None = None,
+            channel_max_entries: int = 5_000,
+            channel_min_entries: int = 100,
+            idle_after: float = 60 * 60,
+            sizeof: Callable[[AM], int] | None = None):
+        self.max_messages: int = max_messages
+        self.max_bytes: int | None = max_bytes
+        self.channel_max_entries: int = channel_max_entries
+        self.channel_min_entries: int = channel_min_entries
+        self.idle_after: float = idle_after
+        self.sizeof: Callable[[AM], int] = sizeof or _approximate_size
+        self._channels: collections.OrderedDict[int, ChannelMessageCache[AM]]
+        self._channels = collections.OrderedDict()
+        self._last_active: dict[int, float] = {}
+        self._authors: dict[tuple[int | None, int], dict[int, int]] = {}
+        self._messages: int = 0
+        self._bytes: int = 0
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def __contains__(self, channel_id: int) -> bool:
+        return channel_id in self._channels
+
+    @property
+    def usage(self) -> MessageCacheUsage:
+        """
+        How much of the budget the cache is currently using.
+        """
+
+        return MessageCacheUsage(
+            channels=len(self._channels),
+            messages=self._messages,
+            bytes=self._bytes,
+            max_messages=self.max_messages,
+            max_bytes=self.max_bytes,
+        )
+
+    def get_channel(self, channel_id: int) -> ChannelMessageCache[AM] | None:
+        """
+        Get the cache for a single channel.
+
+        Parameters
+        ----------
+        channel_id : int
+            The ID of the channel.
+
+        Returns
+        -------
+        ChannelMessageCache | None
+            The channel's cache, if it has one.
+        """
+
+        return self._channels.get(channel_id)
+
+    def get_message(self, channel_id: int, message_id: int) -> AM | None:
+        """
+        Get a message from the cache.
+
+        Parameters
+        ----------
+        channel_id : int
+            The ID of the channel where the message lives.
+        message_id : int
+            The ID of the message you want to retrieve.
+
+        Returns
+        -------
+        AM | None
+            The cached message, if one could be found.
+        """
+
+        channel_cache = self._channels.get(channel_id)
+        if channel_cache is None:
+            return None
+        return channel_cache.get(message_id)
+
+    def append(self, channel_id: int, message: AM) -> None:
+        """
+        Add a message to a channel's cache, evicting older messages if the
+        cache is over budget.
+
+        Parameters
+        ----------
+        channel_id : int
+            The ID of the channel the message was sent in.
+        message : AM
+            The message to add.
+        """
+
+        # Get the channel and mark it as the most recently active
+        channel_cache = self._channels.get(channel_id)
+        if channel_cache is None:
+            channel_cache = ChannelMessageCache(self.channel_max_entries)
+            self._channels[channel_id] = channel_cache
+        else:
+            self._channels.move_to_end(channel_id)
+        self._last_active[channel_id] = time.monotonic()
+
+        # Let channels that were shrunk grow back while there's room
+        if (
+                len(channel_cache) >= channel_cache.max_entries
+                and channel_cache.max_entries < self.channel_max_entries
+                and self._has_room_for(channel_cache.max_entries)):
+            channel_cache.resize(min(
+                channel_cache.max_entries * 2,
+                self.channel_max_entries,
+            ))
+
+        # Add the message
+        replaced = channel_cache.get(message.id)
+        if replaced is not None:
+            self._forget([replaced])
+        evicted = channel_cache.append(message)
+        self._messages += 1
+        self._bytes += self.sizeof(message)
+        author_key = (message.guild_id, message.author_id)
+        self._authors.setdefault(author_key, {})[message.id] = channel_id
+        if evicted is not None:
+            self._forget([evicted])
+        if self._over_budget():
+            self._enforce_budget()
+
+    def discard(self, channel_id: int, message_id: int) -> AM | None:
+        """
+        Remove a message from the cache, such as when it's been deleted.
+
+        Parameters
+        ----------
+        channel_id : int
+            The ID of the channel where the message lives.
+        message_id : int
+            The ID of the message to remove.
+
+        Returns
+        -------
+        AM | None
+            The message that was removed, if it was cached.
+        """
+
+        channel_cache = self._channels.get(channel_id)
+        if channel_cache is None:
+            return None
+        message = channel_cache.discard(message_id)
+        if message is not None:
+            self._forget([message])
+        return message
+
+    def by_author(self, guild_id: int, author_id: int) -> list[AM]:
+        """
+        Get every cached message that a user has sent in a guild, across all
+        channels.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild.
+        author_id : int
+            The ID of the user.
+
+        Returns
+        -------
+        list[AM]
+            The user's cached messages, oldest first.
+        """
+
+        entries = self._authors.get((guild_id, author_id))
+        if not entries:
+            return []
+        found: list[AM] = []
+        for message_id, channel_id in entries.items():
+            message = self._channels[channel_id].get(message_id)
+            if message is not None:
+                found.append(message)
+        found.sort(key=lambda i: i.id)
+        return found
+
+    def prune(self) -> int:
+        """
+        Drop every channel that hasn't seen a message within the idle time.
+
+        Returns
+        -------
+        int
+            The number of channels that were dropped.
+        """
+
+        cutoff = time.monotonic() - self.idle_after
+        dropped = 0
+        while self._channels:
+            channel_id = next(iter(self._channels))
+            if self._last_active[channel_id] > cutoff:
+                break
+            self._drop_channel(channel_id)
+            dropped += 1
+        return dropped
+
+    def _has_room_for(self, messages: int) -> bool:
+        """
+        Whether the given number of extra messages would fit in the budget.
+        """
+
+        if self._messages + messages > self.max_messages:
+            return False
+        if self.max_bytes is not None and self._messages:
+            average = self._bytes / self._messages
+            return self._bytes + (average * messages) <= self.max_bytes
+        return True
+
+    def _over_budget(self) -> bool:
+        """
+        Whether the cache is currently holding more than it's allowed to.
+        """
+
+        if self._messages > self.max_messages:
+            return True
+        return self.max_bytes is not None and self._bytes > self.max_bytes
+
+    def _enforce_budget(self) -> None:
+        """
+        Shrink or drop the least recently active channels until the cache is
+        back within budget.
+        """
+
+        idle_cutoff = time.monotonic() - self.idle_after
+        while self._over_budget():
+            channel_id, channel_cache = next(iter(self._channels.items()))
+            if len(self._channels) == 1:
+                # Only one channel left, so it's the one that needs to give
+                if len(channel_cache) <= 1:
+                    break
+                self._forget(channel_cache.resize(len(channel_cache) // 2))
+            elif (
+                    len(channel_cache) <= self.channel_min_entries
+                    or self._last_active[channel_id] <= idle_cutoff):
+                self._drop_channel(channel_id)
+            else:
+                # Halving means the cost of the resize is paid for by the
+                # messages it frees up
+                self._forget(channel_cache.resize(max(
+                    len(channel_cache) // 2,
+                    self.channel_min_entries,
+                )))
+
+    def _drop_channel(self, channel_id: int) -> None:
+        """
+        Remove a channel and all of its messages from the cache.
+        """
+
+        channel_cache = self._channels.pop(channel_id)
+        del self._last_active[channel_id]
+        self._forget(channel_cache)
+
+    def _forget(self, messages: Iterable[AM]) -> None:
+        """
+        Update the cache's usage and author index for messages that have
+        been removed.
+        """
+
+        for message in messages:
+            self._messages -= 1
+            self._bytes -= self.sizeof(message)
+            author_key = (message.guild_id, message.author_id)
+            entries = self._authors.get(author_key)
+            if entries is not None:
+                entries.pop(message.id, None)
+                if not entries:
+                    del self._authors[author_key]
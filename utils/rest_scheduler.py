@@ -0,0 +1,272 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import logging
+from enum import IntEnum
+from typing import Any, Coroutine, Literal, NamedTuple, TypeVar
+
+__all__ = (
+    "Priority",
+    "RequestDropped",
+    "RestScheduler",
+    "RestSchedulerStats",
+    "rest_scheduler",
+)
+
+
+log = logging.getLogger("utils.rest_scheduler")
+
+T = TypeVar("T")
+DropPolicy = Literal["oldest", "newest"]
+
+
+class Priority(IntEnum):
+    """
+    How urgent a REST call is. Lower values go first.
+    """
+
+    MODERATION = 0  # bans, timeouts, message purges
+    NORMAL = 1  # things people are waiting on, like reports and reminders
+    LOW = 2  # logs and other chatter, which can be dropped under load
+
+
+class RequestDropped(Exception):
+    """
+    A low priority call was dropped because too many were queued.
+    """
+
+
+class RestSchedulerStats(NamedTuple):
+    """
+    What the REST scheduler is doing, and what it's done. Each count is
+    indexed by :class:`Priority`.
+    """
+
+    in_flight: int
+    queued: tuple[int, ...]
+    completed: tuple[int, ...]
+    failed: tuple[int, ...]
+    dropped: tuple[int, ...]
+
+
+class _Job:
+
+    __slots__ = ("priority", "route", "coro", "future")
+
+    def __init__(
+            self,
+            priority: Priority,
+            route: str,
+            coro: Coroutine[Any, Any, Any]):
+        self.priority = priority
+        self.route = route
+        self.coro = coro
+        self.future: asyncio.Future[Any] = asyncio.get_running_loop().create_future()
+
+
+class RestScheduler:
+    """
+    Decides the order that outbound REST calls go out in, so that
+    moderation isn't stuck behind log traffic during a raid.
+
+    Calls are queued by priority and started highest priority first, with
+    a limit on how many are in flight overall and on each route (such as a
+    single channel's messages). Some of the overall slots are kept free
+    for moderation calls, and low priority calls can only use some of the
+    rest, so that normal calls always have room even while a flood of logs
+    is sat waiting out rate limits. The low priority queue is bounded; once
+    it's full, either the oldest or the newest low priority call is
+    dropped.
+
+    Parameters
+    ----------
+    max_concurrency : int
+        The most calls in flight at once.
+    reserved_for_moderation : int
+        How many of those are only used by moderation calls.
+    low_priority_concurrency : int
+        The most low priority calls in flight at once. This is always kept
+        below the slots that aren't reserved for moderation.
+    route_concurrency : int
+        The most calls in flight on any one route.
+    max_low_priority : int
+        The most low priority calls to keep queued.
+    drop_policy : DropPolicy
+        Whether to drop the ``"oldest"`` queued low priority call or the
+        ``"newest"`` one (the call being made) when the queue is full.
+    """
+
+    def __init__(
+            self,
+            max_concurrency: int = 10,
+            reserved_for_moderation: int = 2,
+            low_priority_concurrency: int = 4,
+            route_concurrency: int = 2,
+            max_low_priority: int = 500,
+            drop_policy: DropPolicy = "oldest"):
+        self.max_concurrency = max_concurrency
+        self.reserved_for_moderation = reserved_for_moderation
+        self.low_priority_concurrency = low_priority_concurrency
+        self.route_concurrency = route_concurrency
+        self.max_low_priority = max_low_priority
+        self.drop_policy = drop_policy
+        self._queues: dict[Priority, collections.deque[_Job]] = {
+            p: collections.deque()
+            for p in Priority
+        }
+        self._routes: collections.Counter[str] = collections.Counter()
+        self._in_flight: int = 0
+        self._in_flight_by_priority = [0] * len(Priority)
+        self._completed = [0] * len(Priority)
+        self._failed = [0] * len(Priority)
+        self._dropped = [0] * len(Priority)
+
+    @property
+    def stats(self) -> RestSchedulerStats:
+        """
+        The current queue sizes and the totals so far.
+        """
+
+        return RestSchedulerStats(
+            in_flight=self._in_flight,
+            queued=tuple(len(self._queues[p]) for p in Priority),
+            completed=tuple(self._completed),
+            failed=tuple(self._failed),
+            dropped=tuple(self._dropped),
+        )
+
+    async def call(
+            self,
+            coro: Coroutine[Any, Any, T],
+            *,
+            priority: Priority = Priority.NORMAL,
+            route: str = "global") -> T:
+        """
+        Make a REST call once the scheduler gets to it.
+
+        Parameters
+        ----------
+        coro : Coroutine
+            The call to make. It isn't started until it's scheduled, and
+            it's closed without being started if it's dropped.
+        priority : Priority
+            How urgent the call is.
+        route : str
+            What the call is rate limited by, such as
+            ``"channels/{id}/messages"``.
+
+        Returns
+        -------
+        T
+            Whatever the call returned.
+
+        Raises
+        ------
+        RequestDropped
+            The call was low priority and was dropped.
+        """
+
+        job = _Job(priority, route, coro)
+        self._enqueue(job)
+        self._pump()
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+
+    def _enqueue(self, job: _Job) -> None:
+        queue = self._queues[job.priority]
+        if job.priority == Priority.LOW and len(queue) >= self.max_low_priority:
+            if self.drop_policy == "newest":
+                self._drop(job)
+                return
+            self._drop(queue.popleft())
+        queue.append(job)
+
+    def _drop(self, job: _Job) -> None:
+        job.coro.close()
+        self._dropped[job.priority] += 1
+        if not job.future.done():
+            job.future.set_exception(RequestDropped(f"Dropped low priority call on {job.route}"))
+        log.warning("Dropped a %s priority REST call on %s", job.priority.name, job.route)
+
+    def _next_job(self) -> _Job | None:
+        """
+        Pop the most urgent job whose route has room, if there's room for
+        it overall.
+        """
+
+        for priority, queue in self._queues.items():
+
+            # Throw away anything whose caller has given up
+            while queue and queue[0].future.done():
+                queue.popleft().coro.close()
+            if not queue:
+                continue
+
+            limit = self.max_concurrency
+            if priority != Priority.MODERATION:
+                limit -= self.reserved_for_moderation
+            if self._in_flight >= limit:
+                return None
+            if priority == Priority.LOW:
+                low_limit = max(1, min(self.low_priority_concurrency, limit - 1))
+                if self._in_flight_by_priority[priority] >= low_limit:
+                    continue
+            for index, job in enumerate(queue):
+                if not job.future.done() and self._routes[job.route] < self.route_concurrency:
+                    del queue[index]
+                    return job
+        return None
+
+    def _pump(self) -> None:
+        while self._in_flight < self.max_concurrency:
+            job = self._next_job()
+            if job is None:
+                return
+            self._in_flight += 1
+            self._in_flight_by_priority[job.priority] += 1
+            self._routes[job.route] += 1
+            task = asyncio.ensure_future(job.coro)
+            task.add_done_callback(lambda t, job=job: self._finished(job, t))
+
+    def _finished(self, job: _Job, task: asyncio.Future[Any]) -> None:
+        self._in_flight -= 1
+        self._in_flight_by_priority[job.priority] -= 1
+        self._routes[job.route] -= 1
+        if self._routes[job.route] <= 0:
+            del self._routes[job.route]
+        if task.cancelled():
+            self._failed[job.priority] += 1
+            job.future.cancel()
+        elif task.exception() is not None:
+            self._failed[job.priority] += 1
+            if not job.future.done():
+                job.future.set_exception(task.exception())  # pyright: ignore
+        else:
+            self._completed[job.priority] += 1
+            if not job.future.done():
+                job.future.set_result(task.result())
+        self._pump()
+
+
+rest_scheduler = RestScheduler()
@@ -0,0 +1,57 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+from .rest_scheduler import rest_scheduler
+from .webhook_pool import webhook_pool
+
+__all__ = (
+    "configure_rest",
+)
+
+
+def configure_rest(config: Any) -> None:
+    """
+    Apply the REST scheduler limits and the webhook pool size from the
+    bot's config. Anything missing from the config keeps its default.
+
+    Parameters
+    ----------
+    config : Any
+        The bot's config.
+    """
+
+    webhook_pool.per_channel = getattr(
+        config,
+        "log_webhooks_per_channel",
+        webhook_pool.per_channel,
+    )
+    for key in (
+            "max_concurrency",
+            "reserved_for_moderation",
+            "low_priority_concurrency",
+            "route_concurrency",
+            "max_low_priority",
+            "drop_policy"):
+        setattr(
+            rest_scheduler,
+            key,
+            getattr(config, f"rest_{key}", getattr(rest_scheduler, key)),
+        )
@@ -17,7 +17,7 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
 
-from datetime import timedelta, datetime as dt
+from datetime import timedelta, timezone, datetime as dt
 import re
 
 from novus.utils import utcnow, parse_timestamp
@@ -25,9 +25,58 @@ from novus.utils import utcnow, parse_timestamp
 
 __all__ = (
     "get_datetime_until",
+    "datetime_to_snowflake",
+    "snowflake_to_datetime",
 )
 
 
+DISCORD_EPOCH = 1_420_070_400_000
+
+
+def snowflake_to_datetime(snowflake: int) -> dt:
+    """
+    Get the time that a snowflake was created at.
+
+    Parameters
+    ----------
+    snowflake : int
+        The snowflake ID.
+
+    Returns
+    -------
+    datetime.datetime
+        The (UTC) time the snowflake was created.
+    """
+
+    timestamp = ((snowflake >> 22) + DISCORD_EPOCH) / 1_000
+    return dt.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+def datetime_to_snowflake(time: dt, *, high: bool = False) -> int:
+    """
+    Get a snowflake for a given time, suitable for comparing against real
+    snowflakes.
+
+    Parameters
+    ----------
+    time : datetime.datetime
+        The time to convert. Naive datetimes are treated as UTC.
+    high : bool
+        Whether to return the largest possible snowflake for the time rather
+        than the smallest.
+
+    Returns
+    -------
+    int
+        The snowflake for the given time.
+    """
+
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=timezone.utc)
+    milliseconds = int(time.timestamp() * 1_000) - DISCORD_EPOCH
+    return (milliseconds << 22) + ((1 << 22) - 1 if high else 0)
+
+
 def get_datetime_until(time: str, default_days: int | None = 28) -> timedelta:
     """
     Parse a duration string. If no duration qualifier is given, the default is days.
@@ -0,0 +1,276 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Literal
+
+import novus
+
+from .guild_settings import guild_settings
+from .rest_scheduler import Priority, rest_scheduler
+
+__all__ = (
+    "WebhookColumn",
+    "WebhookPool",
+    "WebhookUnavailable",
+    "webhook_pool",
+)
+
+
+log = logging.getLogger("utils.webhook_pool")
+
+WebhookColumn = Literal["message_webhook_ids", "report_webhook_ids"]
+
+
+class WebhookUnavailable(Exception):
+    """
+    A channel's webhooks couldn't be fetched or made, so messages for it
+    should be sent some other way.
+    """
+
+
+class WebhookPool:
+    """
+    Sends messages to a channel through a few of the bot's own webhooks,
+    taking turns between them. Each webhook has its own rate limit, so a
+    busy log channel isn't held back by the bot user's limit for it.
+
+    Webhooks are made the first time they're needed and their IDs are kept
+    in the guild's settings so that they're reused after a restart; their
+    tokens are only ever held in memory, and are got back by fetching the
+    channel's webhooks. If that fails (the bot can't manage webhooks, or the
+    channel already has as many as Discord allows), the channel isn't tried
+    again for a while.
+
+    Parameters
+    ----------
+    per_channel : int
+        How many webhooks to use for each channel.
+    name : str
+        The name to give new webhooks.
+    retry_after : float
+        How many seconds to wait before trying to load a channel's webhooks
+        again after it failed.
+    """
+
+    def __init__(
+            self,
+            per_channel: int = 2,
+            name: str = "VoxelMod",
+            retry_after: float = 60 * 10):
+        self.per_channel = per_channel
+        self.name = name
+        self.retry_after = retry_after
+        self._webhooks: dict[int, list[novus.Webhook]] = {}
+        self._turns: dict[int, int] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._unavailable: dict[int, float] = {}
+
+    def size(self, channel_id: int) -> int:
+        """
+        How many webhooks are ready to use for a channel.
+        """
+
+        return len(self._webhooks.get(channel_id, ()))
+
+    def forget(self, channel_id: int) -> None:
+        """
+        Drop the cached webhooks for a channel, so that they're fetched (or
+        made) again next time.
+        """
+
+        self._webhooks.pop(channel_id, None)
+        self._turns.pop(channel_id, None)
+        self._unavailable.pop(channel_id, None)
+
+    async def retire(
+            self,
+            state: novus.api.HTTPConnection,
+            channel_id: int,
+            guild_id: int,
+            column: WebhookColumn) -> None:
+        """
+        Stop using a channel's webhooks and delete them, for when the guild
+        moves its logs or reports to another channel.
+
+        Parameters
+        ----------
+        state : novus.api.HTTPConnection
+            The connection to make requests with.
+        channel_id : int
+            The ID of the channel that the webhooks are in.
+        guild_id : int
+            The ID of the guild the channel is in.
+        column : WebhookColumn
+            The guild setting that the channel's webhook IDs are kept in.
+        """
+
+        self.forget(channel_id)
+        settings = await guild_settings.get(guild_id)
+        known_ids: list[int] = getattr(settings, column) or []
+        if not known_ids:
+            return
+        await guild_settings.set(guild_id, column, [])
+
+        # Losing track of them is fine if they can't be deleted; they'd just
+        # be left sitting in the old channel
+        channel = novus.Channel.partial(state, channel_id)
+        try:
+            existing = await rest_scheduler.call(
+                channel.fetch_webhooks(),
+                route=f"channels/{channel_id}/webhooks",
+            )
+            for webhook in existing:
+                if webhook.id not in known_ids:
+                    continue
+                await rest_scheduler.call(
+                    webhook.delete(),
+                    route=f"webhooks/{webhook.id}",
+                )
+        except novus.HTTPException:
+            log.info("Couldn't delete the old webhooks for channel %s", channel_id, exc_info=True)
+
+    async def _load(
+            self,
+            channel: novus.Channel,
+            guild_id: int,
+            column: WebhookColumn) -> list[novus.Webhook]:
+        """
+        Find the channel's webhooks from the guild settings, making any that
+        are missing.
+        """
+
+        lock = self._locks.setdefault(channel.id, asyncio.Lock())
+        async with lock:
+            if channel.id in self._webhooks:
+                return self._webhooks[channel.id]
+            if self._unavailable.get(channel.id, 0) > time.monotonic():
+                raise WebhookUnavailable(f"Webhooks for channel {channel.id} recently failed")
+            try:
+                return await self._load_uncached(channel, guild_id, column)
+            except novus.HTTPException as e:
+                self._unavailable[channel.id] = time.monotonic() + self.retry_after
+                raise WebhookUnavailable(f"Couldn't load webhooks for channel {channel.id}") from e
+
+    async def _load_uncached(
+            self,
+            channel: novus.Channel,
+            guild_id: int,
+            column: WebhookColumn) -> list[novus.Webhook]:
+        """
+        Fetch and make the channel's webhooks, without the lock or any of
+        the error handling.
+        """
+
+        settings = await guild_settings.get(guild_id)
+        known_ids: list[int] = getattr(settings, column) or []
+
+        # Get back the tokens for the webhooks that we already made
+        existing = await rest_scheduler.call(
+            channel.fetch_webhooks(),
+            route=f"channels/{channel.id}/webhooks",
+        )
+        webhooks = [
+            w for w in existing
+            if w.id in known_ids and w.token
+        ][:self.per_channel]
+
+        # Make up the numbers, making do with what we have if the channel
+        # is full of other webhooks
+        while len(webhooks) < self.per_channel:
+            try:
+                webhooks.append(await rest_scheduler.call(
+                    channel.create_webhook(name=self.name),
+                    route=f"channels/{channel.id}/webhooks",
+                ))
+            except novus.HTTPException:
+                if not webhooks:
+                    raise
+                log.info(
+                    "Only using %s webhooks for channel %s",
+                    len(webhooks), channel.id, exc_info=True,
+                )
+                break
+
+        # Save the IDs if they've changed
+        ids = [w.id for w in webhooks]
+        if ids != known_ids:
+            await guild_settings.set(guild_id, column, ids)
+        self._webhooks[channel.id] = webhooks
+        return webhooks
+
+    async def send(
+            self,
+            channel: novus.Channel,
+            guild_id: int,
+            column: WebhookColumn,
+            *,
+            priority: Priority = Priority.NORMAL,
+            make_files: Callable[[], list[novus.File]] | None = None,
+            **kwargs: Any) -> None:
+        """
+        Send a message to a channel through the next webhook in its pool.
+
+        Parameters
+        ----------
+        channel : novus.Channel
+            The channel to send to.
+        guild_id : int
+            The ID of the guild the channel is in.
+        column : WebhookColumn
+            The guild setting that the channel's webhook IDs are kept in.
+        priority : Priority
+            How urgent the message is.
+        make_files : Callable[[], list[novus.File]] | None
+            Makes the files to attach. It's called again for a retry, since
+            files can only be read once.
+        **kwargs : Any
+            Passed to the webhook's ``send``.
+
+        Raises
+        ------
+        WebhookUnavailable
+            The channel's webhooks couldn't be fetched or made.
+        """
+
+        for attempt in range(2):
+            webhooks = self._webhooks.get(channel.id) or await self._load(channel, guild_id, column)
+            turn = self._turns.get(channel.id, 0)
+            self._turns[channel.id] = turn + 1
+            webhook = webhooks[turn % len(webhooks)]
+            try:
+                if make_files is not None:
+                    kwargs["files"] = make_files()
+                await rest_scheduler.call(
+                    webhook.send(**kwargs),
+                    priority=priority,
+                    route=f"webhooks/{webhook.id}",
+                )
+                return
+            except novus.NotFound as e:
+                # Someone deleted the webhook; make a new one and try again
+                log.info("Webhook %s for channel %s has gone", webhook.id, channel.id)
+                self.forget(channel.id)
+                if attempt:
+                    raise WebhookUnavailable(f"Webhooks for channel {channel.id} keep going missing") from e
+
+
+webhook_pool = WebhookPool()